@@ -0,0 +1,285 @@
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import time
+
+import boto3
+import requests
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+from client import validate_args
+
+s3 = boto3.client('s3', region_name='us-east-1')
+dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+bucket_name = 'render-files-bucket'
+job_table_name = 'JobTable'
+
+# Scenes go up in parallel multipart uploads; the part size also fixes the ETag S3 gives the object
+PART_SIZE = 16 * 1024 ** 2
+PART_THREADS = 8
+UPLOAD_FILES = 4
+SUBMIT_REQUESTS = 16
+# DynamoDB's limit on the keys in one BatchGetItem request
+BATCH_GET_KEYS = 100
+# Status polls back off while no job makes progress
+POLL_MIN_SECONDS = 2
+POLL_MAX_SECONDS = 30
+# Job statuses that won't change again
+FINISHED = ('Complete', 'Failed')
+
+transfer_config = TransferConfig(multipart_threshold=PART_SIZE, multipart_chunksize=PART_SIZE,
+                                 max_concurrency=PART_THREADS)
+
+
+def job_id(filename, start_frame, end_frame):
+    """The server's id for a file and frame range."""
+    return '%s_%d-%d' % (filename[:-6], int(start_frame), int(end_frame))
+
+
+def read_jobs(path):
+    """
+    Reads a jobs file with one job per line: <file> <start_frame> <end_frame> [priority].
+
+    Blank lines and lines starting with # are skipped.
+    """
+    jobs = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            if len(fields) not in (3, 4):
+                raise ValueError(f'{path}:{number}: expected <file> <start_frame> <end_frame> [priority]')
+            filename, start, end = fields[:3]
+            validate_args(filename, start, end)
+            jobs.append({'file': filename, 'start': start, 'end': end,
+                         'priority': fields[3] if len(fields) > 3 else None})
+    return jobs
+
+
+def file_hashes(path, part_size=PART_SIZE):
+    """
+    Returns the file's SHA-256 and the ETag S3 gives it when uploaded with transfer_config, in one read.
+
+    Objects under the part size are uploaded whole, with the MD5 of their contents as the ETag; larger ones
+    get the MD5 of their parts' MD5s, suffixed with the number of parts.
+    """
+    digest = hashlib.sha256()
+    parts = []
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(part_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            parts.append(hashlib.md5(chunk).digest())
+    if os.path.getsize(path) < part_size:
+        etag = (parts[0] if parts else hashlib.md5().digest()).hex()
+    else:
+        etag = '%s-%d' % (hashlib.md5(b''.join(parts)).hexdigest(), len(parts))
+    return digest.hexdigest(), '"' + etag + '"'
+
+
+def upload_scene(path, key):
+    """
+    Uploads the file unless the bucket already has the same contents under the key. Returns True if it uploaded.
+
+    Matching contents are found by the SHA-256 this client stores in the object's metadata, or by the ETag for
+    files uploaded some other way. Skipping the upload also keeps the object's ETag, and with it the render cache
+    entries of scenes that use the file.
+    """
+    sha256, etag = file_hashes(path)
+    try:
+        head = s3.head_object(Bucket=bucket_name, Key=key)
+        if head.get('Metadata', dict()).get('sha256') == sha256 or head['ETag'] == etag:
+            return False
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+            raise
+    s3.upload_file(path, bucket_name, key, ExtraArgs={'Metadata': {'sha256': sha256}}, Config=transfer_config)
+    return True
+
+
+def submit_request(url, job):
+    data = {key: value for key, value in job.items() if value is not None}
+    r = requests.post(url, json=data)
+    return r.status_code, r.text
+
+
+def get_statuses(jobs):
+    """Reads the JobTable items of the jobs, BATCH_GET_KEYS at a time, retrying any keys DynamoDB leaves unread."""
+    items = dict()
+    for i in range(0, len(jobs), BATCH_GET_KEYS):
+        request = {job_table_name: {
+            'Keys': [{'job': job} for job in jobs[i:i + BATCH_GET_KEYS]],
+            'ProjectionExpression': '#job, job_status, n_batches, remaining',
+            'ExpressionAttributeNames': {'#job': 'job'}
+        }}
+        for attempt in range(8):
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response['Responses'].get(job_table_name, []):
+                items[item['job']] = item
+            request = response.get('UnprocessedKeys')
+            if not request:
+                break
+            time.sleep(min(POLL_MAX_SECONDS, 0.1 * 2 ** attempt))
+    return items
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return '--:--:--'
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class JobProgress:
+    """
+    A job's progress from its JobTable item, with an ETA from its batch completion rate since submission.
+
+    Batches are assumed to take about as long as each other, so the ETA is rough for jobs split by render time.
+    """
+
+    def __init__(self, job, submitted):
+        self.job = job
+        self.submitted = submitted
+        self.status = 'Submitting'
+        self.done = 0
+        self.total = 0
+        self.finished = None
+
+    def update(self, item, now):
+        """Returns True if the job has moved on since the last update."""
+        status = item['job_status']
+        total = int(item['n_batches'])
+        done = total - int(item['remaining'])
+        if status == 'Processing':
+            status = 'Sequencing'
+        elif status == 'Waiting':
+            status = 'Rendering'
+        if status in FINISHED and self.finished is None:
+            self.finished = now
+        changed = (status, done) != (self.status, self.done)
+        self.status, self.done, self.total = status, done, total
+        return changed
+
+    def eta(self, now):
+        if self.status in FINISHED:
+            return 0
+        if self.total == 0 or self.done == 0:
+            return None
+        return (now - self.submitted) * (self.total - self.done) / self.done
+
+    def line(self, now):
+        elapsed = (self.finished or now) - self.submitted
+        percent = 100 * self.done / self.total if self.total else 100 if self.status == 'Complete' else 0
+        return '%-32s %-11s %5d/%-5d %6.1f%%  elapsed %s  ETA %s' % (
+            self.job, self.status, self.done, self.total, percent, format_seconds(elapsed),
+            format_seconds(self.eta(now)))
+
+
+def render_view(progress, failed, now, previous_lines=0):
+    """Draws one line per job and a total, redrawn in place on a terminal. Returns the number of lines drawn."""
+    lines = [p.line(now) for p in progress.values()]
+    lines += ['%-32s Failed      %s' % (job, message) for job, message in failed.items()]
+    done = sum(p.done for p in progress.values())
+    total = sum(p.total for p in progress.values())
+    etas = [p.eta(now) for p in progress.values()]
+    eta = None if None in etas else max(etas, default=0)
+    complete = sum(p.status == 'Complete' for p in progress.values())
+    lines.append('%-32s %-11s %5d/%-5d batches, %d/%d jobs complete  ETA %s' % (
+        'all jobs', '', done, total, complete, len(progress) + len(failed), format_seconds(eta)))
+    if sys.stdout.isatty() and previous_lines:
+        sys.stdout.write('\x1b[%dF\x1b[J' % previous_lines)
+    sys.stdout.write('\n'.join(lines) + '\n')
+    sys.stdout.flush()
+    return len(lines)
+
+
+async def submit_all(url, jobs, scenes):
+    """
+    Uploads each job's scene once and submits the job as soon as its scene is in the bucket.
+
+    Returns the JobProgress of each submitted job and an error message for each job that could not be submitted.
+    """
+    upload_slots = asyncio.Semaphore(UPLOAD_FILES)
+    submit_slots = asyncio.Semaphore(SUBMIT_REQUESTS)
+    progress = dict()
+    failed = dict()
+
+    async def upload(filename):
+        path = os.path.join(scenes, filename)
+        if not os.path.exists(path):
+            print(f'{filename} is not in {scenes}, assuming it is already in the bucket')
+            return
+        async with upload_slots:
+            started = time.time()
+            uploaded = await asyncio.to_thread(upload_scene, path, filename)
+        if uploaded:
+            print('Uploaded %s (%d bytes) in %.1f s' % (filename, os.path.getsize(path), time.time() - started))
+        else:
+            print(f'{filename} is unchanged in the bucket, not uploading')
+
+    uploads = {filename: asyncio.create_task(upload(filename)) for filename in {job['file'] for job in jobs}}
+
+    async def submit(job):
+        name = job_id(job['file'], job['start'], job['end'])
+        try:
+            await uploads[job['file']]
+            async with submit_slots:
+                submitted = time.time()
+                status_code, text = await asyncio.to_thread(submit_request, url, job)
+        except Exception as e:
+            failed[name] = str(e)
+            return
+        if status_code != 200:
+            failed[name] = text
+        else:
+            progress[name] = JobProgress(name, submitted)
+
+    await asyncio.gather(*(submit(job) for job in jobs))
+    return progress, failed
+
+
+async def poll(progress, failed):
+    """Polls the jobs' status until every job has finished, backing off while none of them moves on."""
+    interval = POLL_MIN_SECONDS
+    lines = 0
+    while True:
+        items = await asyncio.to_thread(get_statuses, [job for job, p in progress.items() if p.status not in FINISHED])
+        now = time.time()
+        changed = [p.update(items[job], now) for job, p in progress.items() if job in items]
+        lines = render_view(progress, failed, now, lines)
+        if all(p.status in FINISHED for p in progress.values()):
+            return
+        interval = POLL_MIN_SECONDS if any(changed) else min(POLL_MAX_SECONDS, interval * 2)
+        await asyncio.sleep(interval)
+
+
+async def run(url, jobs, scenes, wait=True):
+    progress, failed = await submit_all(url, jobs, scenes)
+    if wait and progress:
+        await poll(progress, failed)
+    else:
+        render_view(progress, failed, time.time())
+    return not failed and all(p.status != 'Failed' for p in progress.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Upload scenes and submit many render jobs, then follow them')
+    parser.add_argument('server_url')
+    parser.add_argument('jobs', help='file with one job per line: <file> <start_frame> <end_frame> [priority]')
+    parser.add_argument('--scenes', default='.', help='directory of the .blend files to upload')
+    parser.add_argument('--no-wait', action='store_true', help='exit once the jobs are submitted')
+    args = parser.parse_args()
+
+    jobs = read_jobs(args.jobs)
+    if not asyncio.run(run(args.server_url, jobs, args.scenes, not args.no_wait)):
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,8 +12,10 @@ def validate_args(file, start, end):
     return
 
 
-def submit_request(url, file, start, end):
+def submit_request(url, file, start, end, priority=None):
     data = {'file': file, 'start': start, 'end': end}
+    if priority is not None:
+        data['priority'] = priority
     try:
         r = requests.post(url, json=data)
     except Exception as e:
@@ -28,15 +30,17 @@ def main():
         print('\tfilename')
         print('\tstart_frame')
         print('\tend_frame')
+        print('\t[priority: high, normal or low]')
         exit(1)
 
     server_url = sys.argv[1]
     filename = sys.argv[2]
     start_frame = sys.argv[3]
     end_frame = sys.argv[4]
+    priority = sys.argv[5] if len(sys.argv) > 5 else None
 
     validate_args(filename, start_frame, end_frame)
-    result = submit_request(server_url, filename, start_frame, end_frame)
+    result = submit_request(server_url, filename, start_frame, end_frame, priority)
     print(result)
 
 
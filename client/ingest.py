@@ -0,0 +1,127 @@
+import hashlib
+import os
+
+import pandas as pd
+
+CACHE_DIR = '.farm_cache'
+SPAN_PATTERN = (r'^Span (?P<stage>\S+) job=(?P<job>\S*) batch=(?P<batch>\S*) '
+                r'duration=(?P<duration>[0-9.]+) bytes=(?P<bytes>\d+)$')
+EVENT_PATTERN = r'^(?P<event>Span|Rendered|Sequenced|Downloaded|Uploaded|Encoded|Submitted|Cache|Started)'
+AGE_PATTERN = r'^(?:(?P<h>\d+)h)?(?:(?P<m>\d+)m)?(?:(?P<s>\d+)s)?$'
+
+
+def _cache_path(kind: str, paths: list) -> str:
+    """Cache file for the given sources, keyed on their paths, sizes and modification times."""
+    key = hashlib.sha256()
+    for path in sorted(paths):
+        stat = os.stat(path)
+        key.update(f'{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode('utf-8'))
+    return os.path.join(CACHE_DIR, f'{kind}-{key.hexdigest()[:16]}')
+
+
+def _cached(kind: str, paths: list, load):
+    """Reads the table from the columnar cache, building it with load() on a miss."""
+    path = _cache_path(kind, paths)
+    try:
+        import pyarrow  # noqa: F401
+        path, read, write = path + '.parquet', pd.read_parquet, pd.DataFrame.to_parquet
+    except ImportError:
+        path, read, write = path + '.pkl', pd.read_pickle, pd.DataFrame.to_pickle
+    if os.path.exists(path):
+        return read(path)
+    df = load()
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    write(df, path)
+    return df
+
+
+def _load_worker_logs(paths: list) -> pd.DataFrame:
+    frames = []
+    for path in paths:
+        df = pd.read_csv(path, header=None, names=['timestamp', 'status'], skiprows=1, on_bad_lines='skip',
+                         dtype={'timestamp': 'string', 'status': 'string'})
+        df['worker'] = os.path.splitext(os.path.basename(path))[0]
+        frames.append(df)
+    df = pd.concat(frames, ignore_index=True)
+    df['timestamp'] = pd.to_numeric(df['timestamp'], errors='coerce')
+    df = df.dropna(subset=['timestamp', 'status'])
+
+    df['event'] = df['status'].str.extract(EVENT_PATTERN)['event'].fillna('Other')
+    spans = df['status'].str.extract(SPAN_PATTERN)
+    df['stage'] = spans['stage']
+    df['job'] = spans['job']
+    df['batch'] = spans['batch']
+    df['duration'] = pd.to_numeric(spans['duration'])
+    df['bytes'] = pd.to_numeric(spans['bytes']).astype('Int64')
+    for column in ['worker', 'event', 'stage', 'job', 'batch']:
+        df[column] = df[column].astype('category')
+    return df.sort_values('timestamp', ignore_index=True)
+
+
+def load_worker_logs(paths: list) -> pd.DataFrame:
+    """
+    Loads worker CSV logs into one typed table, one row per log line.
+
+    Span lines are split into stage, job, batch, duration and bytes columns. Results are cached in CACHE_DIR and
+    reused until a source file changes.
+    """
+    return _cached('worker', paths, lambda: _load_worker_logs(paths))
+
+
+def _load_hpa(path: str) -> pd.DataFrame:
+    df = pd.read_csv(path, sep=r'\s+', dtype='string', engine='python', on_bad_lines='skip')
+    df = df[df['NAME'] != 'NAME']
+    age = df['AGE'].str.extract(AGE_PATTERN).astype('float').fillna(0)
+    return pd.DataFrame({
+        'cpu': pd.to_numeric(df['TARGETS'].str.extract(r'^(\d+)%')[0]),
+        'replicas': pd.to_numeric(df['REPLICAS']),
+        'minutes': age['h'] * 60 + age['m'] + age['s'] / 60,
+    }).dropna(subset=['cpu']).reset_index(drop=True)
+
+
+def load_hpa(path: str = 'hpa_logs.txt') -> pd.DataFrame:
+    """Loads the samples written by hpa_logger.py into a table of cpu, replicas and age in minutes."""
+    return _cached('hpa', [path], lambda: _load_hpa(path))
+
+
+def throughput(logs: pd.DataFrame, start: float, bucket: float = 60) -> pd.Series:
+    """Render and sequence events completed in each time bucket since start, including empty buckets."""
+    done = logs[logs['event'].isin(['Rendered', 'Sequenced'])]
+    buckets = ((done['timestamp'] - start) // bucket).astype('int64')
+    counts = buckets.value_counts().sort_index()
+    if counts.empty:
+        return counts
+    return counts.reindex(range(0, counts.index.max() + 2), fill_value=0)
+
+
+def stage_percentiles(logs: pd.DataFrame, percentiles=(0.5, 0.9, 0.99)) -> pd.DataFrame:
+    """Duration percentiles, span count and bytes moved for each stage."""
+    spans = logs.dropna(subset=['stage'])
+    grouped = spans.groupby('stage', observed=True)
+    table = grouped['duration'].quantile(list(percentiles)).unstack()
+    table.columns = [f'p{int(p * 100)}' for p in percentiles]
+    table['count'] = grouped.size()
+    table['bytes'] = grouped['bytes'].sum()
+    return table
+
+
+def pod_utilisation(logs: pd.DataFrame) -> pd.DataFrame:
+    """Fraction of each worker's logged lifetime spent rendering."""
+    grouped = logs.groupby('worker', observed=True)
+    lifetime = grouped['timestamp'].max() - grouped['timestamp'].min()
+    rendering = logs[logs['stage'] == 'render'].groupby('worker', observed=True)['duration'].sum()
+    table = pd.DataFrame({'lifetime': lifetime, 'rendering': rendering}).fillna(0)
+    table['utilisation'] = table['rendering'] / table['lifetime'].where(table['lifetime'] > 0)
+    return table
+
+
+def queue_wait(logs: pd.DataFrame, submitted: float) -> pd.Series:
+    """
+    Seconds between the job's submission and each batch starting to download, indexed by job and batch.
+
+    A batch's start is the beginning of its first span, so this includes any time spent waiting for a free pod.
+    """
+    spans = logs.dropna(subset=['batch'])
+    spans = spans[spans['batch'] != '']
+    started = (spans['timestamp'] - spans['duration']).groupby([spans['job'], spans['batch']], observed=True).min()
+    return (started - submitted).sort_values()
@@ -1,47 +1,160 @@
+import argparse
 import os
+import re
 import shutil
 import subprocess
-import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-BLENDER_PATH = "/Applications/Blender.app/Contents/MacOS/Blender"
+BLENDER_PATH = os.environ.get('BLENDER_PATH') or shutil.which('blender') or \
+    "/Applications/Blender.app/Contents/MacOS/Blender"
+# The server's batch size for files without render time history
+JOB_SIZE = 3
+# Blender threads per render, unless --threads is given; the renders share the machine's cores
+RENDER_THREADS = 4
 
+SAVED_PATTERN = re.compile(r"Saved: '(.+)'")
 
-def main(blender_file, start, end):
+# The same codec parameters as the farm's workers, so segments can be concatenated by stream copy
+FRAMERATE = '24'
+RESOLUTION = '1920x1080'
+ENCODE_OPTIONS = ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-r', FRAMERATE, '-s', RESOLUTION]
+
+
+class TimingLog:
+    """Collects events and timing spans in the worker CSV log format, so ingest.py reads local and farm runs alike."""
+
+    def __init__(self, job: str):
+        self.job = job
+        self.lock = threading.Lock()
+        self.lines = ['timestamp,status\n']
+
+    def event(self, status: str):
+        with self.lock:
+            self.lines.append(f'{time.time()},{status}\n')
+
+    def span(self, stage: str, start: float, batch: str = '', nbytes: int = 0):
+        end = time.time()
+        with self.lock:
+            self.lines.append(f'{end},Span {stage} job={self.job} batch={batch} duration={end - start:.3f} '
+                              f'bytes={nbytes}\n')
+
+    def write(self, path: str):
+        with open(path, 'w') as f:
+            f.write(''.join(self.lines))
+
+
+def split_range(start: int, end: int, size: int = JOB_SIZE) -> list:
+    """Splits the frame range into (start, end) batches of size frames, like the server does without history."""
+    return [(s, min(s + size - 1, end)) for s in range(start, end + 1, size)]
+
+
+def render_batch(blender_file: str, output_path: str, start: int, end: int, threads: int, log: TimingLog) -> list:
+    """
+    Renders the batch's frames with its own Blender process and returns their paths in frame order.
+
+    The first frame's span also covers Blender starting and loading the scene, so it is logged as 'first_frame', the
+    stage the farm's workers log it under.
+    """
+    batch = f'{start}-{end}'
+    command = [BLENDER_PATH, '-b', blender_file, '-E', 'CYCLES', '-t', str(threads), '-o', output_path,
+               '-s', str(start), '-e', str(end), '-a']
+    started = last = time.time()
+    frames = []
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    for line in process.stdout:
+        match = SAVED_PATTERN.search(line)
+        if match:
+            frames.append(match.group(1))
+            log.span('frame' if len(frames) > 1 else 'first_frame', last, batch)
+            last = time.time()
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    log.span('render', started, batch)
+    log.event(f'Rendered animation {blender_file} frames {start} to {end}')
+    return frames
+
+
+def encode_segment(frames: list, output_file: str, batch: str, log: TimingLog):
+    """Encodes a batch's frames into a video segment, piping them into ffmpeg in frame order."""
+    started = time.time()
+    command = ['ffmpeg', '-y', '-f', 'image2pipe', '-r', FRAMERATE, '-s', RESOLUTION, '-i', '-', *ENCODE_OPTIONS,
+               output_file]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    for path in frames:
+        with open(path, 'rb') as f:
+            process.stdin.write(f.read())
+    process.stdin.close()
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+    log.span('encode_segment', started, batch, os.path.getsize(output_file))
+
+
+def concat(segment_files: list, output_file: str):
+    """Joins the segments into one video with the concat demuxer."""
+    list_file = output_file + '.txt'
+    with open(list_file, 'w') as f:
+        for segment in segment_files:
+            f.write(f"file '{os.path.abspath(segment)}'\n")
+    try:
+        subprocess.run(['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_file, '-c', 'copy', output_file],
+                       check=True)
+    finally:
+        os.remove(list_file)
+
+
+def main(blender_file, start, end, renders=None, threads=None, batch_size=JOB_SIZE, log_file='local.csv'):
+    """
+    Renders the range on this machine, with several Blender processes at once, and sequences it into an mp4.
+
+    renders: concurrent Blender processes, by default one per RENDER_THREADS cores
+    threads: Blender threads for each process, by default the cores shared out between the processes
+    Each batch is encoded into a segment as soon as it has rendered, while later batches are still rendering.
+    """
+    cores = os.cpu_count() or 1
+    renders = renders or max(1, cores // RENDER_THREADS)
+    threads = threads or max(1, cores // renders)
     filename = blender_file[:-6]
-    directory = blender_file[:-6] + '/'
+    directory = filename + '/'
     output_path = directory + filename
     os.mkdir(directory)
-    log = 'timestamp,status\n'
-
-    # Render the file into PNG frames
-    for i in range(int(start), int(end)+1, 3):
-        command = [BLENDER_PATH, '-b', blender_file, '-E', 'CYCLES', '-o', output_path, '-s', str(i), '-e', str(min(i+2, int(end))), '-a']
-        subprocess.run(command, check=True)
-        log += str(time.time()) + f",Rendered animation {blender_file} frames {start} to {end}\n"
-
-    # Sequence the frames into an MP4 video
-    framerate = '24'
-    resolution = '1920x1080'
-    file_template = output_path + '%04d.png'
-    output_file = filename + '.mp4'
-    command = ['ffmpeg',
-               '-r', framerate,
-               '-s', resolution,
-               '-i', file_template,
-               output_file]
-    subprocess.run(command, check=True)
-    log += str(time.time()) + f",Sequenced {blender_file}\n"
+    log = TimingLog(f'{filename}_{start}-{end}')
+    log.event(f'Started rendering {blender_file} with {renders} processes of {threads} threads')
+
+    batches = split_range(int(start), int(end), batch_size)
+    segments = [directory + 'segment_%04d_%04d.mp4' % batch for batch in batches]
+    started = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=renders) as render_pool, ThreadPoolExecutor(max_workers=1) as encode_pool:
+            def render_and_encode(batch, segment):
+                frames = render_batch(blender_file, output_path, *batch, threads, log)
+                return encode_pool.submit(encode_segment, frames, segment, '%d-%d' % batch, log)
 
-    # Cleanup the PNG files directory
-    shutil.rmtree(filename + '/')
+            encodes = list(render_pool.map(render_and_encode, batches, segments))
+            for encode in encodes:
+                encode.result()
 
-    with open('local.csv', 'w') as f:
-        f.write(log)
+        # Join the segments into the MP4 video
+        sequenced = time.time()
+        concat(segments, filename + '.mp4')
+        log.span('sequence', sequenced)
+        log.event(f'Sequenced {blender_file}')
+        log.span('job', started)
+    finally:
+        # Cleanup the PNG files directory
+        shutil.rmtree(directory)
+        log.write(log_file)
 
 
 if __name__ == '__main__':
-    file_arg = sys.argv[1]
-    start_arg = sys.argv[2]
-    end_arg = sys.argv[3]
-    main(file_arg, start_arg, end_arg)
+    parser = argparse.ArgumentParser(description='Render a .blend file on this machine, as a baseline for the farm')
+    parser.add_argument('file')
+    parser.add_argument('start')
+    parser.add_argument('end')
+    parser.add_argument('--renders', type=int, help='concurrent Blender processes')
+    parser.add_argument('--threads', type=int, help='Blender threads per process')
+    parser.add_argument('--batch-size', type=int, default=JOB_SIZE, help='frames rendered by each process')
+    parser.add_argument('--log', default='local.csv', help='timing log, in the worker log format')
+    args = parser.parse_args()
+    main(args.file, args.start, args.end, args.renders, args.threads, args.batch_size, args.log)
@@ -0,0 +1,113 @@
+"""
+boto3 clients and resources shared by the Lambda functions and the worker, created on first use.
+
+Importing this module, or a module that declares its clients with it, makes no AWS calls: each client is created
+when something first uses it, from one session with one connection pool per service, and then reused for the rest
+of the process (or warm Lambda container). Queue URLs come from SQS_QUEUE_URL_PREFIX when it is set, so a queue
+costs no GetQueueUrl round trip.
+"""
+import os
+import threading
+
+import boto3
+import botocore.exceptions
+from botocore.config import Config
+
+REGION = 'us-east-1'
+# e.g. https://sqs.us-east-1.amazonaws.com/123456789012/
+QUEUE_URL_PREFIX = os.environ.get('SQS_QUEUE_URL_PREFIX', '')
+# Fail fast on a connection that can't be made, and retry throttling and transient errors a few times with backoff;
+# read_timeout stays above the workers' 20 second SQS long polls
+CONFIG = Config(
+    region_name=REGION,
+    connect_timeout=2,
+    read_timeout=30,
+    retries={'mode': 'standard', 'max_attempts': int(os.environ.get('AWS_MAX_ATTEMPTS', '4'))},
+    max_pool_connections=int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '32'))
+)
+
+_lock = threading.RLock()
+_session = None
+_clients = dict()
+_resources = dict()
+_queue_urls = dict()
+
+
+class Lazy:
+    """Stands in for a client, resource, table or queue, creating it on first attribute access."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._target = None
+
+    def _get(self):
+        if self._target is None:
+            with _lock:
+                if self._target is None:
+                    self._target = self._factory()
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+
+def session():
+    global _session
+    with _lock:
+        if _session is None:
+            _session = boto3.session.Session()
+        return _session
+
+
+def client(service: str):
+    with _lock:
+        if service not in _clients:
+            _clients[service] = session().client(service, config=CONFIG)
+        return _clients[service]
+
+
+def resource(service: str):
+    with _lock:
+        if service not in _resources:
+            _resources[service] = session().resource(service, config=CONFIG)
+        return _resources[service]
+
+
+def queue_url(name: str) -> str:
+    """The queue's URL, from QUEUE_URL_PREFIX or else looked up once per process."""
+    if QUEUE_URL_PREFIX:
+        return QUEUE_URL_PREFIX.rstrip('/') + '/' + name
+    with _lock:
+        if name not in _queue_urls:
+            _queue_urls[name] = client('sqs').get_queue_url(QueueName=name)['QueueUrl']
+        return _queue_urls[name]
+
+
+def lazy_client(service: str) -> Lazy:
+    return Lazy(lambda: client(service))
+
+
+def lazy_resource(service: str) -> Lazy:
+    return Lazy(lambda: resource(service))
+
+
+def lazy_table(name: str) -> Lazy:
+    return Lazy(lambda: resource('dynamodb').Table(name))
+
+
+def lazy_queue(name: str) -> Lazy:
+    return Lazy(lambda: resource('sqs').Queue(queue_url(name)))
+
+
+def head_object(bucket: str, key: str):
+    """The object's HEAD response, or None if there is no object with exactly this key."""
+    try:
+        return client('s3').head_object(Bucket=bucket, Key=key)
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+
+def object_exists(bucket: str, key: str) -> bool:
+    return head_object(bucket, key) is not None
@@ -0,0 +1,2 @@
+from .fake_aws import ClientError, FakeAWS
+from .farm import LocalFarm
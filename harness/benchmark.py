@@ -0,0 +1,73 @@
+import argparse
+import time
+
+from .farm import LocalFarm
+
+
+def run(n_frames: int, n_workers: int, frame_seconds: float, timeout: float, preview_frames: int = 0,
+        tiles: int = None, slow_workers: int = 0) -> dict:
+    """
+    Renders one job of n_frames on n_workers and returns its makespan, frame rate and AWS call counts.
+
+    With preview_frames, the job is submitted at low priority and a short preview of another scene is submitted just
+    after it; the preview's latency shows how long a small job waits behind the large one. With tiles, each frame
+    of the job is split into that many tiles. With slow_workers, that many workers render ten times slower.
+    """
+    preview_latency = None
+    with LocalFarm(n_workers, frame_seconds, slow_workers=slow_workers) as farm:
+        farm.upload_scene('benchmark.blend')
+        farm.upload_scene('preview.blend')
+        # Let the worker processes start before the clock does
+        time.sleep(2)
+        started = time.time()
+        job = farm.submit('benchmark.blend', 1, n_frames, 'low' if preview_frames else None, tiles)
+        if preview_frames:
+            time.sleep(frame_seconds * 3)
+            preview_started = time.time()
+            preview = farm.submit('preview.blend', 1, preview_frames)
+            if farm.wait(preview, timeout):
+                preview_latency = time.time() - preview_started
+        finished = farm.wait(job, timeout)
+        makespan = time.time() - started
+        calls = farm.aws.call_counts()
+    return {
+        'frames': n_frames,
+        'workers': n_workers,
+        'finished': finished,
+        'makespan': makespan,
+        'frames_per_second': n_frames / makespan,
+        'preview_latency': preview_latency,
+        'calls': calls,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end throughput benchmark of the farm on fake AWS services')
+    parser.add_argument('--frames', type=int, nargs='+', default=[30])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--frame-seconds', type=float, default=0.05, help='fake render cost per frame')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--preview', type=int, default=0, metavar='FRAMES',
+                        help='also submit a preview of this many frames while the job is rendering')
+    parser.add_argument('--tiles', type=int, help='split each frame of the job into this many tiles')
+    parser.add_argument('--slow-workers', type=int, default=0, help='make this many workers ten times slower')
+    args = parser.parse_args()
+
+    for n_frames in args.frames:
+        for n_workers in args.workers:
+            result = run(n_frames, n_workers, args.frame_seconds, args.timeout, args.preview, args.tiles,
+                         args.slow_workers)
+            status = '' if result['finished'] else ' (DID NOT FINISH)'
+            print(f"--- {n_frames} frames, {n_workers} workers{status} ---")
+            print(f"makespan:   {result['makespan']:.2f} s")
+            print(f"throughput: {result['frames_per_second']:.2f} frames/s")
+            if args.preview:
+                latency = result['preview_latency']
+                print('preview:    ' + ('did not finish' if latency is None else f'{latency:.2f} s'))
+            print(f"API calls:  {sum(result['calls'].values())}")
+            for operation, count in sorted(result['calls'].items()):
+                print(f'  {operation:40s} {count}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import time
+
+from .fake_aws import FakeAWS
+from .fake_boto3 import install
+from .farm import ROOT, load_component
+
+HANDLERS = {
+    'server': ('server', 'lambda_server.py'),
+    'watcher': ('watcher', 'lambda_watcher.py'),
+    'logger': ('logger', 'lambda_logger.py'),
+}
+
+
+def server_events(aws):
+    """Two submissions of new jobs, for different ranges of one scene."""
+    aws.s3_put('render-files-bucket', 'cold.blend', b'BLENDER-v300')
+    return [{'file': 'cold.blend', 'start': str(start), 'end': str(start + 23)} for start in (1, 25)]
+
+
+def watcher_events(aws):
+    """The S3 notifications of two finished jobs, each with its batches' segments still in the PNG bucket."""
+    events = []
+    for job in ('cold_1-24', 'cold_25-48'):
+        aws.ddb_put('JobTable', {'job': job, 'job_status': 'Processing', 'n_batches': 8, 'remaining': 0})
+        for batch in range(8):
+            segment = '%s_segment_%04d.mp4' % (job, batch)
+            aws.s3_put('png-files-bucket', segment, b'segment')
+            aws.ddb_put('BatchTable', {'job': job, 'batch': '%06d' % batch, 'batch_status': 'Complete',
+                                       'segment': segment})
+        events.append({'Records': [{'s3': {'bucket': {'name': 'render-files-bucket'},
+                                           'object': {'key': job + '.mp4'}}}]})
+    return events
+
+
+def logger_events(aws):
+    """Two SQS batches of log messages from a few workers."""
+    now = int(time.time() * 1000)
+    records = [{'messageId': str(i), 'attributes': {'SentTimestamp': str(now)},
+                'body': json.dumps({'id': i % 4, 'type': 'log', 'message': f'{now / 1000},Rendered frame {i}\n'})}
+               for i in range(20)]
+    return [{'Records': records[:10]}, {'Records': records[10:]}]
+
+
+EVENTS = {'server': server_events, 'watcher': watcher_events, 'logger': logger_events}
+
+
+def calls_since(aws, before: dict) -> int:
+    return sum(aws.call_counts().values()) - sum(before.values())
+
+
+def measure(handler: str, latency: float, results):
+    """
+    Runs in a fresh process: imports the handler's module and invokes it twice, timing each step.
+
+    The first invocation is the one a cold start pays for along with the import; the second shows the warm latency.
+    """
+    aws = FakeAWS()
+    first, second = EVENTS[handler](aws)
+    install(aws, latency)
+    directory, script = HANDLERS[handler]
+
+    before, started = aws.call_counts(), time.perf_counter()
+    load_component(os.path.join(ROOT, 'common', 'aws_clients.py'), 'aws_clients')
+    module = load_component(os.path.join(ROOT, directory, script), 'lambda_' + handler)
+    imported, import_calls = time.perf_counter(), calls_since(aws, before)
+
+    before = aws.call_counts()
+    module.lambda_handler(first, None)
+    invoked, first_calls = time.perf_counter(), calls_since(aws, before)
+
+    before = aws.call_counts()
+    module.lambda_handler(second, None)
+    warm, warm_calls = time.perf_counter(), calls_since(aws, before)
+
+    results.put({'import': imported - started, 'first': invoked - imported, 'warm': warm - invoked,
+                 'import_calls': import_calls, 'first_calls': first_calls, 'warm_calls': warm_calls})
+
+
+def run(handler: str, latency: float, runs: int) -> dict:
+    """Measures the handler's cold start in runs fresh processes and returns the median of each measurement."""
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    samples = []
+    for _ in range(runs):
+        process = context.Process(target=measure, args=(handler, latency, results))
+        process.start()
+        samples.append(results.get(timeout=120))
+        process.join()
+    return {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Import-plus-first-invocation latency of the Lambda handlers on fake AWS services. boto3's own "
+                    "import and client setup aren't included, since the fakes replace boto3")
+    parser.add_argument('--handlers', nargs='+', choices=list(HANDLERS), default=list(HANDLERS))
+    parser.add_argument('--latency', type=float, default=0.02, help='simulated round trip of each AWS call, in s')
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes per handler; the median is reported')
+    args = parser.parse_args()
+
+    print(f"{'handler':10s} {'import':>10s} {'first call':>12s} {'cold start':>12s} {'warm call':>12s}   "
+          f"AWS calls (import/first/warm)")
+    for handler in args.handlers:
+        r = run(handler, args.latency, args.runs)
+        print(f"{handler:10s} {r['import'] * 1000:8.1f}ms {r['first'] * 1000:10.1f}ms "
+              f"{(r['import'] + r['first']) * 1000:10.1f}ms {r['warm'] * 1000:10.1f}ms   "
+              f"{r['import_calls']:.0f}/{r['first_calls']:.0f}/{r['warm_calls']:.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,463 @@
+import collections
+import hashlib
+import re
+import threading
+import time
+import uuid
+
+TABLE_KEYS = {
+    'JobTable': ('job',),
+    'BatchTable': ('job', 'batch'),
+    'FrameTimeTable': ('file',),
+    'RenderCacheTable': ('scene', 'frame'),
+}
+QUEUE_VISIBILITY = {
+    'JobQueueHigh': 20 * 60,
+    'JobQueue': 20 * 60,
+    'JobQueueLow': 20 * 60,
+    'LoggingQueue': 30,
+}
+MISSING = object()
+
+
+class ClientError(Exception):
+    """Mirrors botocore.exceptions.ClientError closely enough for the components' error handling."""
+
+    def __init__(self, error_response, operation_name):
+        super().__init__(f"An error occurred ({error_response['Error']['Code']}) when calling the {operation_name} "
+                         f"operation: {error_response['Error'].get('Message', '')}")
+        self.response = error_response
+        self.operation_name = operation_name
+
+    def __reduce__(self):
+        return type(self), (self.response, self.operation_name)
+
+
+class NoSuchKey(ClientError):
+    pass
+
+
+def error(code: str, operation: str, message: str = '', cls=ClientError):
+    return cls({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+def split_top_level(expression: str, separator: str = ',') -> list:
+    """Splits on the separator, ignoring separators inside parentheses."""
+    parts, depth, current = [], 0, ''
+    for char in expression:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == separator and depth == 0:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    parts.append(current)
+    return [p.strip() for p in parts if p.strip()]
+
+
+class Expressions:
+    """Evaluates the subset of DynamoDB update and condition expressions that the components use."""
+
+    def __init__(self, names: dict, values: dict):
+        self.names = names or dict()
+        self.values = values or dict()
+
+    def path(self, expression: str) -> list:
+        return [self.names.get(p, p) for p in expression.strip().split('.')]
+
+    @staticmethod
+    def get(item: dict, path: list):
+        for name in path:
+            if not isinstance(item, dict) or name not in item:
+                return MISSING
+            item = item[name]
+        return item
+
+    @staticmethod
+    def put(item: dict, path: list, value):
+        for name in path[:-1]:
+            item = item[name]
+        item[path[-1]] = value
+
+    @staticmethod
+    def remove(item: dict, path: list):
+        for name in path[:-1]:
+            item = item.get(name, dict())
+        item.pop(path[-1], None)
+
+    def operand(self, item: dict, expression: str):
+        expression = expression.strip()
+        if expression.startswith(':'):
+            return self.values[expression]
+        match = re.fullmatch(r'if_not_exists\((.+)\)', expression)
+        if match:
+            path, default = split_top_level(match.group(1))
+            value = self.get(item, self.path(path))
+            return self.operand(item, default) if value is MISSING else value
+        match = re.fullmatch(r'list_append\((.+)\)', expression)
+        if match:
+            a, b = split_top_level(match.group(1))
+            a, b = self.operand(item, a), self.operand(item, b)
+            return (a if a is not MISSING else []) + (b if b is not MISSING else [])
+        match = re.fullmatch(r'(.+?)\s*([+-])\s*(.+)', expression)
+        if match:
+            a, b = self.operand(item, match.group(1)), self.operand(item, match.group(3))
+            return a + b if match.group(2) == '+' else a - b
+        return self.get(item, self.path(expression))
+
+    def update(self, item: dict, expression: str):
+        sections = re.split(r'(?i)\b(set|remove|add|delete)\b', expression)
+        for keyword, body in zip(sections[1::2], sections[2::2]):
+            keyword = keyword.lower()
+            for clause in split_top_level(body):
+                if keyword == 'set':
+                    path, value = clause.split('=', 1)
+                    self.put(item, self.path(path), self.operand(item, value))
+                elif keyword == 'remove':
+                    self.remove(item, self.path(clause))
+                elif keyword == 'delete':
+                    path, value = clause.split(None, 1)
+                    current = self.get(item, self.path(path))
+                    if current is not MISSING:
+                        current = current - self.operand(item, value)
+                        if current:
+                            self.put(item, self.path(path), current)
+                        else:
+                            self.remove(item, self.path(path))
+                else:
+                    path, value = clause.split(None, 1)
+                    current = self.get(item, self.path(path))
+                    value = self.operand(item, value)
+                    if isinstance(value, set):
+                        self.put(item, self.path(path), (set() if current is MISSING else current) | value)
+                    else:
+                        self.put(item, self.path(path), (0 if current is MISSING else current) + value)
+
+    def condition(self, item: dict, expression: str) -> bool:
+        if not expression:
+            return True
+        expression = expression.strip()
+        ors = re.split(r'(?i)\s+or\s+', expression)
+        if len(ors) > 1:
+            return any(self.condition(item, e) for e in ors)
+        ands = re.split(r'(?i)\s+and\s+', expression)
+        if len(ands) > 1:
+            return all(self.condition(item, e) for e in ands)
+        match = re.fullmatch(r'(?i)not\s+(.+)', expression)
+        if match:
+            return not self.condition(item, match.group(1))
+        match = re.fullmatch(r'attribute_(not_)?exists\((.+)\)', expression)
+        if match:
+            exists = self.get(item, self.path(match.group(2))) is not MISSING
+            return exists != bool(match.group(1))
+        match = re.fullmatch(r'contains\((.+)\)', expression)
+        if match:
+            path, value = split_top_level(match.group(1))
+            container = self.get(item, self.path(path))
+            return container is not MISSING and self.operand(item, value) in container
+        match = re.fullmatch(r'(.+?)\s*(<>|<=|>=|=|<|>)\s*(.+)', expression)
+        if match:
+            a, b = self.operand(item, match.group(1)), self.operand(item, match.group(3))
+            if a is MISSING or b is MISSING:
+                return match.group(2) == '<>'
+            return {'=': a == b, '<>': a != b, '<': a < b, '<=': a <= b, '>': a > b, '>=': a >= b}[match.group(2)]
+        raise ValueError(f'Unsupported condition expression: {expression}')
+
+
+class FakeAWS:
+    """
+    In-memory stand-ins for the S3 buckets, SQS queues and DynamoDB tables the farm uses.
+
+    SQS messages follow visibility timeout semantics: received messages are hidden until they are deleted or their
+    timeout expires. Every call is counted, per service and operation, for the benchmarks.
+    """
+
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.calls = collections.Counter()
+        self.buckets = collections.defaultdict(dict)
+        self.notifications = []
+        self.events = []
+        self.queues = collections.defaultdict(collections.OrderedDict)
+        self.tables = collections.defaultdict(dict)
+
+    def _count(self, operation: str):
+        self.calls[operation] += 1
+
+    def call_counts(self) -> dict:
+        with self.lock:
+            return dict(self.calls)
+
+    # S3
+
+    def add_notification(self, bucket: str, suffix: str):
+        """Records an event for every object put into the bucket with the given suffix, like an S3 trigger."""
+        with self.lock:
+            self.notifications.append((bucket, suffix))
+
+    def pop_events(self) -> list:
+        with self.lock:
+            events, self.events = self.events, []
+            return events
+
+    def s3_put(self, bucket: str, key: str, data: bytes) -> str:
+        with self.lock:
+            self._count('s3.PutObject')
+            etag = '"' + hashlib.md5(data).hexdigest() + '"'
+            self.buckets[bucket][key] = (data, etag, time.time())
+            for b, suffix in self.notifications:
+                if b == bucket and key.endswith(suffix):
+                    self.events.append((bucket, key))
+            return etag
+
+    def _object(self, bucket: str, key: str, operation: str):
+        if key not in self.buckets[bucket]:
+            if operation == 'GetObject':
+                raise error('NoSuchKey', operation, 'The specified key does not exist.', NoSuchKey)
+            raise error('404', operation, 'Not Found')
+        return self.buckets[bucket][key]
+
+    def s3_get(self, bucket: str, key: str, byte_range: tuple = None) -> bytes:
+        with self.lock:
+            self._count('s3.GetObject')
+            data = self._object(bucket, key, 'GetObject')[0]
+        if byte_range is not None:
+            start, end = byte_range
+            return data[start:end + 1]
+        return data
+
+    def s3_head(self, bucket: str, key: str, if_none_match: str = None) -> dict:
+        with self.lock:
+            self._count('s3.HeadObject')
+            data, etag, modified = self._object(bucket, key, 'HeadObject')
+        if if_none_match is not None and if_none_match == etag:
+            raise error('304', 'HeadObject', 'Not Modified')
+        return {'ETag': etag, 'ContentLength': len(data), 'LastModified': modified}
+
+    def s3_list(self, bucket: str, prefix: str = '', start_after: str = '', max_keys: int = 1000) -> dict:
+        with self.lock:
+            self._count('s3.ListObjectsV2')
+            keys = sorted(k for k in self.buckets[bucket] if k.startswith(prefix) and k > start_after)
+            page = keys[:max_keys]
+            contents = [{'Key': k, 'Size': len(self.buckets[bucket][k][0]), 'ETag': self.buckets[bucket][k][1]}
+                        for k in page]
+        response = {'KeyCount': len(page), 'IsTruncated': len(keys) > max_keys}
+        if contents:
+            response['Contents'] = contents
+        if len(keys) > max_keys:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    def s3_delete(self, bucket: str, keys: list) -> dict:
+        with self.lock:
+            self._count('s3.DeleteObjects')
+            if len(keys) > 1000:
+                raise error('MalformedXML', 'DeleteObjects', 'The XML you provided was not well-formed')
+            for key in keys:
+                self.buckets[bucket].pop(key, None)
+        return {'Deleted': [{'Key': k} for k in keys]}
+
+    def s3_keys(self, bucket: str) -> list:
+        with self.lock:
+            return sorted(self.buckets[bucket])
+
+    # SQS
+
+    def sqs_get_queue_url(self, queue: str):
+        with self.lock:
+            self._count('sqs.GetQueueUrl')
+
+    def sqs_send(self, queue: str, body: str) -> str:
+        with self.lock:
+            self._count('sqs.SendMessage')
+            return self._enqueue(queue, body)
+
+    def _enqueue(self, queue: str, body: str) -> str:
+        id = str(uuid.uuid4())
+        self.queues[queue][id] = {'body': body, 'visible_at': 0.0, 'receipt': None,
+                                  'sent': int(time.time() * 1000), 'receives': 0}
+        self.lock.notify_all()
+        return id
+
+    def sqs_send_batch(self, queue: str, entries: list) -> dict:
+        with self.lock:
+            self._count('sqs.SendMessageBatch')
+            if len(entries) > 10:
+                raise error('AWS.SimpleQueueService.TooManyEntriesInBatchRequest', 'SendMessageBatch')
+            return {'Successful': [{'Id': e['Id'], 'MessageId': self._enqueue(queue, e['MessageBody'])}
+                                   for e in entries], 'Failed': []}
+
+    def sqs_receive(self, queue: str, max_messages: int = 1, wait: float = 0, visibility: float = None) -> list:
+        if visibility is None:
+            visibility = QUEUE_VISIBILITY.get(queue, 30)
+        deadline = time.time() + wait
+        with self.lock:
+            self._count('sqs.ReceiveMessage')
+            while True:
+                now = time.time()
+                received = []
+                for id, message in self.queues[queue].items():
+                    if message['visible_at'] <= now:
+                        message['visible_at'] = now + visibility
+                        message['receives'] += 1
+                        message['receipt'] = f'{id}:{message["receives"]}'
+                        received.append({'MessageId': id, 'ReceiptHandle': message['receipt'],
+                                         'Body': message['body'],
+                                         'Attributes': {'SentTimestamp': str(message['sent']),
+                                                        'ApproximateReceiveCount': str(message['receives'])}})
+                        if len(received) >= max_messages:
+                            break
+                if received or now >= deadline:
+                    return received
+                # Wake up when a message is sent or the earliest hidden message becomes visible again
+                hidden = [m['visible_at'] for m in self.queues[queue].values()]
+                timeout = min([deadline] + hidden) - now
+                self.lock.wait(max(0.01, timeout))
+
+    def _message(self, queue: str, receipt: str):
+        id = receipt.split(':')[0]
+        return id, self.queues[queue].get(id)
+
+    def sqs_delete(self, queue: str, receipt: str):
+        with self.lock:
+            self._count('sqs.DeleteMessage')
+            id, message = self._message(queue, receipt)
+            if message is not None:
+                del self.queues[queue][id]
+
+    def sqs_change_visibility(self, queue: str, entries: list):
+        """entries: list of (receipt, timeout) pairs."""
+        with self.lock:
+            self._count('sqs.ChangeMessageVisibility' if len(entries) == 1 else 'sqs.ChangeMessageVisibilityBatch')
+            for receipt, timeout in entries:
+                _, message = self._message(queue, receipt)
+                if message is not None and message['receipt'] == receipt:
+                    message['visible_at'] = time.time() + timeout
+            self.lock.notify_all()
+
+    def sqs_attributes(self, queue: str) -> dict:
+        with self.lock:
+            self._count('sqs.GetQueueAttributes')
+            now = time.time()
+            visible = sum(1 for m in self.queues[queue].values() if m['visible_at'] <= now)
+            return {'ApproximateNumberOfMessages': str(visible),
+                    'ApproximateNumberOfMessagesNotVisible': str(len(self.queues[queue]) - visible),
+                    'VisibilityTimeout': str(QUEUE_VISIBILITY.get(queue, 30))}
+
+    # DynamoDB
+
+    def _key(self, table: str, item: dict) -> tuple:
+        return tuple(item[k] for k in TABLE_KEYS[table])
+
+    def ddb_get(self, table: str, key: dict):
+        with self.lock:
+            self._count('dynamodb.GetItem')
+            item = self.tables[table].get(self._key(table, key))
+            return None if item is None else _copy(item)
+
+    def ddb_peek(self, table: str, key: dict):
+        """Reads an item without counting it as an API call, for the harness's own polling."""
+        with self.lock:
+            item = self.tables[table].get(self._key(table, key))
+            return None if item is None else _copy(item)
+
+    def ddb_put(self, table: str, item: dict, condition: str = None, names: dict = None, values: dict = None):
+        with self.lock:
+            self._count('dynamodb.PutItem')
+            self._put(table, item, condition, names, values)
+
+    def _put(self, table, item, condition=None, names=None, values=None):
+        existing = self.tables[table].get(self._key(table, item), dict())
+        if not Expressions(names, values).condition(existing, condition):
+            raise error('ConditionalCheckFailedException', 'PutItem', 'The conditional request failed')
+        self.tables[table][self._key(table, item)] = _copy(item)
+
+    def ddb_update(self, table: str, key: dict, expression: str, condition: str = None, names: dict = None,
+                   values: dict = None, return_values: str = 'NONE') -> dict:
+        with self.lock:
+            self._count('dynamodb.UpdateItem')
+            existing = self.tables[table].get(self._key(table, key))
+            item = _copy(existing) if existing is not None else dict(key)
+            expressions = Expressions(names, values)
+            if not expressions.condition(existing or dict(), condition):
+                raise error('ConditionalCheckFailedException', 'UpdateItem', 'The conditional request failed')
+            expressions.update(item, expression)
+            self.tables[table][self._key(table, key)] = item
+            if return_values == 'ALL_NEW':
+                return _copy(item)
+            if return_values == 'ALL_OLD':
+                return _copy(existing or dict())
+            if return_values == 'UPDATED_NEW':
+                return {k: _copy(v) for k, v in item.items() if existing is None or existing.get(k) != v}
+            return dict()
+
+    def ddb_delete(self, table: str, key: dict, condition: str = None, names: dict = None, values: dict = None):
+        with self.lock:
+            self._count('dynamodb.DeleteItem')
+            self._delete(table, key, condition, names, values)
+
+    def _delete(self, table, key, condition=None, names=None, values=None):
+        existing = self.tables[table].get(self._key(table, key), dict())
+        if not Expressions(names, values).condition(existing, condition):
+            raise error('ConditionalCheckFailedException', 'DeleteItem', 'The conditional request failed')
+        self.tables[table].pop(self._key(table, key), None)
+
+    def ddb_batch_write(self, table: str, puts: list, deletes: list):
+        with self.lock:
+            self._count('dynamodb.BatchWriteItem')
+            for item in puts:
+                self._put(table, item)
+            for key in deletes:
+                self._delete(table, key)
+
+    def ddb_query(self, table: str, conditions: list, forward: bool = True, limit: int = None,
+                  start_key: dict = None) -> dict:
+        """conditions: list of (operator, attribute, operands) from boto3.dynamodb.conditions.Key."""
+        with self.lock:
+            self._count('dynamodb.Query')
+            items = [_copy(i) for i in self.tables[table].values() if all(_matches(i, c) for c in conditions)]
+        sort_key = TABLE_KEYS[table][-1]
+        items.sort(key=lambda i: i.get(sort_key), reverse=not forward)
+        if start_key is not None:
+            position = [self._key(table, i) for i in items].index(self._key(table, start_key)) + 1
+            items = items[position:]
+        response = {'Items': items[:limit] if limit else items, 'Count': len(items[:limit] if limit else items)}
+        if limit and len(items) > limit:
+            last = items[limit - 1]
+            response['LastEvaluatedKey'] = {k: last[k] for k in TABLE_KEYS[table]}
+        return response
+
+    def ddb_scan(self, table: str, condition: str = None, names: dict = None, values: dict = None) -> dict:
+        with self.lock:
+            self._count('dynamodb.Scan')
+            expressions = Expressions(names, values)
+            items = [_copy(i) for i in self.tables[table].values() if expressions.condition(i, condition)]
+        return {'Items': items, 'Count': len(items)}
+
+
+def _matches(item: dict, condition: tuple) -> bool:
+    operator, attribute, operands = condition
+    value = item.get(attribute, MISSING)
+    if value is MISSING:
+        return False
+    if operator == 'eq':
+        return value == operands[0]
+    if operator == 'begins_with':
+        return str(value).startswith(operands[0])
+    if operator == 'between':
+        return operands[0] <= value <= operands[1]
+    return {'lt': value < operands[0], 'lte': value <= operands[0],
+            'gt': value > operands[0], 'gte': value >= operands[0]}[operator]
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    if isinstance(value, set):
+        return set(value)
+    return value
@@ -0,0 +1,344 @@
+"""
+Module objects that stand in for boto3 and botocore, backed by a FakeAWS instance (or a proxy to one).
+
+install() puts them in sys.modules, so the server, watcher, logger and worker can be imported unchanged.
+"""
+import io
+import sys
+import time
+import types
+
+from .fake_aws import ClientError, NoSuchKey
+
+
+def queue_name(url: str) -> str:
+    return url.rstrip('/').split('/')[-1]
+
+
+def queue_url(name: str) -> str:
+    return f'https://sqs.local/000000000000/{name}'
+
+
+class Paginator:
+    def __init__(self, client, operation: str):
+        self.client = client
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        while True:
+            page = getattr(self.client, self.operation)(**kwargs)
+            yield page
+            if not page.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+
+class S3Client:
+    def __init__(self, aws):
+        self.aws = aws
+        self.exceptions = types.SimpleNamespace(NoSuchKey=NoSuchKey, ClientError=ClientError)
+
+    def download_file(self, Bucket, Key, Filename, **kwargs):
+        data = self.aws.s3_get(Bucket, Key)
+        with open(Filename, 'wb') as f:
+            f.write(data)
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        with open(Filename, 'rb') as f:
+            self.aws.s3_put(Bucket, Key, f.read())
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif hasattr(Body, 'read'):
+            Body = Body.read()
+        return {'ETag': self.aws.s3_put(Bucket, Key, Body)}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        byte_range = None
+        if Range is not None:
+            start, end = Range.replace('bytes=', '').split('-')
+            byte_range = (int(start), int(end))
+        data = self.aws.s3_get(Bucket, Key, byte_range)
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+
+    def head_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        return self.aws.s3_head(Bucket, Key, IfNoneMatch)
+
+    def list_objects_v2(self, Bucket, Prefix='', ContinuationToken='', StartAfter='', MaxKeys=1000, **kwargs):
+        return self.aws.s3_list(Bucket, Prefix, ContinuationToken or StartAfter, MaxKeys)
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        return self.aws.s3_delete(Bucket, [obj['Key'] for obj in Delete['Objects']])
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.aws.s3_delete(Bucket, [Key])
+        return dict()
+
+    def get_paginator(self, operation):
+        return Paginator(self, operation)
+
+
+class Message:
+    def __init__(self, aws, queue: str, message: dict):
+        self.aws = aws
+        self.queue_name = queue
+        self.queue_url = queue_url(queue)
+        self.message_id = message['MessageId']
+        self.receipt_handle = message['ReceiptHandle']
+        self.body = message['Body']
+        self.attributes = message['Attributes']
+
+    def delete(self):
+        self.aws.sqs_delete(self.queue_name, self.receipt_handle)
+
+    def change_visibility(self, VisibilityTimeout):
+        self.aws.sqs_change_visibility(self.queue_name, [(self.receipt_handle, VisibilityTimeout)])
+
+
+class Queue:
+    def __init__(self, aws, name: str):
+        self.aws = aws
+        self.name = name
+        self.url = queue_url(name)
+
+    @property
+    def attributes(self):
+        return self.aws.sqs_attributes(self.name)
+
+    def reload(self):
+        pass
+
+    def receive_messages(self, MaxNumberOfMessages=1, WaitTimeSeconds=0, VisibilityTimeout=None, **kwargs):
+        messages = self.aws.sqs_receive(self.name, MaxNumberOfMessages, WaitTimeSeconds, VisibilityTimeout)
+        return [Message(self.aws, self.name, m) for m in messages]
+
+    def send_message(self, MessageBody, **kwargs):
+        return {'MessageId': self.aws.sqs_send(self.name, MessageBody)}
+
+    def send_messages(self, Entries):
+        return self.aws.sqs_send_batch(self.name, Entries)
+
+
+class SQSResource:
+    def __init__(self, aws):
+        self.aws = aws
+
+    def get_queue_by_name(self, QueueName):
+        self.aws.sqs_get_queue_url(QueueName)
+        return Queue(self.aws, QueueName)
+
+    def Queue(self, url):
+        return Queue(self.aws, queue_name(url))
+
+
+class SQSClient:
+    def __init__(self, aws):
+        self.aws = aws
+
+    def get_queue_url(self, QueueName, **kwargs):
+        self.aws.sqs_get_queue_url(QueueName)
+        return {'QueueUrl': queue_url(QueueName)}
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        return {'MessageId': self.aws.sqs_send(queue_name(QueueUrl), MessageBody)}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        return self.aws.sqs_send_batch(queue_name(QueueUrl), Entries)
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0, VisibilityTimeout=None, **kwargs):
+        messages = self.aws.sqs_receive(queue_name(QueueUrl), MaxNumberOfMessages, WaitTimeSeconds,
+                                        VisibilityTimeout)
+        return {'Messages': messages} if messages else dict()
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self.aws.sqs_delete(queue_name(QueueUrl), ReceiptHandle)
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        self.aws.sqs_change_visibility(queue_name(QueueUrl), [(ReceiptHandle, VisibilityTimeout)])
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        self.aws.sqs_change_visibility(queue_name(QueueUrl),
+                                       [(e['ReceiptHandle'], e['VisibilityTimeout']) for e in Entries])
+        return {'Successful': [{'Id': e['Id']} for e in Entries], 'Failed': []}
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames=(), **kwargs):
+        return {'Attributes': self.aws.sqs_attributes(queue_name(QueueUrl))}
+
+
+class BatchWriter:
+    def __init__(self, table):
+        self.table = table
+        self.puts = []
+        self.deletes = []
+
+    def put_item(self, Item):
+        self.puts.append(Item)
+        self._flush_if_full()
+
+    def delete_item(self, Key):
+        self.deletes.append(Key)
+        self._flush_if_full()
+
+    def _flush_if_full(self):
+        if len(self.puts) + len(self.deletes) >= 25:
+            self.flush()
+
+    def flush(self):
+        if self.puts or self.deletes:
+            self.table.aws.ddb_batch_write(self.table.name, self.puts, self.deletes)
+        self.puts, self.deletes = [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+
+class Table:
+    def __init__(self, aws, name: str):
+        self.aws = aws
+        self.name = name
+
+    def get_item(self, Key, **kwargs):
+        item = self.aws.ddb_get(self.name, Key)
+        return {'Item': item} if item is not None else dict()
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, **kwargs):
+        self.aws.ddb_put(self.name, Item, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        return dict()
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE', **kwargs):
+        attributes = self.aws.ddb_update(self.name, Key, UpdateExpression, ConditionExpression,
+                                         ExpressionAttributeNames, ExpressionAttributeValues, ReturnValues)
+        return {'Attributes': attributes} if ReturnValues != 'NONE' else dict()
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, **kwargs):
+        self.aws.ddb_delete(self.name, Key, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+        return dict()
+
+    def query(self, KeyConditionExpression, ScanIndexForward=True, Limit=None, ExclusiveStartKey=None, **kwargs):
+        return self.aws.ddb_query(self.name, KeyConditionExpression.conditions, ScanIndexForward, Limit,
+                                  ExclusiveStartKey)
+
+    def scan(self, FilterExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        return self.aws.ddb_scan(self.name, FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+
+    def batch_writer(self, **kwargs):
+        return BatchWriter(self)
+
+
+class DynamoDBResource:
+    def __init__(self, aws):
+        self.aws = aws
+
+    def Table(self, name):
+        return Table(self.aws, name)
+
+
+class KeyCondition:
+    def __init__(self, conditions: list):
+        self.conditions = conditions
+
+    def __and__(self, other):
+        return KeyCondition(self.conditions + other.conditions)
+
+
+class Key:
+    def __init__(self, name: str):
+        self.name = name
+
+    def _condition(self, operator, *operands):
+        return KeyCondition([(operator, self.name, operands)])
+
+    def eq(self, value):
+        return self._condition('eq', value)
+
+    def lt(self, value):
+        return self._condition('lt', value)
+
+    def lte(self, value):
+        return self._condition('lte', value)
+
+    def gt(self, value):
+        return self._condition('gt', value)
+
+    def gte(self, value):
+        return self._condition('gte', value)
+
+    def begins_with(self, value):
+        return self._condition('begins_with', value)
+
+    def between(self, low, high):
+        return self._condition('between', low, high)
+
+
+class Latency:
+    """Wraps a FakeAWS so that every call to it first waits for a network round trip of the given seconds."""
+
+    def __init__(self, aws, seconds: float):
+        self.aws = aws
+        self.seconds = seconds
+
+    def __getattr__(self, name):
+        method = getattr(self.aws, name)
+
+        def call(*args, **kwargs):
+            time.sleep(self.seconds)
+            return method(*args, **kwargs)
+        return call
+
+
+class Config:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+
+CLIENTS = {'s3': S3Client, 'sqs': SQSClient}
+RESOURCES = {'sqs': SQSResource, 'dynamodb': DynamoDBResource}
+
+
+def install(aws, latency: float = 0):
+    """Replaces boto3 and botocore in sys.modules with stand-ins backed by aws, with latency seconds per call."""
+    if latency:
+        aws = Latency(aws, latency)
+    boto3 = types.ModuleType('boto3')
+    boto3.client = lambda service, *args, **kwargs: CLIENTS[service](aws)
+    boto3.resource = lambda service, *args, **kwargs: RESOURCES[service](aws)
+    boto3_session = types.ModuleType('boto3.session')
+    boto3_session.Session = lambda *args, **kwargs: boto3
+    boto3.session = boto3_session
+    boto3_dynamodb = types.ModuleType('boto3.dynamodb')
+    conditions = types.ModuleType('boto3.dynamodb.conditions')
+    conditions.Key = Key
+    boto3_dynamodb.conditions = conditions
+    boto3.dynamodb = boto3_dynamodb
+    boto3_s3 = types.ModuleType('boto3.s3')
+    transfer = types.ModuleType('boto3.s3.transfer')
+    transfer.TransferConfig = Config
+    boto3_s3.transfer = transfer
+    boto3.s3 = boto3_s3
+
+    botocore = types.ModuleType('botocore')
+    exceptions = types.ModuleType('botocore.exceptions')
+    exceptions.ClientError = ClientError
+    botocore.exceptions = exceptions
+    config = types.ModuleType('botocore.config')
+    config.Config = Config
+    botocore.config = config
+
+    sys.modules.update({
+        'boto3': boto3,
+        'boto3.session': boto3_session,
+        'boto3.dynamodb': boto3_dynamodb,
+        'boto3.dynamodb.conditions': conditions,
+        'boto3.s3': boto3_s3,
+        'boto3.s3.transfer': transfer,
+        'botocore': botocore,
+        'botocore.exceptions': exceptions,
+        'botocore.config': config,
+    })
@@ -0,0 +1,237 @@
+import importlib.util
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.managers import BaseManager
+
+from .fake_aws import FakeAWS
+from .fake_boto3 import install
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PNG_HEADER = b'\x89PNG\r\n\x1a\n'
+
+_aws = None
+
+
+def _get_aws():
+    global _aws
+    if _aws is None:
+        _aws = FakeAWS()
+    return _aws
+
+
+class FarmManager(BaseManager):
+    pass
+
+
+FarmManager.register('get_aws', callable=_get_aws)
+
+
+def load_component(path: str, name: str):
+    """Imports one of the farm's scripts by file path, under the given module name."""
+    directory = os.path.dirname(path)
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def fake_render(frame_seconds: float):
+    """
+    Replacement for worker.render that sleeps for frame_seconds per frame and writes a small PNG.
+
+    A render of a border region costs the region's share of frame_seconds.
+    """
+    def render(blender_file, start, end, on_frame=None, border=None, output_path=None, slot=0, on_start=None):
+        if output_path is None:
+            output_path = blender_file[:-6] + '/' + os.path.basename(blender_file[:-6])
+        area = 1 if border is None else (border[1] - border[0]) * (border[3] - border[2])
+        if on_start is not None:
+            on_start()
+        for frame in range(int(start), int(end) + 1):
+            time.sleep(frame_seconds * area)
+            path = output_path + '%04d.png' % frame
+            with open(path, 'wb') as f:
+                f.write(PNG_HEADER + str(frame).encode('utf-8') * 64)
+            if on_frame is not None:
+                on_frame(path)
+    return render
+
+
+def fake_sequence(filename, frames, output_file=None):
+    """Replacement for worker.sequence that concatenates the frames instead of running ffmpeg."""
+    with open(output_file or filename + '.mp4', 'wb') as f:
+        for frame in frames:
+            f.write(frame)
+
+
+def fake_stitch(tile_files, rows, cols, output_file):
+    fake_concat(tile_files, output_file)
+
+
+def fake_concat(segment_files, output_file):
+    with open(output_file, 'wb') as f:
+        for segment in segment_files:
+            with open(segment, 'rb') as s:
+                f.write(s.read())
+
+
+def run_worker(address, authkey: bytes, workdir: str, env: dict, frame_seconds: float):
+    """Entry point of a worker process: the real worker module, bound to the shared fake services."""
+    manager = FarmManager(address, authkey)
+    manager.connect()
+    install(manager.get_aws())
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    os.environ.update(env)
+    load_component(os.path.join(ROOT, 'common', 'aws_clients.py'), 'aws_clients')
+    worker = load_component(os.path.join(ROOT, 'worker', 'worker.py'), 'worker')
+    worker.render = fake_render(frame_seconds)
+    worker.sequence = fake_sequence
+    worker.concat = fake_concat
+    worker.stitch = fake_stitch
+    worker.main()
+
+
+class LocalFarm:
+    """
+    The server, watcher, logger and worker components running locally against in-memory AWS stand-ins.
+
+    The Lambdas are imported into this process and invoked directly; each worker runs in its own process (with its
+    own working directory) and renders with a fake renderer that costs frame_seconds per frame, or slowdown times
+    that on the first slow_workers workers. The watcher's straggler schedule runs every few frames' time.
+    """
+
+    WORKER_ENV = {
+        'BLENDER_SERVER': '0',
+        'QUEUE_WAIT_TIME': '1',
+        'METRICS_PORT': '0',
+        'BATCH_PROGRESS_INTERVAL': '0',
+    }
+
+    def __init__(self, n_workers: int = 2, frame_seconds: float = 0.05, env: dict = None, slow_workers: int = 0,
+                 slowdown: float = 10):
+        self.n_workers = n_workers
+        self.frame_seconds = frame_seconds
+        self.slow_workers = slow_workers
+        self.slowdown = slowdown
+        self.env = dict(self.WORKER_ENV, **(env or dict()))
+        self.tmp = tempfile.mkdtemp(prefix='local-farm-')
+        self.authkey = os.urandom(16)
+        self.manager = FarmManager(authkey=self.authkey)
+        self.workers = []
+        self.stopping = threading.Event()
+        self.pumps = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self.manager.start()
+        self.aws = self.manager.get_aws()
+        self.aws.add_notification('render-files-bucket', '.mp4')
+        install(self.aws)
+        # Loaded afresh so that its clients are bound to this farm's services
+        load_component(os.path.join(ROOT, 'common', 'aws_clients.py'), 'aws_clients')
+        self.server = load_component(os.path.join(ROOT, 'server', 'lambda_server.py'), 'lambda_server')
+        self.watcher = load_component(os.path.join(ROOT, 'watcher', 'lambda_watcher.py'), 'lambda_watcher')
+        self.logger = load_component(os.path.join(ROOT, 'logger', 'lambda_logger.py'), 'lambda_logger')
+        # Scaled down from the minute-long slack the schedule is tuned for
+        self.watcher.MIN_SLACK_SECONDS = 10 * self.frame_seconds
+
+        context = multiprocessing.get_context('spawn')
+        for i in range(self.n_workers):
+            workdir = os.path.join(self.tmp, f'worker-{i}')
+            env = dict(self.env, BLEND_CACHE_DIR=os.path.join(workdir, 'cache'))
+            frame_seconds = self.frame_seconds * (self.slowdown if i < self.slow_workers else 1)
+            process = context.Process(target=run_worker, daemon=True,
+                                      args=(self.manager.address, self.authkey, workdir, env, frame_seconds))
+            process.start()
+            self.workers.append(process)
+
+        for target in (self._pump_watcher, self._pump_logger, self._pump_speculation):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.pumps.append(thread)
+
+    def _pump_watcher(self):
+        """Invokes the watcher for every .mp4 put into the render bucket, like the S3 trigger."""
+        while not self.stopping.is_set():
+            for bucket, key in self.aws.pop_events():
+                self.watcher.lambda_handler({'Records': [{'s3': {'bucket': {'name': bucket},
+                                                                'object': {'key': key}}}]}, None)
+            time.sleep(0.05)
+
+    def _pump_speculation(self):
+        """Invokes the watcher's straggler check on a schedule, like the EventBridge trigger."""
+        while not self.stopping.wait(max(0.2, 4 * self.frame_seconds)):
+            self.watcher.lambda_handler({'speculate': True}, None)
+
+    def _pump_logger(self):
+        """Delivers LoggingQueue messages to the logger in batches, like the SQS trigger."""
+        while not self.stopping.is_set():
+            messages = self.aws.sqs_receive('LoggingQueue', 10, 0.5)
+            if messages:
+                records = [{'messageId': m['MessageId'], 'body': m['Body'], 'attributes': m['Attributes']}
+                           for m in messages]
+                self.logger.lambda_handler({'Records': records}, None)
+                for m in messages:
+                    self.aws.sqs_delete('LoggingQueue', m['ReceiptHandle'])
+
+    def upload_scene(self, filename: str, data: bytes = b'BLENDER-v300'):
+        self.aws.s3_put('render-files-bucket', filename, data)
+
+    def submit(self, filename: str, start: int, end: int, priority: str = None, tiles: int = None) -> str:
+        """Submits a render job through the server and returns its job id."""
+        event = {'file': filename, 'start': str(start), 'end': str(end)}
+        if priority is not None:
+            event['priority'] = priority
+        if tiles is not None:
+            event['tiles'] = tiles
+        response = self.server.lambda_handler(event, None)
+        if response['statusCode'] != 200:
+            raise RuntimeError(response['body'])
+        return self.server.job_id(filename, start, end)
+
+    def status(self, job: str):
+        item = self.aws.ddb_peek('JobTable', {'job': job})
+        return None if item is None else item.get('job_status')
+
+    def wait(self, job: str, timeout: float = 600) -> bool:
+        """Waits until the watcher has marked the job complete."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.status(job) == 'Complete':
+                return True
+            if not any(w.is_alive() for w in self.workers):
+                return False
+            time.sleep(0.05)
+        return False
+
+    def stop(self):
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in self.workers:
+            worker.join(timeout=10)
+        self.stopping.set()
+        for pump in self.pumps:
+            pump.join(timeout=5)
+        try:
+            self.logger.lambda_handler({'compact': True}, None)
+        except Exception as e:
+            print(f'Log compaction failed: {e}')
+        self.manager.shutdown()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
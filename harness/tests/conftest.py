@@ -0,0 +1,17 @@
+import os
+
+import pytest
+
+from harness.fake_aws import FakeAWS
+from harness.fake_boto3 import install
+from harness.farm import ROOT, load_component
+
+
+@pytest.fixture
+def aws():
+    """Fresh in-memory AWS services in place of boto3, with the components' shared clients bound to them."""
+    aws = FakeAWS()
+    install(aws)
+    load_component(os.path.join(ROOT, 'common', 'aws_clients.py'), 'aws_clients')
+    return aws
+
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from harness.fake_boto3 import S3Client
+from harness.farm import ROOT, load_component
+
+
+@pytest.fixture
+def cache(aws, tmp_path):
+    blend_cache = load_component(os.path.join(ROOT, 'worker', 'blend_cache.py'), 'blend_cache')
+    aws.s3_put('render-files-bucket', 'a.blend', b'A' * 100)
+    aws.s3_put('render-files-bucket', 'b.blend', b'B' * 100)
+    return blend_cache.BlendCache(S3Client(aws), str(tmp_path / 'cache'), max_bytes=150)
+
+
+def test_unchanged_object_is_revalidated_not_downloaded(aws, cache, tmp_path):
+    assert not cache.fetch('render-files-bucket', 'a.blend', str(tmp_path / 'task-1' / 'a.blend'))
+    assert cache.fetch('render-files-bucket', 'a.blend', str(tmp_path / 'task-2' / 'a.blend'))
+    assert aws.call_counts()['s3.GetObject'] == 1
+    assert aws.call_counts()['s3.HeadObject'] == 2
+    # Every task's copy is a link to the same cache entry
+    assert os.stat(tmp_path / 'task-1' / 'a.blend').st_ino == os.stat(tmp_path / 'task-2' / 'a.blend').st_ino
+    assert cache.stats() == 'hits=1 misses=1 bytes_saved=100 bytes_downloaded=100'
+
+
+def test_changed_object_is_downloaded_again(aws, cache, tmp_path):
+    cache.fetch('render-files-bucket', 'a.blend', str(tmp_path / 'task-1' / 'a.blend'))
+    aws.s3_put('render-files-bucket', 'a.blend', b'C' * 100)
+    assert not cache.fetch('render-files-bucket', 'a.blend', str(tmp_path / 'task-2' / 'a.blend'))
+    assert (tmp_path / 'task-2' / 'a.blend').read_bytes() == b'C' * 100
+    assert (tmp_path / 'task-1' / 'a.blend').read_bytes() == b'A' * 100
+
+
+def test_least_recently_used_entry_is_evicted_over_budget(cache, tmp_path):
+    cache.fetch('render-files-bucket', 'a.blend', str(tmp_path / 'task-1' / 'a.blend'))
+    cache.fetch('render-files-bucket', 'b.blend', str(tmp_path / 'task-2' / 'b.blend'))
+    entries = [name for name in os.listdir(tmp_path / 'cache') if name.endswith('.obj')]
+    assert len(entries) == 1
+    assert cache.fetch('render-files-bucket', 'b.blend', str(tmp_path / 'task-3' / 'b.blend'))
+    assert not cache.fetch('render-files-bucket', 'a.blend', str(tmp_path / 'task-4' / 'a.blend'))
@@ -0,0 +1,46 @@
+import hashlib
+import os
+
+import pytest
+
+from harness.farm import ROOT, load_component
+
+pytest.importorskip('requests')
+
+
+@pytest.fixture
+def bulk_client(aws):
+    return load_component(os.path.join(ROOT, 'client', 'bulk_client.py'), 'bulk_client')
+
+
+def etag_of(data: bytes) -> str:
+    return '"' + hashlib.md5(data).hexdigest() + '"'
+
+
+def test_file_under_the_part_size_has_the_md5_etag(aws, bulk_client, tmp_path):
+    path = tmp_path / 'a.blend'
+    path.write_bytes(b'abcdefg')
+    sha256, etag = bulk_client.file_hashes(str(path), part_size=8)
+    assert sha256 == hashlib.sha256(b'abcdefg').hexdigest()
+    # Matches the ETag of a single-part upload
+    assert etag == aws.s3_put('render-files-bucket', 'a.blend', b'abcdefg')
+
+
+def test_empty_file_has_the_md5_etag_of_nothing(bulk_client, tmp_path):
+    path = tmp_path / 'a.blend'
+    path.write_bytes(b'')
+    assert bulk_client.file_hashes(str(path), part_size=8)[1] == etag_of(b'')
+
+
+def test_file_of_the_part_size_or_more_has_the_multipart_etag(bulk_client, tmp_path):
+    path = tmp_path / 'a.blend'
+    path.write_bytes(b'abcdefgh')
+    # At the threshold the upload is already multipart, with one part
+    assert bulk_client.file_hashes(str(path), part_size=8)[1] == '"%s-1"' % hashlib.md5(
+        hashlib.md5(b'abcdefgh').digest()).hexdigest()
+
+    path.write_bytes(b'abcdefghij')
+    parts = hashlib.md5(b'abcd').digest() + hashlib.md5(b'efgh').digest() + hashlib.md5(b'ij').digest()
+    sha256, etag = bulk_client.file_hashes(str(path), part_size=4)
+    assert sha256 == hashlib.sha256(b'abcdefghij').hexdigest()
+    assert etag == '"%s-3"' % hashlib.md5(parts).hexdigest()
@@ -0,0 +1,73 @@
+import os
+import signal
+import threading
+import types
+
+import pytest
+
+from harness.farm import ROOT, load_component
+
+consumer_module = load_component(os.path.join(ROOT, 'worker', 'consumer.py'), 'consumer')
+
+
+class SQSClient:
+    """Records the visibility changes and deletes the consumer makes."""
+
+    def __init__(self):
+        self.visibility = []
+        self.deleted = []
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        self.visibility.extend((entry['ReceiptHandle'], entry['VisibilityTimeout']) for entry in Entries)
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self.deleted.append(ReceiptHandle)
+
+
+def message(id: str, receives: int = 1):
+    return types.SimpleNamespace(message_id=id, receipt_handle=id, queue_url='JobQueue',
+                                 attributes={'ApproximateReceiveCount': str(receives)})
+
+
+@pytest.fixture
+def sqs():
+    return SQSClient()
+
+
+@pytest.fixture
+def consumer(sqs):
+    return consumer_module.JobConsumer([], sqs, visibility_timeout=300)
+
+
+def test_failed_job_is_retried_straight_away_then_backs_off(consumer, sqs):
+    for receives in range(1, 8):
+        consumer.finish(message(str(receives), receives), False)
+    backoff = consumer_module.RETRY_BACKOFF
+    assert [timeout for _, timeout in sqs.visibility] == [0, backoff, 2 * backoff, 4 * backoff, 8 * backoff,
+                                                          16 * backoff, min(300, 32 * backoff)]
+
+
+def test_successful_job_is_deleted(consumer, sqs):
+    consumer.finish(message('a'), True)
+    assert sqs.deleted == ['a'] and sqs.visibility == []
+
+
+def test_sigterm_while_the_lock_is_held_releases_the_messages_afterwards(consumer, sqs):
+    consumer.held = {'a': message('a'), 'b': message('b')}
+    exited = []
+
+    def interrupted_receive():
+        # The handler runs in the main thread, possibly in the middle of a receive that holds the lock
+        with consumer.lock:
+            try:
+                consumer._on_sigterm(signal.SIGTERM, None)
+            except SystemExit:
+                exited.append(True)
+
+    thread = threading.Thread(target=interrupted_receive, daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+    assert exited == [True]
+    assert consumer.stopping.is_set()
+    consumer.release_all()
+    assert sorted(sqs.visibility) == [('a', 0), ('b', 0)]
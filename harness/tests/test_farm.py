@@ -0,0 +1,201 @@
+import json
+import os
+import time
+import types
+
+import pytest
+
+from harness.fake_aws import ClientError
+from harness.farm import ROOT, fake_concat, fake_render, fake_sequence, fake_stitch, load_component
+
+
+@pytest.fixture
+def farm(aws, tmp_path, monkeypatch):
+    """The server and worker modules in this process, against fresh fake services, with a renderer that logs frames."""
+    monkeypatch.chdir(tmp_path)
+    server = load_component(os.path.join(ROOT, 'server', 'lambda_server.py'), 'lambda_server')
+    worker = load_component(os.path.join(ROOT, 'worker', 'worker.py'), 'worker')
+
+    farm = types.SimpleNamespace(aws=aws, server=server, worker=worker, rendered=[], on_frame=None)
+    render = fake_render(0)
+
+    def logged_render(blender_file, start, end, on_frame=None, **kwargs):
+        def frame(path):
+            farm.rendered.append(int(worker.FRAME_PATTERN.search(path).group(1)))
+            if on_frame is not None:
+                on_frame(path)
+            if farm.on_frame is not None:
+                farm.on_frame(path)
+        return render(blender_file, start, end, on_frame=frame, **kwargs)
+
+    worker.render = logged_render
+    worker.sequence = fake_sequence
+    worker.concat = fake_concat
+    worker.stitch = fake_stitch
+    aws.s3_put('render-files-bucket', 'a.blend', b'BLENDER-v300')
+    return farm
+
+
+def submit(farm, start: int, end: int, **event) -> list:
+    """Submits a job of the frames through the server and returns its render batches."""
+    response = farm.server.lambda_handler({'file': 'a.blend', 'start': str(start), 'end': str(end), **event}, None)
+    assert response['statusCode'] == 200
+    return [json.loads(m['Body']) for m in farm.aws.sqs_receive('JobQueueHigh', 10, 0)]
+
+
+def render_batch(farm, batch: dict, tmp_path, attempt: str = 'task') -> bool:
+    work = str(tmp_path / attempt) + '/'
+    os.mkdir(work)
+    success, log = farm.worker.render_job(batch['job'], batch['file'], batch['scene'], batch['start'], batch['end'],
+                                          batch.get('assets', []), work)
+    return success
+
+
+def batch_item(farm, batch: dict) -> dict:
+    return farm.aws.ddb_peek('BatchTable', {'job': batch['job'],
+                                            'batch': farm.worker.batch_key(batch['start'], batch['end'])})
+
+
+def test_claim_batch_only_first_copy_wins(farm):
+    batch, = submit(farm, 1, 3)
+    assert farm.worker.claim_batch(batch['job'], '1', '3', 'first.mp4')
+    assert not farm.worker.claim_batch(batch['job'], '1', '3', 'second.mp4')
+    item = batch_item(farm, batch)
+    assert item['batch_status'] == 'Complete'
+    assert item['segment'] == 'first.mp4'
+
+
+def test_retry_renders_only_frames_missing_from_checkpoints(farm, tmp_path):
+    batch, = submit(farm, 1, 3)
+
+    def fail_after_second_frame(path):
+        if path.endswith('0002.png'):
+            raise RuntimeError('Blender crashed')
+
+    farm.on_frame = fail_after_second_frame
+    assert not render_batch(farm, batch, tmp_path, 'first')
+    assert farm.rendered == [1, 2]
+
+    farm.on_frame = None
+    farm.rendered.clear()
+    assert render_batch(farm, batch, tmp_path, 'retry')
+    assert farm.rendered == [3]
+    assert batch_item(farm, batch)['batch_status'] == 'Complete'
+    assert sorted(farm.worker.get_cached_frames(batch['scene'], '1', '3')) == [1, 2, 3]
+
+
+def test_speculative_loser_discards_its_segment(farm, tmp_path):
+    batch, = submit(farm, 1, 3)
+    remaining = farm.aws.ddb_peek('JobTable', {'job': batch['job']})['remaining']
+
+    def other_copy_finishes(path):
+        if path.endswith('0003.png'):
+            farm.worker.claim_batch(batch['job'], '1', '3', 'winner.mp4')
+
+    farm.on_frame = other_copy_finishes
+    assert render_batch(farm, batch, tmp_path)
+    assert batch_item(farm, batch)['segment'] == 'winner.mp4'
+    assert farm.aws.call_counts()['s3.DeleteObjects'] == 1
+    assert farm.worker.segment_key(batch['job'], 'a', '1', '3') not in farm.aws.s3_keys('png-files-bucket')
+    # Only the winner counts the batch off the job
+    assert farm.aws.ddb_peek('JobTable', {'job': batch['job']})['remaining'] == remaining
+
+
+def test_redelivered_batch_finishes_a_failed_count(farm, tmp_path, monkeypatch):
+    batches = submit(farm, 1, 6)
+    update_item = farm.worker.job_table.update_item
+    throttled = []
+
+    def throttle_first_count(**kwargs):
+        if 'remaining - :one' in kwargs['UpdateExpression'] and not throttled:
+            throttled.append(kwargs)
+            raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'UpdateItem')
+        return update_item(**kwargs)
+
+    monkeypatch.setattr(farm.worker.job_table, 'update_item', throttle_first_count)
+    with pytest.raises(ClientError):
+        render_batch(farm, batches[0], tmp_path, 'first')
+    assert batch_item(farm, batches[0])['batch_status'] == 'Complete'
+    # The redelivered message finishes the count instead of skipping the completed batch
+    assert render_batch(farm, batches[0], tmp_path, 'redelivered')
+    assert render_batch(farm, batches[1], tmp_path, 'second')
+    # Only the first count of each batch takes effect
+    assert render_batch(farm, batches[1], tmp_path, 'duplicate')
+    job = farm.aws.ddb_peek('JobTable', {'job': batches[0]['job']})
+    assert job['remaining'] == 0
+    assert job['job_status'] == 'Processing'
+    assert [json.loads(m['Body'])['type'] for m in farm.aws.sqs_receive('JobQueueHigh', 10, 0)] == ['sequence']
+
+
+def test_tile_arriving_after_the_job_finished_is_skipped(farm, tmp_path):
+    tiles = submit(farm, 1, 1, tiles=4)
+    assert [tile['type'] for tile in tiles] == ['tile'] * 4
+    farm.aws.ddb_delete('BatchTable', {'job': tiles[0]['job'], 'batch': farm.worker.batch_key('1', '1')})
+    work = str(tmp_path / 'task') + '/'
+    os.mkdir(work)
+    tile = tiles[0]
+    success, log = farm.worker.tile_job(tile['job'], tile['file'], tile['scene'], tile['start'], tile['tile'],
+                                        tile['grid'], [], work)
+    assert success
+    assert batch_item(farm, tile) is None
+
+
+def test_failed_job_is_resubmitted_for_its_missing_frames(farm, tmp_path):
+    batch, = submit(farm, 1, 3)
+    assert render_batch(farm, batch, tmp_path)
+    farm.aws.sqs_receive('JobQueueHigh', 10, 0)
+    farm.aws.ddb_update('JobTable', {'job': batch['job']}, 'set job_status = :failed', None, None,
+                        {':failed': 'Failed'})
+    farm.aws.ddb_delete('RenderCacheTable', {'scene': batch['scene'], 'frame': 2})
+
+    rerun, = submit(farm, 1, 3)
+    assert (rerun['start'], rerun['end']) == ('2', '2')
+    job = farm.aws.ddb_peek('JobTable', {'job': batch['job']})
+    assert job['job_status'] == 'Waiting' and job['remaining'] == 1 and 'counted' not in job
+    assert batch_item(farm, batch) is None
+
+
+def test_complete_job_is_resubmitted_only_when_its_scene_changed(farm):
+    batch, = submit(farm, 1, 3)
+    farm.aws.ddb_update('JobTable', {'job': batch['job']}, 'set job_status = :complete', None, None,
+                        {':complete': 'Complete'})
+    assert submit(farm, 1, 3) == []
+    assert farm.aws.ddb_peek('JobTable', {'job': batch['job']})['job_status'] == 'Complete'
+
+    farm.aws.s3_put('render-files-bucket', 'a.blend', b'BLENDER-v300 changed')
+    rerun, = submit(farm, 1, 3)
+    assert rerun['scene'] != batch['scene']
+
+
+def test_single_frame_batch_records_its_render_time_without_the_scene_load(farm, tmp_path):
+    batch, = submit(farm, 1, 1)
+    render = farm.worker.render
+
+    def slow_loading_render(*args, **kwargs):
+        time.sleep(0.2)
+        return render(*args, **kwargs)
+
+    farm.worker.render = slow_loading_render
+    assert render_batch(farm, batch, tmp_path)
+    frame_times = farm.aws.ddb_peek('FrameTimeTable', {'file': 'a.blend'})['frame_times']
+    assert list(frame_times) == ['1']
+    assert frame_times['1'] < 0.1
+
+
+def ranges(batches: list) -> list:
+    return [(int(batch['start']), int(batch['end'])) for batch in batches]
+
+
+def test_split_job_batches_skip_cached_frames(farm):
+    batches = farm.server.split_job('j', 'a.blend', '1', '10', cached={4, 5})
+    assert ranges(batches) == [(1, 3), (6, 8), (9, 10)]
+
+
+def test_split_job_batches_by_estimated_duration(farm):
+    # Cheap frames first, then frames ten times as expensive, with a cached frame in each half
+    frame_times = {1: 10, 10: 10, 11: 100, 20: 100}
+    batches = farm.server.split_job('j', 'a.blend', '1', '20', frame_times, cached={5, 15})
+    # Batches end at a cached frame or once their estimated time reaches the target, so the expensive frames get one
+    # frame each
+    assert ranges(batches) == [(1, 4), (6, 11), (12, 12), (13, 13), (14, 14),
+                               (16, 16), (17, 17), (18, 18), (19, 19), (20, 20)]
@@ -0,0 +1,36 @@
+import os
+
+from harness.fake_boto3 import S3Client
+from harness.farm import ROOT, load_component
+
+frame_stream = load_component(os.path.join(ROOT, 'worker', 'frame_stream.py'), 'frame_stream')
+
+
+def test_whole_objects_are_read_one_each():
+    assert frame_stream.plan_reads(['a.png', 'b.png']) == [('a.png', None, [(0, None)]), ('b.png', None, [(0, None)])]
+
+
+def test_consecutive_bundle_frames_share_a_ranged_read():
+    # Tar members are 512 byte headers apart
+    frames = [('bundle', 512, 100), ('bundle', 1536, 200), ('bundle', 2560, 50)]
+    assert frame_stream.plan_reads(frames) == [('bundle', (512, 2609), [(0, 100), (1024, 200), (2048, 50)])]
+
+
+def test_reads_split_at_max_frames_other_objects_and_backward_offsets():
+    frames = [('x', 0, 10), ('x', 10, 10), ('x', 20, 10), ('y', 0, 10), ('y', 0, 10), 'z.png', ('y', 10, 10)]
+    assert frame_stream.plan_reads(frames, max_frames=2) == [
+        ('x', (0, 19), [(0, 10), (10, 10)]),
+        ('x', (20, 29), [(0, 10)]),
+        ('y', (0, 9), [(0, 10)]),
+        ('y', (0, 9), [(0, 10)]),
+        ('z.png', None, [(0, None)]),
+        ('y', (10, 19), [(0, 10)]),
+    ]
+
+
+def test_stream_yields_frames_in_order_from_objects_and_bundles(aws):
+    aws.s3_put('png-files-bucket', 'bundle', b'..AAAA..BBBBBB..CC')
+    aws.s3_put('png-files-bucket', 'd.png', b'DDD')
+    frames = [('bundle', 2, 4), ('bundle', 8, 6), 'd.png', ('bundle', 16, 2)]
+    assert list(frame_stream.stream_frames(S3Client(aws), 'png-files-bucket', frames, threads=2, window=2)) == \
+        [b'AAAA', b'BBBBBB', b'DDD', b'CC']
@@ -0,0 +1,30 @@
+import os
+import stat
+import sys
+
+from harness.farm import ROOT, load_component
+
+local_render = load_component(os.path.join(ROOT, 'client', 'local_render.py'), 'local_render')
+
+FAKE_BLENDER = f'''#!{sys.executable}
+import sys
+args = sys.argv
+output = args[args.index('-o') + 1]
+for frame in range(int(args[args.index('-s') + 1]), int(args[args.index('-e') + 1]) + 1):
+    print(f"Saved: '{{output}}{{frame:04d}}.png'", flush=True)
+'''
+
+
+def test_first_frame_of_each_batch_is_logged_as_first_frame(tmp_path, monkeypatch):
+    blender = tmp_path / 'blender'
+    blender.write_text(FAKE_BLENDER)
+    blender.chmod(blender.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(local_render, 'BLENDER_PATH', str(blender))
+    log = local_render.TimingLog('a_1-6')
+
+    for start, end in local_render.split_range(1, 6):
+        frames = local_render.render_batch('a.blend', 'a/a', start, end, 1, log)
+        assert frames == ['a/a%04d.png' % frame for frame in range(start, end + 1)]
+
+    stages = [line.split()[1] for line in log.lines if ',Span ' in line]
+    assert stages == ['first_frame', 'frame', 'frame', 'render'] * 2
@@ -0,0 +1,48 @@
+import json
+import os
+
+import pytest
+
+from harness.farm import ROOT, load_component
+
+
+@pytest.fixture
+def logger(aws):
+    return load_component(os.path.join(ROOT, 'logger', 'lambda_logger.py'), 'lambda_logger')
+
+
+def record(payload: dict, sent_ms: int) -> dict:
+    return {'body': json.dumps(payload), 'attributes': {'SentTimestamp': str(sent_ms)}}
+
+
+def test_records_are_grouped_by_kind_worker_and_window(logger):
+    groups = logger.group_records([
+        record({'id': 1, 'type': 'log', 'success': True, 'message': '61.0,Rendered\n'}, 61000),
+        record({'id': 1, 'type': 'log', 'success': True, 'message': '60.5,Downloaded\n'}, 60500),
+        record({'id': 1, 'type': 'log', 'success': True, 'message': '121.0,Sequenced\n'}, 121000),
+        record({'id': 2, 'type': 'log', 'success': True, 'message': '62.0,Rendered\n'}, 62000),
+        record({'id': 1, 'type': 'error', 'state': 'Rendering animation', 'message': 'Blender\ncrashed'}, 63250),
+    ])
+    assert groups == {
+        ('segments/', '1', 60): [(61, '61.0,Rendered\n'), (60, '60.5,Downloaded\n')],
+        ('segments/', '1', 120): [(121, '121.0,Sequenced\n')],
+        ('segments/', '2', 60): [(62, '62.0,Rendered\n')],
+        ('error-segments/', '1', 60): [(63, '63.25,Rendering animation: Blender crashed\n')],
+    }
+
+
+def test_compaction_keeps_logs_and_errors_in_separate_files(aws, logger):
+    logger.lambda_handler({'Records': [
+        record({'id': 7, 'type': 'log', 'success': True, 'message': '61.0,Rendered\n'}, 61000),
+        record({'id': 7, 'type': 'log', 'success': True, 'message': '60.5,Downloaded\n'}, 60500),
+        record({'id': 7, 'type': 'error', 'state': 'Clean up', 'message': 'No such file'}, 62000),
+    ]}, None)
+    logger.lambda_handler({'Records': [
+        record({'id': 7, 'type': 'log', 'success': True, 'message': '125.0,Sequenced\n'}, 125000),
+    ]}, None)
+    logger.lambda_handler({'compact': True}, None)
+
+    assert sorted(aws.s3_keys('worker-logging-bucket')) == ['7.csv', 'errors/7.csv']
+    assert aws.s3_get('worker-logging-bucket', '7.csv') == (b'timestamp,status\n60.5,Downloaded\n61.0,Rendered\n'
+                                                            b'125.0,Sequenced\n')
+    assert aws.s3_get('worker-logging-bucket', 'errors/7.csv') == b'timestamp,status\n62.0,Clean up: No such file\n'
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from harness.farm import ROOT, load_component
+
+resources = load_component(os.path.join(ROOT, 'worker', 'resources.py'), 'resources')
+
+GB = 1024 ** 3
+
+
+@pytest.fixture
+def cgroup(tmp_path, monkeypatch):
+    """An empty cgroup filesystem; write files into it with cgroup(path, contents)."""
+    monkeypatch.setattr(resources, 'CGROUP_ROOT', str(tmp_path))
+    monkeypatch.setattr(resources, 'SLOT_CPUS', 4)
+    monkeypatch.setattr(resources, 'SLOT_MEMORY', 4 * GB)
+    for name in ('RENDER_SLOTS', 'RENDER_THREADS', 'CPU_REQUEST_MILLICORES'):
+        monkeypatch.delenv(name, raising=False)
+
+    def write(path: str, contents: str):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(contents + '\n')
+    return write
+
+
+def test_no_cgroup_files_means_no_limits(cgroup):
+    assert resources.cgroup_cpu_quota() is None
+    assert resources.cgroup_memory_limit() is None
+
+
+def test_cgroup_v2_limits(cgroup):
+    cgroup('cpu.max', '250000 100000')
+    cgroup('memory.max', str(8 * GB))
+    assert resources.cgroup_cpu_quota() == 2.5
+    assert resources.cgroup_memory_limit() == 8 * GB
+
+
+def test_cgroup_v2_without_limits(cgroup):
+    cgroup('cpu.max', 'max 100000')
+    cgroup('memory.max', 'max')
+    assert resources.cgroup_cpu_quota() is None
+    assert resources.cgroup_memory_limit() is None
+
+
+def test_cgroup_v1_limits(cgroup):
+    cgroup('cpu,cpuacct/cpu.cfs_quota_us', '150000')
+    cgroup('cpu,cpuacct/cpu.cfs_period_us', '100000')
+    cgroup('memory/memory.limit_in_bytes', str(4 * GB))
+    assert resources.cgroup_cpu_quota() == 1.5
+    assert resources.cgroup_memory_limit() == 4 * GB
+
+
+def test_cgroup_v1_without_limits(cgroup):
+    cgroup('cpu/cpu.cfs_quota_us', '-1')
+    cgroup('cpu/cpu.cfs_period_us', '100000')
+    cgroup('memory/memory.limit_in_bytes', '9223372036854771712')
+    assert resources.cgroup_cpu_quota() is None
+    assert resources.cgroup_memory_limit() is None
+
+
+def test_cpu_request_stands_in_for_a_missing_quota(cgroup, monkeypatch):
+    monkeypatch.setenv('CPU_REQUEST_MILLICORES', '500')
+    assert resources.cpu_limit() == 0.5
+
+
+def test_slots_are_limited_by_cpus_and_memory(cgroup):
+    assert resources.render_slots(cpus=16, memory=None) == (4, 4)
+    assert resources.render_slots(cpus=16, memory=8 * GB) == (2, 8)
+    assert resources.render_slots(cpus=2, memory=GB) == (1, 2)
+
+
+def test_slots_and_threads_can_be_set_by_hand(cgroup, monkeypatch):
+    monkeypatch.setenv('RENDER_SLOTS', '3')
+    assert resources.render_slots(cpus=12, memory=GB) == (3, 4)
+    monkeypatch.setenv('RENDER_THREADS', '2')
+    assert resources.render_slots(cpus=12, memory=GB) == (3, 2)
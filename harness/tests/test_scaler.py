@@ -0,0 +1,17 @@
+import os
+
+from harness.farm import ROOT, load_component
+
+scaler = load_component(os.path.join(ROOT, 'scaler', 'scaler.py'), 'scaler')
+
+
+def test_recommendation_divides_the_backlog_between_render_slots():
+    for slots, replicas in ((None, 9), (1, 9), (2, 5), (4, 3)):
+        queue = scaler.LocalQueue(40, 5)
+        autoscaler = scaler.Scaler([queue], lambda: (120, slots))
+        assert autoscaler.desired_replicas(0) == replicas
+
+
+def test_empty_queues_scale_to_the_minimum():
+    autoscaler = scaler.Scaler([scaler.LocalQueue(0, 0)], lambda: (120, 2))
+    assert autoscaler.desired_replicas(0) == scaler.MIN_REPLICAS
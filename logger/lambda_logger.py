@@ -1,26 +1,96 @@
-import boto3
-from botocore.exceptions import ClientError
+import json
+import uuid
 
-s3 = boto3.client('s3', region_name='us-east-1')
+import aws_clients
+
+s3 = aws_clients.lazy_client('s3')
 bucket_name = 'worker-logging-bucket'
+segment_prefix = 'segments/'
+# Error reports are segmented apart from the logs and compacted into errors/<id>.csv
+error_segment_prefix = 'error-segments/'
+error_prefix = 'errors/'
+
+WINDOW_SECONDS = 60
+
+
+def error_line(sent_ms: int, payload: dict) -> str:
+    """An error report as a line of the CSV log format, on one line however many its message spans."""
+    message = ' '.join(f"{payload.get('state', 'Error')}: {payload.get('message', '')}".split())
+    return f'{sent_ms / 1000},{message}\n'
+
+
+def group_records(records):
+    """Groups log messages and error reports by their segment prefix, worker id and the window they were sent in."""
+    groups = dict()
+    for record in records:
+        payload = json.loads(record['body'])
+        sent_ms = int(record['attributes']['SentTimestamp'])
+        sent = sent_ms // 1000
+        window = sent - sent % WINDOW_SECONDS
+        if payload['type'] == 'log':
+            prefix, message = segment_prefix, payload['message']
+        elif payload['type'] == 'error':
+            prefix, message = error_segment_prefix, error_line(sent_ms, payload)
+        else:
+            continue
+        groups.setdefault((prefix, str(payload['id']), window), []).append((sent, message))
+    return groups
+
+
+def write_segments(groups):
+    """
+    Writes each group as a new, immutable segment object.
+
+    Every invocation writes unique keys, so concurrent invocations never overwrite each other's logs.
+    """
+    for (prefix, id, window), messages in groups.items():
+        messages.sort(key=lambda m: m[0])
+        body = ''.join(message for _, message in messages)
+        key = f'{prefix}{id}/{window:012d}-{uuid.uuid4().hex}.csv'
+        s3.put_object(Bucket=bucket_name, Key=key, Body=body.encode('utf-8'))
+
+
+def list_segments(prefix=segment_prefix):
+    """Returns the segment keys under the prefix of each worker, oldest window first."""
+    segments = dict()
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            id = obj['Key'][len(prefix):].split('/')[0]
+            segments.setdefault(id, []).append(obj['Key'])
+    for keys in segments.values():
+        keys.sort()
+    return segments
+
+
+def compact_segments(prefix, log_prefix=''):
+    """Merges each worker's segments under the prefix into its <log_prefix><id>.csv file, then deletes them."""
+    for id, keys in list_segments(prefix).items():
+        filename = log_prefix + id + '.csv'
+        try:
+            log = s3.get_object(Bucket=bucket_name, Key=filename)['Body'].read()
+        except s3.exceptions.NoSuchKey:
+            log = b'timestamp,status\n'
+        for key in keys:
+            log += s3.get_object(Bucket=bucket_name, Key=key)['Body'].read()
+        s3.put_object(Bucket=bucket_name, Key=filename, Body=log)
+        for i in range(0, len(keys), 1000):
+            s3.delete_objects(Bucket=bucket_name, Delete={'Objects': [{'Key': k} for k in keys[i:i + 1000]]})
+
+
+def compact():
+    """
+    Merges each worker's log segments into its <id>.csv log file, and its error segments into errors/<id>.csv.
+
+    Run this from a schedule with a reserved concurrency of 1; segments written while it runs are left for the next
+    compaction.
+    """
+    compact_segments(segment_prefix)
+    compact_segments(error_segment_prefix, error_prefix)
 
 
 def lambda_handler(event, context):
-    for record in event['Records']:
-        payload = record['Body']
-        if payload['type'] == 'error':
-            # Leave the error message in the queue
-            pass
-        elif payload['type'] == 'log':
-            # Upload the log to S3
-            id = payload['id']
-            message = payload['message']
-            filename = str(id) + '.csv'
-            try:
-                s3.download_file(bucket_name, filename, '/temp/' + filename)
-                with open('/temp/' + filename, 'a') as f:
-                    f.write(message)
-            except ClientError as e:
-                with open('/temp/' + filename, 'w') as f:
-                    f.write(message)
-            s3.upload_file('/temp/' + filename, bucket_name, filename)
+    if event.get('compact'):
+        compact()
+        return
+    write_segments(group_records(event['Records']))
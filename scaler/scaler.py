@@ -0,0 +1,161 @@
+import argparse
+import math
+import re
+import subprocess
+import time
+
+DEPLOYMENT = 'worker-deployment'
+MIN_REPLICAS = 1
+MAX_REPLICAS = 10
+TARGET_DRAIN_SECONDS = 600
+DEFAULT_BATCH_SECONDS = 180
+SCALE_DOWN_WINDOW = 300
+INTERVAL = 15
+JOB_QUEUES = ['JobQueueHigh', 'JobQueue', 'JobQueueLow']
+
+RENDER_SUM_PATTERN = re.compile(r'^worker_stage_seconds_sum\{stage="render"\} (\S+)$', re.MULTILINE)
+RENDER_COUNT_PATTERN = re.compile(r'^worker_stage_seconds_count\{stage="render"\} (\S+)$', re.MULTILINE)
+SLOTS_PATTERN = re.compile(r'^worker_render_slots (\S+)$', re.MULTILINE)
+
+
+class LocalQueue:
+    """Stand-in for an SQS queue resource that reports fixed message counts, for dry runs."""
+
+    def __init__(self, visible: int = 0, in_flight: int = 0):
+        self.attributes = dict()
+        self.set_depth(visible, in_flight)
+
+    def set_depth(self, visible: int, in_flight: int):
+        self.attributes['ApproximateNumberOfMessages'] = str(visible)
+        self.attributes['ApproximateNumberOfMessagesNotVisible'] = str(in_flight)
+
+    def reload(self):
+        pass
+
+
+def kubectl(*args) -> str:
+    result = subprocess.run(['kubectl', *args], check=True, capture_output=True)
+    return result.stdout.decode('utf-8')
+
+
+def scrape_metrics():
+    """
+    Returns the mean render time per batch and the mean number of render slots per pod, across the worker pods'
+    /metrics; either is None if no pod reported it.
+    """
+    total, count = 0.0, 0.0
+    slots = []
+    pods = kubectl('get', 'pods', '-l', 'app=worker', '-o', 'jsonpath={.items[*].metadata.name}').split()
+    for pod in pods:
+        try:
+            metrics = kubectl('get', '--raw', f'/api/v1/namespaces/default/pods/{pod}:3000/proxy/metrics')
+        except subprocess.CalledProcessError:
+            continue
+        sums = RENDER_SUM_PATTERN.search(metrics)
+        counts = RENDER_COUNT_PATTERN.search(metrics)
+        if sums and counts:
+            total += float(sums.group(1))
+            count += float(counts.group(1))
+        pod_slots = SLOTS_PATTERN.search(metrics)
+        if pod_slots:
+            slots.append(float(pod_slots.group(1)))
+    return total / count if count else None, sum(slots) / len(slots) if slots else None
+
+
+class Scaler:
+    """
+    Sizes the worker deployment from the backlog across the job queues, the measured render time per batch and the
+    number of batches each pod renders at once.
+
+    It asks for enough pods to drain the backlog within target_drain_seconds. Scaling up is immediate; scaling down
+    uses the largest recommendation from the last scale_down_window seconds, so a brief dip doesn't evict pods that
+    are about to be needed again.
+    metrics: returns the measured (batch seconds, render slots per pod), either None until the pods report it
+    """
+
+    def __init__(self, queues: list, metrics=scrape_metrics, min_replicas: int = MIN_REPLICAS,
+                 max_replicas: int = MAX_REPLICAS, target_drain_seconds: float = TARGET_DRAIN_SECONDS,
+                 scale_down_window: float = SCALE_DOWN_WINDOW):
+        self.queues = queues
+        self.metrics = metrics
+        self.min_replicas = min_replicas
+        self.max_replicas = max_replicas
+        self.target_drain_seconds = target_drain_seconds
+        self.scale_down_window = scale_down_window
+        self.recommendations = []
+        self.measured_batch_seconds = DEFAULT_BATCH_SECONDS
+        self.slots_per_pod = 1
+
+    def backlog(self):
+        """Returns the number of batches waiting in the queues and being processed."""
+        visible, in_flight = 0, 0
+        for queue in self.queues:
+            queue.reload()
+            visible += int(queue.attributes['ApproximateNumberOfMessages'])
+            in_flight += int(queue.attributes['ApproximateNumberOfMessagesNotVisible'])
+        return visible, in_flight
+
+    def recommend(self, visible: int, in_flight: int) -> int:
+        """The replica count needed to finish the current backlog by the deadline."""
+        if visible + in_flight == 0:
+            return self.min_replicas
+        # Each pod works through its share of the backlog one batch per render slot at a time
+        work = (visible + in_flight) * self.measured_batch_seconds
+        replicas = math.ceil(work / (self.target_drain_seconds * self.slots_per_pod))
+        return max(self.min_replicas, min(self.max_replicas, replicas))
+
+    def desired_replicas(self, now: float) -> int:
+        batch_seconds, slots_per_pod = self.metrics()
+        if batch_seconds:
+            self.measured_batch_seconds = batch_seconds
+        if slots_per_pod:
+            self.slots_per_pod = slots_per_pod
+        visible, in_flight = self.backlog()
+        self.recommendations.append((now, self.recommend(visible, in_flight)))
+        self.recommendations = [(t, r) for t, r in self.recommendations if now - t <= self.scale_down_window]
+        return max(r for _, r in self.recommendations)
+
+
+def current_replicas() -> int:
+    return int(kubectl('get', 'deployment', DEPLOYMENT, '-o', 'jsonpath={.spec.replicas}'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Queue-depth autoscaler for the worker deployment')
+    parser.add_argument('--dry-run', action='store_true', help='print decisions instead of scaling the deployment')
+    parser.add_argument('--local-queue', nargs=2, type=int, metavar=('VISIBLE', 'IN_FLIGHT'),
+                        help='use a local queue stand-in with fixed depths instead of the job queues (implies --dry-run)')
+    parser.add_argument('--batch-seconds', type=float, help='use a fixed render time per batch instead of scraping')
+    parser.add_argument('--slots', type=float, default=1,
+                        help='render slots per pod to assume along with --batch-seconds (default 1)')
+    args = parser.parse_args()
+
+    if args.local_queue:
+        queues = [LocalQueue(*args.local_queue)]
+        args.dry_run = True
+    else:
+        import boto3
+        sqs = boto3.resource('sqs', region_name='us-east-1')
+        queues = [sqs.get_queue_by_name(QueueName=name) for name in JOB_QUEUES]
+    if args.batch_seconds or args.local_queue:
+        metrics = lambda: (args.batch_seconds, args.slots)
+    else:
+        metrics = scrape_metrics
+    scaler = Scaler(queues, metrics)
+
+    while True:
+        desired = scaler.desired_replicas(time.time())
+        if args.dry_run:
+            visible, in_flight = scaler.backlog()
+            print(f'{time.time()},visible={visible} in_flight={in_flight} '
+                  f'batch_seconds={scaler.measured_batch_seconds:.1f} slots={scaler.slots_per_pod:g} desired={desired}')
+        else:
+            replicas = current_replicas()
+            if desired != replicas:
+                kubectl('scale', 'deployment', DEPLOYMENT, f'--replicas={desired}')
+                print(f'{time.time()},Scaled {DEPLOYMENT} from {replicas} to {desired} replicas')
+        time.sleep(INTERVAL)
+
+
+if __name__ == '__main__':
+    main()
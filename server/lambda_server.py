@@ -1,17 +1,47 @@
+import bisect
+import hashlib
 import json
-import boto3
+import math
+import time
+import botocore.exceptions
+from boto3.dynamodb.conditions import Key
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('JobTable')
-s3 = boto3.client('s3', region_name='us-east-1')
-sqs = boto3.resource('sqs', region_name='us-east-1')
-queue = sqs.get_queue_by_name(QueueName='JobQueue')
+import aws_clients
+
+table = aws_clients.lazy_table('JobTable')
+batch_table = aws_clients.lazy_table('BatchTable')
+frame_time_table = aws_clients.lazy_table('FrameTimeTable')
+cache_table = aws_clients.lazy_table('RenderCacheTable')
+s3 = aws_clients.lazy_client('s3')
+
+# Workers poll the queues of every priority, favouring higher ones, so small interactive jobs can overtake bulk work
+PRIORITY_QUEUES = {'high': 'JobQueueHigh', 'normal': 'JobQueue', 'low': 'JobQueueLow'}
+queues = {priority: aws_clients.lazy_queue(name) for priority, name in PRIORITY_QUEUES.items()}
 
 JOB_SIZE = 3
+TARGET_BATCH_SECONDS = 300
+BATCH_OVERHEAD_SECONDS = 20
+MIN_BATCH_SECONDS = BATCH_OVERHEAD_SECONDS * 5
+MAX_PODS = 10
+BATCHES_PER_POD = 4
+SEND_ATTEMPTS = 5
+# Jobs without an explicit priority are prioritised by their estimated render time, in pod-seconds
+DEFAULT_FRAME_SECONDS = 60
+INTERACTIVE_SECONDS = 30 * 60
+BULK_SECONDS = 24 * 3600
+# Frames are split into image tiles, rendered by separate pods, when a job has fewer frames than there are pods and
+# each frame is slow to render
+MAX_TILES = 16
+TILE_MIN_FRAME_SECONDS = 10 * 60
+# Part of every render cache key; change it when the workers' render command changes
+RENDER_SETTINGS = 'engine=CYCLES;format=PNG'
+# Sort key of the cache index item that summarises a scene's cached frames
+SUMMARY_FRAME = -1
 bucket_name = 'render-files-bucket'
+png_bucket_name = 'png-files-bucket'
 
 
-def validate_input(filename, start_frame, end_frame):
+def validate_input(filename, start_frame, end_frame, priority=None, assets=(), tiles=None):
     if len(filename) < 7 or filename[-6:] != '.blend':
         return {
             'statusCode': 400,
@@ -27,77 +57,351 @@ def validate_input(filename, start_frame, end_frame):
             'statusCode': 400,
             'body': 'Bad Request: Start frame must be less than end frame.'
         }
+    elif not isinstance(assets, list) or not all(isinstance(a, str) for a in assets):
+        return {
+            'statusCode': 400,
+            'body': 'Bad Request: Assets must be a list of file names.'
+        }
+    elif tiles is not None and (not isinstance(tiles, int) or not 1 <= tiles <= MAX_TILES):
+        return {
+            'statusCode': 400,
+            'body': f'Bad Request: Tiles must be an integer from 1 to {MAX_TILES}.'
+        }
+    elif priority is not None and priority not in PRIORITY_QUEUES:
+        return {
+            'statusCode': 400,
+            'body': 'Bad Request: Priority must be one of ' + ', '.join(PRIORITY_QUEUES) + '.'
+        }
     else:
         return None
 
 
-def file_in_s3(filename):
-    keys = s3.list_objects_v2(Bucket=bucket_name, Prefix=filename)
-    return 'Contents' in keys
+def job_id(filename, start_frame, end_frame):
+    """Jobs are identified by file and frame range, so one file can be rendered over several ranges at once."""
+    return '%s_%d-%d' % (filename[:-6], int(start_frame), int(end_frame))
+
+
+def file_etag(filename):
+    """The ETag of the Blender file in S3, or None if there is no object with exactly this name."""
+    head = aws_clients.head_object(bucket_name, filename)
+    return None if head is None else head['ETag']
+
+
+def scene_hash(etag, assets=()):
+    """
+    Content hash of a render: the .blend file and linked assets, by their S3 ETags, and the render settings.
+
+    Frames rendered from the same scene hash are identical, whatever the job or file name.
+    """
+    scene = hashlib.sha256(RENDER_SETTINGS.encode('utf-8'))
+    scene.update(etag.encode('utf-8'))
+    for key in sorted(assets):
+        etag = s3.head_object(Bucket=bucket_name, Key=key)['ETag']
+        scene.update(f'\n{key}:{etag}'.encode('utf-8'))
+    return scene.hexdigest()[:32]
 
 
-def split_job(filename, start_frame, end_frame):
-    n_frames = int(end_frame) - int(start_frame) + 1
-    n_jobs = n_frames // JOB_SIZE
+def get_cached_frames(scene, start, end):
+    """Returns the frames in the range that are already in the render cache, and marks the scene as used."""
+    frames = set()
+    kwargs = {'KeyConditionExpression': Key('scene').eq(scene) & Key('frame').between(int(start), int(end))}
+    while True:
+        response = cache_table.query(**kwargs)
+        frames.update(int(item['frame']) for item in response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    if frames:
+        cache_table.update_item(
+            Key={'scene': scene, 'frame': SUMMARY_FRAME},
+            UpdateExpression='set last_used = :now',
+            ExpressionAttributeValues={':now': int(time.time())}
+        )
+    return frames
+
+
+def get_frame_times(filename):
+    """Returns the per-frame render times (in seconds) recorded by the workers for this file."""
+    response = frame_time_table.get_item(Key={'file': filename})
+    if 'Item' not in response:
+        return dict()
+    return {int(frame): float(t) for frame, t in response['Item']['frame_times'].items()}
+
+
+def estimate_frame_times(frame_times, start, end):
+    """Estimates each frame's render time from the nearest frame with a recorded time."""
+    known = sorted(frame_times)
+    estimates = dict()
+    for frame in range(start, end + 1):
+        if frame in frame_times:
+            estimates[frame] = frame_times[frame]
+            continue
+        # The nearest recorded frame is the one either side of where the frame would be in the sorted list
+        i = bisect.bisect_left(known, frame)
+        nearest = min(known[max(0, i - 1):i + 1], key=lambda f: abs(f - frame))
+        estimates[frame] = frame_times[nearest]
+    return estimates
+
+
+def target_batch_seconds(total_seconds):
+    """
+    Picks a batch duration that gives every pod a few batches to work through.
+
+    It is capped at TARGET_BATCH_SECONDS to limit stragglers, and kept above MIN_BATCH_SECONDS so the per-batch
+    startup overhead stays a small fraction of each batch.
+    """
+    spread = total_seconds / (MAX_PODS * BATCHES_PER_POD)
+    return max(MIN_BATCH_SECONDS, min(TARGET_BATCH_SECONDS, spread))
+
+
+def estimate_job_seconds(start_frame, end_frame, frame_times=None, cached=()):
+    """Estimated render time of the frames that aren't cached, in pod-seconds."""
+    start, end = int(start_frame), int(end_frame)
+    if not frame_times:
+        return sum(DEFAULT_FRAME_SECONDS for frame in range(start, end + 1) if frame not in cached)
+    estimates = estimate_frame_times(frame_times, start, end)
+    return sum(t for frame, t in estimates.items() if frame not in cached)
+
+
+def job_priority(seconds):
+    """Shortest jobs first: previews go to the high priority queue and very long renders to the low one."""
+    if seconds <= INTERACTIVE_SECONDS:
+        return 'high'
+    if seconds >= BULK_SECONDS:
+        return 'low'
+    return 'normal'
+
+
+def split_job(job, filename, start_frame, end_frame, frame_times=None, cached=()):
+    """
+    Splits the frames of the range that aren't in cached into render batches.
+
+    Without any render time history, batches are JOB_SIZE frames long. Otherwise frames are packed into batches of
+    roughly equal estimated duration, so expensive ranges of the animation get smaller batches. A batch never spans
+    a cached frame.
+    """
+    start, end = int(start_frame), int(end_frame)
+    if frame_times:
+        estimates = estimate_frame_times(frame_times, start, end)
+        target = target_batch_seconds(sum(t for frame, t in estimates.items() if frame not in cached))
+        overhead = BATCH_OVERHEAD_SECONDS
+    else:
+        estimates = {frame: 1 for frame in range(start, end + 1)}
+        target = JOB_SIZE
+        overhead = 0
+
+    def batch(s, e):
+        return {'type': 'render', 'job': job, 'file': filename, 'start': str(s), 'end': str(e)}
+
     jobs = []
-    for i in range(n_jobs):
-        s = i * JOB_SIZE + 1
-        e = s + JOB_SIZE - 1
-        job = {'type': 'render', 'file': filename, 'start': str(s), 'end': str(e)}
-        jobs.append(job)
-    if n_frames % JOB_SIZE > 0:
-        s = n_frames - (n_frames % JOB_SIZE) + 1
-        job = {'type': 'render', 'file': filename, 'start': str(s), 'end': str(end_frame)}
-        jobs.append(job)
+    s = None
+    cost = overhead
+    for frame in range(start, end + 1):
+        if frame in cached:
+            if s is not None:
+                jobs.append(batch(s, frame - 1))
+                s = None
+                cost = overhead
+            continue
+        if s is None:
+            s = frame
+        cost += estimates[frame]
+        if cost >= target or frame == end:
+            jobs.append(batch(s, frame))
+            s = None
+            cost = overhead
     return jobs
 
 
-def submit_render_job(filename, start_frame, end_frame):
+def tiles_per_frame(frames, seconds):
+    """Enough tiles per frame to give every pod work, if the frames are slow enough to be worth splitting."""
+    if frames == 0 or frames >= MAX_PODS or seconds / frames < TILE_MIN_FRAME_SECONDS:
+        return 1
+    return min(MAX_TILES, math.ceil(MAX_PODS / frames))
+
+
+def tile_grid(tiles):
+    """The rows and columns of a near-square grid of at least the given number of tiles."""
+    cols = math.ceil(math.sqrt(tiles))
+    return math.ceil(tiles / cols), cols
+
+
+def split_tiles(job, filename, frames, tiles):
+    """One batch per frame, each rendered as a grid of tile jobs that are stitched into the frame."""
+    rows, cols = tile_grid(tiles)
+    batches = [{'start': str(frame), 'end': str(frame), 'tiles': rows * cols} for frame in frames]
+    jobs = [{'type': 'tile', 'job': job, 'file': filename, 'start': batch['start'], 'end': batch['end'],
+             'tile': tile, 'grid': [rows, cols]} for batch in batches for tile in range(rows * cols)]
+    return batches, jobs
+
+
+def batch_key(start, end):
+    """Sort key of a batch item; zero padded so that batches sort in frame order."""
+    return '%06d-%06d' % (int(start), int(end))
+
+
+def send_jobs(jobs, priority='normal'):
+    """Sends jobs to the priority's queue ten at a time, retrying any entries that SQS reports as failed."""
+    queue = queues[priority]
+    for i in range(0, len(jobs), 10):
+        entries = {str(j): json.dumps(job) for j, job in enumerate(jobs[i:i + 10])}
+        for attempt in range(SEND_ATTEMPTS):
+            response = queue.send_messages(
+                Entries=[{'Id': id, 'MessageBody': body} for id, body in entries.items()]
+            )
+            failed = response.get('Failed', [])
+            entries = {f['Id']: entries[f['Id']] for f in failed if not f['SenderFault']}
+            if any(f['SenderFault'] for f in failed):
+                raise Exception(f'Failed to send jobs: {failed}')
+            if not entries:
+                break
+            time.sleep(0.1 * 2 ** attempt)
+        else:
+            raise Exception(f'Failed to send jobs after {SEND_ATTEMPTS} attempts')
+
+
+def delete_batches(job):
+    """Deletes the batch items left by an earlier run of the job, and the segments they point to."""
+    items = []
+    kwargs = {'KeyConditionExpression': Key('job').eq(job)}
+    while True:
+        response = batch_table.query(**kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    segments = [item['segment'] for item in items if 'segment' in item]
+    for i in range(0, len(segments), 1000):
+        s3.delete_objects(Bucket=png_bucket_name,
+                          Delete={'Objects': [{'Key': key} for key in segments[i:i + 1000]]})
+    with batch_table.batch_writer() as writer:
+        for item in items:
+            writer.delete_item(Key={'job': item['job'], 'batch': item['batch']})
+
+
+def needs_rerun(item, filename, assets):
+    """
+    Whether a job that already exists for the range should be submitted again, rather than reported on.
+
+    A failed job is, and so is a complete one whose scene or linked assets have changed since. Either way the render
+    cache limits the new run to the frames that are missing or out of date.
+    """
+    if item['job_status'] == 'Failed':
+        return True
+    if item['job_status'] != 'Complete':
+        return False
+    etag = file_etag(filename)
+    if etag is None:
+        return False
+    try:
+        return scene_hash(etag, assets or item.get('assets', [])) != item['scene']
+    except botocore.exceptions.ClientError:
+        # A linked asset is gone; submitting again reports it
+        return True
+
+
+def submit_render_job(job, filename, start_frame, end_frame, priority=None, assets=(), tiles=None):
     # Check that the file is actually in S3
-    if not file_in_s3(filename):
+    etag = file_etag(filename)
+    if etag is None:
         return {
             'statusCode': 500,
             'body': 'Internal Server Error: Blender file not found in S3.'
         }
-
-    # Split job into batch jobs
-    jobs = split_job(filename, start_frame, end_frame)
-    batches = dict()
-
-    # Send jobs to workers via SQS queue
-    for job in jobs:
-        queue.send_message(MessageBody=json.dumps(job))
-        batches[job['start'] + '-' + job['end']] = 'Processing'
-
-    # Upload a job spec to DynamoDB
-    response = table.put_item(
-        Item={
-            'file': filename,
-            'range': start_frame + '-' + end_frame,
-            'job_status': 'Waiting',
-            'batches': batches
+    try:
+        scene = scene_hash(etag, assets)
+    except botocore.exceptions.ClientError as e:
+        return {
+            'statusCode': 500,
+            'body': f'Internal Server Error: Linked asset not found in S3: {e}'
         }
-    )
+
+    # Split the frames that aren't in the render cache into batch jobs, or into tiles if there are only a few
+    cached = get_cached_frames(scene, start_frame, end_frame)
+    frame_times = get_frame_times(filename)
+    misses = [frame for frame in range(int(start_frame), int(end_frame) + 1) if frame not in cached]
+    seconds = estimate_job_seconds(start_frame, end_frame, frame_times, cached)
+    if tiles is None:
+        tiles = tiles_per_frame(len(misses), seconds)
+    if tiles > 1:
+        batches, jobs = split_tiles(job, filename, misses, tiles)
+    else:
+        batches = jobs = split_job(job, filename, start_frame, end_frame, frame_times, cached)
+    for message in jobs:
+        message['scene'] = scene
+        if assets:
+            message['assets'] = assets
+    if priority is None:
+        priority = job_priority(seconds)
+
+    # Upload a job spec to DynamoDB, with a counter of the batches still to render
+    item = {
+        'job': job,
+        'file': filename,
+        'range': start_frame + '-' + end_frame,
+        'scene': scene,
+        'priority': priority,
+        'job_status': 'Waiting' if jobs else 'Processing',
+        'cached_frames': len(cached),
+        'n_batches': len(batches),
+        'remaining': len(batches)
+    }
+    # Kept so the watcher can resend a batch to another worker
+    if assets:
+        item['assets'] = list(assets)
+    table.put_item(Item=item)
+
+    # One item per batch, so the job record stays small however long the animation is
+    with batch_table.batch_writer() as writer:
+        for batch in batches:
+            item = {
+                'job': job,
+                'batch': batch_key(batch['start'], batch['end']),
+                'start': batch['start'],
+                'end': batch['end'],
+                'batch_status': 'Processing'
+            }
+            if 'tiles' in batch:
+                item['tiles'] = batch['tiles']
+            writer.put_item(Item=item)
+
+    # Send jobs to workers via SQS queue; if every frame is cached the job goes straight to sequencing
+    if not jobs:
+        jobs = [{'type': 'sequence', 'job': job, 'file': filename, 'scene': scene,
+                 'start': start_frame, 'end': end_frame}]
+    send_jobs(jobs, priority)
 
     # Return the status
     return {
         'statusCode': 200,
-        'body': f'Submitted render job at time {time.time()}.'
+        'body': f'Submitted render job {job} with {priority} priority ({len(cached)} frames cached) '
+                f'at time {time.time()}.'
     }
 
 
 def get_status(query_result):
-    if query_result['job_status'] == 'Finished':
+    if query_result['job_status'] == 'Complete':
+        return {
+            'statusCode': 200,
+            'body': f"Sequencing complete: {query_result['job']}.mp4 ready in S3"
+        }
+    if query_result['job_status'] == 'Failed':
+        return {
+            'statusCode': 200,
+            'body': 'Failed: frames kept leaving the render cache before sequencing; submit the job again to '
+                    're-render them'
+        }
+    n_batches = int(query_result['n_batches'])
+    if n_batches == 0:
         return {
             'statusCode': 200,
-            'body': 'Sequencing complete: MP4 file ready in S3'
+            'body': 'All frames cached: sequencing'
         }
-    batches = query_result['batches']
-    complete_batches = sum([1 if status == 'Complete' else 0 for status in batches.values()])
-    percent_render = (complete_batches / len(batches)) * 100
+    complete_batches = n_batches - int(query_result['remaining'])
+    percent_render = (complete_batches / n_batches) * 100
     return {
         'statusCode': 200,
-        'body': '%d/%d batches rendered (%.2f%%)' % (complete_batches, len(batches), percent_render)
+        'body': '%d/%d batches rendered (%.2f%%)' % (complete_batches, n_batches, percent_render)
     }
 
 
@@ -106,16 +410,24 @@ def lambda_handler(event, context):
     filename = str(event['file'])
     start_frame = str(event['start'])
     end_frame = str(event['end'])
+    priority = event.get('priority')
+    assets = event.get('assets', [])
+    tiles = event.get('tiles')
 
     # Validate the input
-    result = validate_input(filename, start_frame, end_frame)
+    result = validate_input(filename, start_frame, end_frame, priority, assets, tiles)
     if result != None:
         return result
 
-    # Check to see if the given file is being processed
-    response = table.get_item(Key={'file': filename})
+    # Check to see if this range of the file is being processed
+    job = job_id(filename, start_frame, end_frame)
+    response = table.get_item(Key={'job': job})
     if not 'Item' in response:
-        result = submit_render_job(filename, start_frame, end_frame)
+        result = submit_render_job(job, filename, start_frame, end_frame, priority, assets, tiles)
+    elif needs_rerun(response['Item'], filename, assets):
+        delete_batches(job)
+        result = submit_render_job(job, filename, start_frame, end_frame, priority,
+                                   assets or response['Item'].get('assets', []), tiles)
     else:
         result = get_status(response['Item'])
     return result
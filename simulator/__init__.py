@@ -0,0 +1,3 @@
+from .fit import fit_lognormal, frame_durations
+from .model import Report, SimConfig, SimQueue, Simulation, constant_frames, fixed_split, lognormal_frames
+from .policies import CpuPolicy, FixedPolicy, QueueDepthPolicy
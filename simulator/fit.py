@@ -0,0 +1,45 @@
+import math
+import re
+import statistics
+
+SPAN_PATTERN = re.compile(r'Span frame .*duration=([0-9.]+)')
+RENDERED_PATTERN = re.compile(r'Rendered animation .* frames (\d+) to (\d+)')
+DOWNLOADED_PATTERN = re.compile(r'Downloaded file ')
+
+
+def frame_durations(files):
+    """
+    Extracts per-frame render times from worker CSV logs.
+
+    Uses the 'Span frame' lines when the logs have them, otherwise spreads the time between each 'Downloaded file'
+    and 'Rendered animation' line evenly over the batch's frames.
+    """
+    spans = []
+    batches = []
+    for file in files:
+        downloaded = None
+        with open(file, 'r') as f:
+            for line in f:
+                if ',' not in line:
+                    continue
+                timestamp, status = line.rstrip('\n').split(',', 1)
+                match = SPAN_PATTERN.search(status)
+                if match:
+                    spans.append(float(match.group(1)))
+                elif DOWNLOADED_PATTERN.search(status):
+                    downloaded = float(timestamp)
+                else:
+                    match = RENDERED_PATTERN.search(status)
+                    if match and downloaded is not None:
+                        frames = int(match.group(2)) - int(match.group(1)) + 1
+                        batches.extend([(float(timestamp) - downloaded) / frames] * frames)
+                        downloaded = None
+    return spans if spans else batches
+
+
+def fit_lognormal(durations):
+    """Returns the (mu, sigma) of a lognormal distribution fitted to the durations."""
+    logs = [math.log(d) for d in durations if d > 0]
+    if len(logs) < 2:
+        raise ValueError('Need at least two positive durations to fit a distribution')
+    return statistics.mean(logs), statistics.stdev(logs)
@@ -0,0 +1,332 @@
+import collections
+import heapq
+import itertools
+import math
+import random
+
+
+def fixed_split(job_size: int = 3):
+    """The server's original splitter: batches of job_size frames, starting from the job's first frame."""
+    def split(start: int, end: int):
+        return [(s, min(s + job_size - 1, end)) for s in range(start, end + 1, job_size)]
+    return split
+
+
+def constant_frames(seconds: float):
+    return lambda rng, frame: seconds
+
+
+def lognormal_frames(mu: float, sigma: float):
+    """Frame render times drawn from a lognormal distribution, e.g. one fitted by simulator.fit."""
+    return lambda rng, frame: rng.lognormvariate(mu, sigma)
+
+
+class Message:
+    def __init__(self, id: int, body: dict, now: float):
+        self.id = id
+        self.body = body
+        self.enqueued_at = now
+        self.first_received_at = None
+        self.receipt = 0
+        self.heartbeat_until = 0.0
+
+
+class SimQueue:
+    """
+    An SQS standard queue with visibility timeout semantics.
+
+    Received messages become invisible for visibility_timeout seconds and are redelivered if they aren't deleted or
+    extended by then. Pods that find the queue empty wait (like a long poll) and are woken when a message arrives.
+    """
+
+    def __init__(self, sim, visibility_timeout: float):
+        self.sim = sim
+        self.visibility_timeout = visibility_timeout
+        self.visible = collections.deque()
+        self.in_flight = dict()
+        self.waiters = collections.deque()
+        self.ids = itertools.count()
+        self.receives = 0
+        self.redeliveries = 0
+
+    def send(self, body: dict):
+        message = Message(next(self.ids), body, self.sim.now)
+        self._make_visible(message)
+
+    def _make_visible(self, message: Message):
+        self.visible.append(message)
+        while self.waiters and self.visible:
+            pod = self.waiters.popleft()
+            if pod.alive:
+                pod.poll()
+
+    def receive(self):
+        if not self.visible:
+            return None
+        message = self.visible.popleft()
+        message.receipt += 1
+        self.receives += 1
+        if message.first_received_at is None:
+            message.first_received_at = self.sim.now
+        self.in_flight[message.id] = message
+        self._schedule_expiry(message, self.visibility_timeout)
+        return message
+
+    def _schedule_expiry(self, message: Message, timeout: float):
+        receipt = message.receipt
+        self.sim.schedule(timeout, self._expire, message, receipt)
+
+    def _expire(self, message: Message, receipt: int):
+        if self.in_flight.get(message.id) is not message or message.receipt != receipt:
+            return
+        if message.heartbeat_until > self.sim.now:
+            self._schedule_expiry(message, message.heartbeat_until - self.sim.now)
+            return
+        del self.in_flight[message.id]
+        self.redeliveries += 1
+        self._make_visible(message)
+
+    def extend(self, message: Message, until: float):
+        """Models the worker's visibility heartbeat keeping a message invisible until the given time."""
+        message.heartbeat_until = until
+
+    def release(self, message: Message, receipt: int):
+        """Makes an in-flight message visible immediately, as the worker does on SIGTERM."""
+        if self.in_flight.get(message.id) is message and message.receipt == receipt:
+            del self.in_flight[message.id]
+            message.receipt += 1
+            message.heartbeat_until = 0.0
+            self._make_visible(message)
+
+    def delete(self, message: Message) -> bool:
+        """Deletes the message; returns False if it had already been deleted by another copy."""
+        if self.in_flight.pop(message.id, None) is message:
+            return True
+        try:
+            self.visible.remove(message)
+            return True
+        except ValueError:
+            return False
+
+    def depth(self):
+        return len(self.visible), len(self.in_flight)
+
+
+class Pod:
+    def __init__(self, sim, id: int):
+        self.sim = sim
+        self.id = id
+        self.alive = True
+        self.ready = False
+        self.busy = False
+        self.busy_since = None
+        self.message = None
+        self.receipt = None
+        self.started_at = sim.now
+        self.stopped_at = None
+
+    def start(self):
+        self.sim.schedule(self.sim.config.pod_startup_seconds, self._ready)
+
+    def _ready(self):
+        if self.alive:
+            self.ready = True
+            self.poll()
+
+    def poll(self):
+        if not self.alive or self.busy:
+            return
+        message = self.sim.queue.receive()
+        if message is None:
+            self.sim.queue.waiters.append(self)
+            return
+        self.busy = True
+        self.busy_since = self.sim.now
+        self.message = message
+        self.receipt = message.receipt
+        duration = self.sim.job_duration(message.body)
+        if self.sim.config.heartbeat:
+            self.sim.queue.extend(message, self.sim.now + duration)
+        self.sim.schedule(duration, self._finish, message, message.receipt)
+
+    def _finish(self, message: Message, receipt: int):
+        if not self.alive or self.message is not message:
+            return
+        self.busy = False
+        self.message = None
+        self.sim.busy_seconds += self.sim.now - self.busy_since
+        if self.sim.queue.delete(message):
+            self.sim.complete(message)
+        else:
+            self.sim.duplicate_completions += 1
+        self.poll()
+
+    def stop(self):
+        """Terminates the pod; an in-flight message is released back to the queue straight away."""
+        self.alive = False
+        self.stopped_at = self.sim.now
+        if self.message is not None:
+            self.sim.busy_seconds += self.sim.now - self.busy_since
+            self.sim.queue.release(self.message, self.receipt)
+            self.message = None
+            self.busy = False
+
+
+class SimConfig:
+    """
+    Parameters of the simulated farm.
+
+    split: function (start, end) -> list of (batch_start, batch_end)
+    frame_seconds: function (rng, frame) -> render time of one frame
+    heartbeat: whether workers extend the visibility of messages they are working on
+    """
+
+    def __init__(self, split=fixed_split(), frame_seconds=constant_frames(180), batch_overhead_seconds: float = 20,
+                 sequence_overhead_seconds: float = 10, sequence_seconds_per_frame: float = 0.5,
+                 visibility_timeout: float = 20 * 60, heartbeat: bool = False, pod_startup_seconds: float = 30):
+        self.split = split
+        self.frame_seconds = frame_seconds
+        self.batch_overhead_seconds = batch_overhead_seconds
+        self.sequence_overhead_seconds = sequence_overhead_seconds
+        self.sequence_seconds_per_frame = sequence_seconds_per_frame
+        self.visibility_timeout = visibility_timeout
+        self.heartbeat = heartbeat
+        self.pod_startup_seconds = pod_startup_seconds
+
+
+class Simulation:
+    """
+    Discrete-event model of the render farm: server splitting, JobQueue, worker pods and an autoscaling policy.
+
+    Times are in seconds. Each job is (submit_time, start_frame, end_frame).
+    """
+
+    def __init__(self, config, policy, seed: int = 0):
+        self.config = config
+        self.policy = policy
+        self.rng = random.Random(seed)
+        self.now = 0.0
+        self.events = []
+        self.sequence = itertools.count()
+        self.queue = SimQueue(self, config.visibility_timeout)
+        self.pods = []
+        self.alive = []
+        self.pod_ids = itertools.count()
+        self.jobs = dict()
+        self.unfinished_jobs = 0
+        self.completed_frames = []
+        self.queue_waits = []
+        self.job_latencies = []
+        self.busy_seconds = 0.0
+        self.duplicate_completions = 0
+
+    def schedule(self, delay: float, callback, *args):
+        heapq.heappush(self.events, (self.now + delay, next(self.sequence), callback, args))
+
+    def job_duration(self, body: dict) -> float:
+        if body['type'] == 'sequence':
+            frames = body['end'] - body['start'] + 1
+            duration = self.config.sequence_overhead_seconds + frames * self.config.sequence_seconds_per_frame
+        else:
+            duration = self.config.batch_overhead_seconds + sum(
+                self.config.frame_seconds(self.rng, frame) for frame in range(body['start'], body['end'] + 1))
+        return duration
+
+    def submit(self, job_id: int, start: int, end: int):
+        batches = self.config.split(start, end)
+        self.jobs[job_id] = {'submitted': self.now, 'remaining': len(batches), 'start': start, 'end': end}
+        self.unfinished_jobs += 1
+        for s, e in batches:
+            self.queue.send({'type': 'render', 'job': job_id, 'start': s, 'end': e})
+
+    def complete(self, message: Message):
+        body = message.body
+        self.queue_waits.append(message.first_received_at - message.enqueued_at)
+        job = self.jobs[body['job']]
+        if body['type'] == 'render':
+            self.completed_frames.extend([self.now] * (body['end'] - body['start'] + 1))
+            job['remaining'] -= 1
+            if job['remaining'] == 0:
+                self.queue.send({'type': 'sequence', 'job': body['job'], 'start': job['start'], 'end': job['end']})
+        else:
+            job['finished'] = self.now
+            self.unfinished_jobs -= 1
+            self.job_latencies.append(self.now - job['submitted'])
+
+    def scale_to(self, replicas: int):
+        for _ in range(replicas - len(self.alive)):
+            pod = Pod(self, next(self.pod_ids))
+            self.pods.append(pod)
+            self.alive.append(pod)
+            pod.start()
+        if replicas < len(self.alive):
+            # Remove pods that are starting or idle before busy ones
+            self.alive.sort(key=lambda p: (p.busy, p.ready))
+            for pod in self.alive[:len(self.alive) - replicas]:
+                pod.stop()
+            self.alive = self.alive[len(self.alive) - replicas:]
+
+    def _autoscale(self):
+        self.scale_to(self.policy.desired(self))
+        if not self._finished():
+            self.schedule(self.policy.interval, self._autoscale)
+
+    def _finished(self) -> bool:
+        return self.pending_submissions == 0 and self.unfinished_jobs == 0
+
+    def run(self, jobs, max_time: float = 30 * 24 * 3600):
+        self.pending_submissions = len(jobs)
+        for job_id, (submit_time, start, end) in enumerate(jobs):
+            self.schedule(submit_time, self._submit, job_id, start, end)
+        self.scale_to(self.policy.initial_replicas)
+        self.schedule(0, self._autoscale)
+        while self.events and not self._finished():
+            time, _, callback, args = heapq.heappop(self.events)
+            if time > max_time:
+                break
+            self.now = time
+            callback(*args)
+        for pod in self.alive:
+            pod.stop()
+        self.alive = []
+        return Report(self, jobs)
+
+    def _submit(self, job_id, start, end):
+        self.pending_submissions -= 1
+        self.submit(job_id, start, end)
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(math.ceil(p / 100 * len(values))) - 1)]
+
+
+class Report:
+    def __init__(self, sim: Simulation, jobs):
+        first_submit = min(submit for submit, _, _ in jobs) if jobs else 0
+        self.makespan = sim.now - first_submit
+        self.frames = len(sim.completed_frames)
+        minutes = collections.Counter(int((t - first_submit) // 60) for t in sim.completed_frames)
+        self.mean_frames_per_minute = self.frames / (self.makespan / 60) if self.makespan else 0.0
+        self.peak_frames_per_minute = max(minutes.values()) if minutes else 0
+        self.pod_minutes = sum((pod.stopped_at or sim.now) - pod.started_at for pod in sim.pods) / 60
+        self.utilisation = sim.busy_seconds / (self.pod_minutes * 60) if self.pod_minutes else 0.0
+        self.queue_wait = {p: percentile(sim.queue_waits, p) for p in (50, 90, 99)}
+        self.job_latency = {p: percentile(sim.job_latencies, p) for p in (50, 90, 99)}
+        self.redeliveries = sim.queue.redeliveries
+        self.duplicate_completions = sim.duplicate_completions
+        self.unfinished_jobs = sum(1 for job in sim.jobs.values() if 'finished' not in job)
+
+    def __str__(self):
+        return '\n'.join([
+            f'makespan:              {self.makespan / 60:.1f} min',
+            f'frames:                {self.frames}',
+            f'throughput:            {self.mean_frames_per_minute:.1f} frames/min (peak {self.peak_frames_per_minute})',
+            f'pod-minutes:           {self.pod_minutes:.1f} (utilisation {self.utilisation * 100:.1f}%)',
+            'queue wait p50/90/99:  ' + '/'.join(f'{self.queue_wait[p]:.0f}' for p in (50, 90, 99)) + ' s',
+            'job latency p50/90/99: ' + '/'.join(f'{self.job_latency[p] / 60:.1f}' for p in (50, 90, 99)) + ' min',
+            f'redeliveries:          {self.redeliveries} ({self.duplicate_completions} duplicate completions)',
+            f'unfinished jobs:       {self.unfinished_jobs}',
+        ])
@@ -0,0 +1,77 @@
+import math
+
+
+class FixedPolicy:
+    """A constant number of pods."""
+
+    def __init__(self, replicas: int, interval: float = 15):
+        self.initial_replicas = replicas
+        self.replicas = replicas
+        self.interval = interval
+
+    def desired(self, sim) -> int:
+        return self.replicas
+
+
+class CpuPolicy:
+    """
+    The Kubernetes HPA on CPU percentage, as deployed with kubectl autoscale --cpu-percent=50.
+
+    A rendering pod is counted as 100% busy and an idle pod as 0%. Scale-down uses the highest recommendation from
+    the stabilisation window, like the HPA's default behaviour.
+    """
+
+    def __init__(self, target: float = 0.5, min_replicas: int = 1, max_replicas: int = 10, interval: float = 15,
+                 stabilisation: float = 300):
+        self.initial_replicas = min_replicas
+        self.target = target
+        self.min_replicas = min_replicas
+        self.max_replicas = max_replicas
+        self.interval = interval
+        self.stabilisation = stabilisation
+        self.recommendations = []
+
+    def desired(self, sim) -> int:
+        alive = sim.alive
+        ready = [pod for pod in alive if pod.ready]
+        if not ready:
+            return max(self.min_replicas, len(alive))
+        utilisation = sum(1 for pod in ready if pod.busy) / len(ready)
+        recommendation = math.ceil(len(alive) * utilisation / self.target)
+        recommendation = max(self.min_replicas, min(self.max_replicas, recommendation))
+        self.recommendations.append((sim.now, recommendation))
+        self.recommendations = [(t, r) for t, r in self.recommendations if sim.now - t <= self.stabilisation]
+        return max(r for _, r in self.recommendations)
+
+
+class QueueDepthPolicy:
+    """
+    The queue-depth scaler in scaler/scaler.py: enough pods to drain the backlog within target_drain_seconds.
+
+    The render time per batch is measured from the batches completed so far.
+    """
+
+    def __init__(self, target_drain_seconds: float = 600, min_replicas: int = 1, max_replicas: int = 10,
+                 interval: float = 15, scale_down_window: float = 300, default_batch_seconds: float = 180):
+        self.initial_replicas = min_replicas
+        self.target_drain_seconds = target_drain_seconds
+        self.min_replicas = min_replicas
+        self.max_replicas = max_replicas
+        self.interval = interval
+        self.scale_down_window = scale_down_window
+        self.default_batch_seconds = default_batch_seconds
+        self.recommendations = []
+
+    def desired(self, sim) -> int:
+        visible, in_flight = sim.queue.depth()
+        batches = visible + in_flight
+        if batches == 0:
+            recommendation = self.min_replicas
+        else:
+            batch_seconds = sim.busy_seconds / sim.queue.receives if sim.queue.receives and sim.busy_seconds \
+                else self.default_batch_seconds
+            recommendation = math.ceil(batches * batch_seconds / self.target_drain_seconds)
+            recommendation = max(self.min_replicas, min(self.max_replicas, recommendation))
+        self.recommendations.append((sim.now, recommendation))
+        self.recommendations = [(t, r) for t, r in self.recommendations if sim.now - t <= self.scale_down_window]
+        return max(r for _, r in self.recommendations)
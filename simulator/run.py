@@ -0,0 +1,64 @@
+import argparse
+import random
+
+from .fit import fit_lognormal, frame_durations
+from .model import SimConfig, Simulation, constant_frames, fixed_split, lognormal_frames
+from .policies import CpuPolicy, FixedPolicy, QueueDepthPolicy
+
+
+def make_policy(name: str, max_replicas: int):
+    if name == 'cpu':
+        return CpuPolicy(max_replicas=max_replicas)
+    elif name == 'queue':
+        return QueueDepthPolicy(max_replicas=max_replicas)
+    elif name.startswith('fixed:'):
+        return FixedPolicy(int(name.split(':')[1]))
+    raise ValueError(f'Unknown policy {name}')
+
+
+def make_jobs(n_jobs: int, min_frames: int, max_frames: int, mean_interarrival: float, seed: int):
+    """Jobs arriving as a Poisson process, each with a uniformly random number of frames."""
+    rng = random.Random(seed)
+    jobs = []
+    t = 0.0
+    for _ in range(n_jobs):
+        jobs.append((t, 1, rng.randint(min_frames, max_frames)))
+        t += rng.expovariate(1 / mean_interarrival) if mean_interarrival else 0
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate the render farm under different policies')
+    parser.add_argument('--jobs', type=int, default=100)
+    parser.add_argument('--frames', type=int, nargs=2, default=(10, 60), metavar=('MIN', 'MAX'))
+    parser.add_argument('--interarrival', type=float, default=120, help='mean seconds between job submissions')
+    parser.add_argument('--job-size', type=int, default=3, help='frames per render batch')
+    parser.add_argument('--frame-seconds', type=float, default=180, help='constant render time per frame')
+    parser.add_argument('--logs', nargs='*', help='worker CSV logs to fit the frame render time distribution from')
+    parser.add_argument('--pod-startup', type=float, default=30)
+    parser.add_argument('--visibility-timeout', type=float, default=20 * 60)
+    parser.add_argument('--heartbeat', action='store_true', help='workers extend message visibility while working')
+    parser.add_argument('--max-pods', type=int, default=10)
+    parser.add_argument('--policy', nargs='+', default=['cpu', 'queue'], help='cpu, queue or fixed:<pods>')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.logs:
+        mu, sigma = fit_lognormal(frame_durations(args.logs))
+        print(f'Fitted lognormal frame times: mu={mu:.3f} sigma={sigma:.3f}')
+        frame_seconds = lognormal_frames(mu, sigma)
+    else:
+        frame_seconds = constant_frames(args.frame_seconds)
+    jobs = make_jobs(args.jobs, *args.frames, args.interarrival, args.seed)
+
+    for name in args.policy:
+        config = SimConfig(split=fixed_split(args.job_size), frame_seconds=frame_seconds,
+                           visibility_timeout=args.visibility_timeout, heartbeat=args.heartbeat,
+                           pod_startup_seconds=args.pod_startup)
+        report = Simulation(config, make_policy(name, args.max_pods), args.seed).run(jobs)
+        print(f'--- {name} ---')
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
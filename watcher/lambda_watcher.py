@@ -1,38 +1,239 @@
-import boto3
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
 import botocore
-import urllib
+import urllib.parse
+from boto3.dynamodb.conditions import Key
 
-dynamodb = boto3.resource('dynamodb')
-job_table = dynamodb.Table('JobTable')
-s3 = boto3.client('s3', region_name='us-east-1')
+import aws_clients
+
+job_table = aws_clients.lazy_table('JobTable')
+batch_table = aws_clients.lazy_table('BatchTable')
+cache_table = aws_clients.lazy_table('RenderCacheTable')
+s3 = aws_clients.lazy_client('s3')
+# Speculative copies go to the front of the line, since the whole job is waiting on them
+speculative_queue = aws_clients.lazy_queue('JobQueueHigh')
 
 png_bucket_name = 'png-files-bucket'
 
+# The render cache in the PNG bucket is kept under CACHE_MAX_BYTES by evicting the least recently used scenes
+CACHE_MAX_BYTES = 100 * 2 ** 30
+CACHE_LOW_WATER = 0.9
+# Scenes used more recently than this may belong to jobs still in progress, so they are never evicted
+CACHE_MIN_IDLE_SECONDS = 24 * 3600
+SUMMARY_FRAME = -1
+DELETE_THREADS = 8
+TOTAL_SCENE = 'total'
+
+# Speculative execution starts once this fraction of a job's batches is complete
+SPECULATE_AFTER = 0.75
+# Completed batches needed to estimate a job's time per frame
+MIN_SAMPLES = 3
+# A batch is a straggler once it has taken STRAGGLER_FACTOR times as long as expected plus MIN_SLACK_SECONDS, or has
+# reported no progress for that long over one frame's expected time
+STRAGGLER_FACTOR = 2.0
+MIN_SLACK_SECONDS = 60
+
+
+def get_batches(job):
+    batches = []
+    kwargs = {'KeyConditionExpression': Key('job').eq(job)}
+    while True:
+        response = batch_table.query(**kwargs)
+        batches.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return batches
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def delete_keys(keys):
+    """Deletes the objects from the PNG bucket, in requests of up to 1000 keys sent in parallel."""
+    def delete(chunk):
+        objects = {'Objects': [{'Key': key} for key in chunk], 'Quiet': True}
+        return s3.delete_objects(Bucket=png_bucket_name, Delete=objects)
+
+    chunks = [keys[i:i + 1000] for i in range(0, len(keys), 1000)]
+    try:
+        with ThreadPoolExecutor(max_workers=DELETE_THREADS) as executor:
+            responses = list(executor.map(delete, chunks))
+    except botocore.exceptions.ClientError as e:
+        raise Exception(f"Failed to delete objects: {e}")
+    errors = [error for response in responses for error in response.get('Errors', [])]
+    if errors:
+        raise Exception(f"Failed to delete {len(errors)} objects: {errors[:10]}")
+
+
+def get_scene_summaries():
+    """Returns the summary item of every scene in the render cache."""
+    summaries = []
+    kwargs = {
+        'FilterExpression': '#frame = :summary and scene <> :total',
+        'ExpressionAttributeNames': {'#frame': 'frame'},
+        'ExpressionAttributeValues': {':summary': SUMMARY_FRAME, ':total': TOTAL_SCENE}
+    }
+    while True:
+        response = cache_table.scan(**kwargs)
+        summaries.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return summaries
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def evict_scene(scene):
+    """Deletes a scene's cached frames and index items, and returns the number of bytes freed."""
+    items = []
+    kwargs = {'KeyConditionExpression': Key('scene').eq(scene)}
+    while True:
+        response = cache_table.query(**kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    # Bundled frames share their bundle's key
+    delete_keys(sorted({item['key'] for item in items if 'key' in item}))
+    with cache_table.batch_writer() as writer:
+        for item in items:
+            writer.delete_item(Key={'scene': item['scene'], 'frame': item['frame']})
+    freed = sum(int(item['bytes']) for item in items if int(item['frame']) == SUMMARY_FRAME)
+    cache_table.update_item(
+        Key={'scene': TOTAL_SCENE, 'frame': SUMMARY_FRAME},
+        UpdateExpression='add #bytes :freed',
+        ExpressionAttributeNames={'#bytes': 'bytes'},
+        ExpressionAttributeValues={':freed': -freed}
+    )
+    return freed
+
+
+def evict_render_cache():
+    """
+    Evicts the least recently used scenes once the cache holds more than CACHE_MAX_BYTES of frames.
+
+    Usage is tracked by counters that the workers add to, so it is approximate: a redelivered batch counts twice.
+    """
+    response = cache_table.get_item(Key={'scene': TOTAL_SCENE, 'frame': SUMMARY_FRAME})
+    total = int(response.get('Item', {}).get('bytes', 0))
+    if total <= CACHE_MAX_BYTES:
+        return []
+    evicted = []
+    idle_since = time.time() - CACHE_MIN_IDLE_SECONDS
+    for summary in sorted(get_scene_summaries(), key=lambda s: int(s.get('last_used', 0))):
+        if total <= CACHE_MAX_BYTES * CACHE_LOW_WATER or int(summary.get('last_used', 0)) > idle_since:
+            break
+        total -= evict_scene(summary['scene'])
+        evicted.append(summary['scene'])
+    return evicted
+
+
+def get_running_jobs():
+    """Returns the items of the jobs whose batches are still rendering."""
+    jobs = []
+    kwargs = {
+        'FilterExpression': 'job_status = :waiting',
+        'ExpressionAttributeValues': {':waiting': 'Waiting'}
+    }
+    while True:
+        response = job_table.scan(**kwargs)
+        jobs.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return jobs
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def frames(batch):
+    return int(batch['end']) - int(batch['start']) + 1
+
+
+def find_stragglers(batches, now):
+    """
+    Returns the running batches that are far behind the job's observed time per frame.
+
+    Only started batches are considered, so batches still queued behind busy workers are left alone, as are tiles
+    and batches that already have a speculative copy.
+    """
+    complete = [b for b in batches if b['batch_status'] == 'Complete']
+    samples = [(float(b['completed_at']) - float(b['started_at'])) / frames(b)
+               for b in complete if 'completed_at' in b and 'started_at' in b]
+    if len(complete) < SPECULATE_AFTER * len(batches) or len(samples) < MIN_SAMPLES:
+        return []
+    per_frame = statistics.median(samples)
+    stragglers = []
+    for batch in batches:
+        if (batch['batch_status'] != 'Processing' or 'started_at' not in batch or 'tiles' in batch
+                or 'speculated_at' in batch):
+            continue
+        expected = per_frame * frames(batch)
+        elapsed = now - float(batch['started_at'])
+        silent = now - float(batch.get('progress_at', batch['started_at']))
+        if (elapsed > STRAGGLER_FACTOR * expected + MIN_SLACK_SECONDS
+                or silent > STRAGGLER_FACTOR * per_frame + MIN_SLACK_SECONDS):
+            stragglers.append(batch)
+    return stragglers
+
+
+def speculate_batch(job, batch, now):
+    """Sends a second copy of a running batch to the workers, at most once per batch."""
+    try:
+        batch_table.update_item(
+            Key={'job': batch['job'], 'batch': batch['batch']},
+            UpdateExpression='set speculated_at = :now',
+            ConditionExpression='batch_status = :processing and attribute_not_exists(speculated_at)',
+            ExpressionAttributeValues={':now': int(now), ':processing': 'Processing'}
+        )
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+    body = {'type': 'render', 'job': job['job'], 'file': job['file'], 'scene': job['scene'],
+            'start': batch['start'], 'end': batch['end'], 'speculative': True}
+    if job.get('assets'):
+        body['assets'] = job['assets']
+    speculative_queue.send_message(MessageBody=json.dumps(body))
+    return True
+
+
+def speculate():
+    """
+    Starts speculative copies of straggling batches, so one slow or stuck worker doesn't hold up a whole job.
+
+    Run this from a schedule. Whichever copy of a batch finishes first completes it; the other stops rendering at its
+    next progress report, or discards its output if it finishes.
+    """
+    now = time.time()
+    speculated = []
+    for job in get_running_jobs():
+        for batch in find_stragglers(get_batches(job['job']), now):
+            if speculate_batch(job, batch, now):
+                speculated.append(f"{job['job']}/{batch['batch']}")
+    return f'Started {len(speculated)} speculative batches: {speculated}'
+
 
 def lambda_handler(event, context):
+    if event.get('speculate'):
+        return speculate()
+
     mp4_file = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'], encoding='utf-8')
 
     # Update job status in the DynamoDB table
-    file = mp4_file[:-4]
-    blender_file = file + '.blend'
-    response = job_table.update_item(
-        Key={'file': blender_file},
+    job = mp4_file[:-4]
+    job_table.update_item(
+        Key={'job': job},
         UpdateExpression='set job_status = :status',
         ExpressionAttributeValues={
             ':status': 'Complete'
-        },
-        ReturnValues='ALL_NEW'
+        }
     )
 
-    # Delete the .png files from S3
-    job_range = response['Attributes']['range'].split('-')
-    frames = {'Objects': []}
-    for i in range(int(job_range[0]), int(job_range[1]) + 1):
-        filename = file + '%04d.png' % i
-        obj = {'Key': filename}
-        frames['Objects'].append(obj)
-    try:
-        s3.delete_objects(Bucket=png_bucket_name, Delete=frames)
-    except botocore.exceptions.ClientError as e:
-        raise Exception(f"Failed to delete frames: {e}")
-    return f'Attempted to delete {frames}'
+    # Delete the video segments from S3; the frames stay in the render cache
+    batches = get_batches(job)
+    segments = [batch['segment'] for batch in batches if 'segment' in batch]
+    delete_keys(segments)
+
+    # Delete the finished job's batch items
+    with batch_table.batch_writer() as writer:
+        for batch in batches:
+            writer.delete_item(Key={'job': batch['job'], 'batch': batch['batch']})
+
+    # Keep the render cache within its size limit
+    evicted = evict_render_cache()
+    return f'Deleted {len(segments)} segments and evicted {len(evicted)} scenes from the render cache'
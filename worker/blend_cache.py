@@ -0,0 +1,141 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import threading
+
+import botocore.exceptions
+
+CACHE_DIR = os.environ.get('BLEND_CACHE_DIR', '/tmp/blend-cache')
+CACHE_BYTES = int(os.environ.get('BLEND_CACHE_BYTES', str(5 * 1024 ** 3)))
+
+
+class BlendCache:
+    """
+    On-disk cache of S3 objects (.blend scenes and their linked assets), shared by every render process on the pod.
+
+    Entries are content addressed by (bucket, key, ETag) and validated with a conditional HEAD request.
+    The cache is capped at a byte budget and the least recently used entries are evicted first.
+    """
+
+    def __init__(self, s3, directory: str = CACHE_DIR, max_bytes: int = CACHE_BYTES):
+        self.s3 = s3
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.bytes_downloaded = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _lock(self):
+        """Opens and exclusively locks the cache lock file; closing the returned file releases it."""
+        f = open(os.path.join(self.directory, '.lock'), 'a')
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def _ref_path(self, bucket: str, key: str) -> str:
+        digest = hashlib.sha256(f'{bucket}\0{key}'.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.ref')
+
+    def _entry_path(self, bucket: str, key: str, etag: str) -> str:
+        digest = hashlib.sha256(f'{bucket}\0{key}\0{etag}'.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.obj')
+
+    def _cached_etag(self, bucket: str, key: str):
+        try:
+            with open(self._ref_path(bucket, key), 'r') as f:
+                etag = f.read()
+        except FileNotFoundError:
+            return None
+        if not os.path.exists(self._entry_path(bucket, key, etag)):
+            return None
+        return etag
+
+    def _current_etag(self, bucket: str, key: str, cached_etag):
+        """Returns the object's ETag, or the cached ETag if S3 reports it as unmodified."""
+        try:
+            if cached_etag is None:
+                response = self.s3.head_object(Bucket=bucket, Key=key)
+            else:
+                response = self.s3.head_object(Bucket=bucket, Key=key, IfNoneMatch=cached_etag)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] == '304':
+                return cached_etag
+            raise
+        return response['ETag']
+
+    def _evict(self, keep: str):
+        """Deletes least recently used entries until the cache fits in its byte budget."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.obj'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+    def fetch(self, bucket: str, key: str, destination: str) -> bool:
+        """
+        Places the S3 object at destination, downloading it only if the cached copy is missing or stale.
+
+        Returns True on a cache hit and False on a miss.
+        """
+        etag = self._current_etag(bucket, key, self._cached_etag(bucket, key))
+        entry = self._entry_path(bucket, key, etag)
+
+        with self._lock():
+            hit = os.path.exists(entry)
+            if hit:
+                # Mark the entry as recently used
+                os.utime(entry)
+                self._link(entry, destination)
+
+        if not hit:
+            tmp = f'{entry}.{os.getpid()}-{threading.get_ident()}.part'
+            self.s3.download_file(bucket, key, tmp)
+            with self._lock():
+                os.replace(tmp, entry)
+                with open(self._ref_path(bucket, key), 'w') as f:
+                    f.write(etag)
+                self._link(entry, destination)
+                self._evict(keep=entry)
+
+        size = os.path.getsize(destination)
+        if hit:
+            self.hits += 1
+            self.bytes_saved += size
+        else:
+            self.misses += 1
+            self.bytes_downloaded += size
+        return hit
+
+    @staticmethod
+    def _link(entry: str, destination: str):
+        """Hard links the entry to destination, so that deleting the working copy leaves the cache intact."""
+        os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+        if os.path.exists(destination):
+            os.remove(destination)
+        try:
+            os.link(entry, destination)
+        except OSError:
+            shutil.copyfile(entry, destination)
+
+    def stats(self) -> str:
+        return (f'hits={self.hits} misses={self.misses} '
+                f'bytes_saved={self.bytes_saved} bytes_downloaded={self.bytes_downloaded}')
@@ -0,0 +1,94 @@
+"""
+Driver script that runs inside Blender and keeps a scene loaded between render batches.
+
+Start it with:
+    blender -b --python blender_server.py -- <socket_path>
+
+Each request is one JSON line on the Unix socket, e.g.
+    {"file": "/app/scene.blend", "start": 1, "end": 3, "output": "/app/scene/scene"}
+with an optional "border": [min_x, max_x, min_y, max_y] to render only that region of the image, and the server answers with {"loaded": true} once the scene is loaded, one {"saved": <path>} line per frame, then {"done": true} or {"error": <message>}.
+The .blend file is only reloaded when it changes on disk, not when the same file arrives under a new path.
+"""
+import json
+import os
+import socket
+import sys
+
+import bpy
+
+loaded = {'directory': None, 'signature': None}
+
+
+def signature(path: str):
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def load(path: str):
+    """
+    Opens the .blend file unless the same version of it is already loaded.
+
+    Every task fetches the scene into its own directory as a hard link to the pod's cached copy, so the file is
+    recognised by its inode, modification time and size rather than by its path. The scene's paths are made absolute
+    when it is opened and moved to each new task's directory, which holds that task's copies of the linked assets.
+    """
+    sig = signature(path)
+    directory = os.path.dirname(os.path.abspath(path))
+    if loaded['signature'] != sig:
+        bpy.ops.wm.open_mainfile(filepath=path)
+        bpy.ops.file.make_paths_absolute()
+    elif loaded['directory'] != directory:
+        prefix = loaded['directory'] + os.sep
+        for image in bpy.data.images:
+            if image.filepath.startswith(prefix):
+                image.filepath = os.path.join(directory, image.filepath[len(prefix):])
+    loaded['directory'] = directory
+    loaded['signature'] = sig
+
+
+def send(conn, message: dict):
+    conn.sendall((json.dumps(message) + '\n').encode('utf-8'))
+
+
+def render(conn, command: dict):
+    load(command['file'])
+    send(conn, {'loaded': True})
+    scene = bpy.context.scene
+    scene.render.engine = 'CYCLES'
+    scene.render.filepath = command['output']
+    border = command.get('border')
+    scene.render.use_border = border is not None
+    scene.render.use_crop_to_border = border is not None
+    if border is not None:
+        (scene.render.border_min_x, scene.render.border_max_x,
+         scene.render.border_min_y, scene.render.border_max_y) = border
+    for frame in range(int(command['start']), int(command['end']) + 1):
+        scene.frame_start = frame
+        scene.frame_end = frame
+        bpy.ops.render.render(animation=True)
+        send(conn, {'saved': scene.render.frame_path(frame=frame)})
+
+
+def serve(socket_path: str):
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+    print(f'Blender render server listening on {socket_path}', flush=True)
+    while True:
+        conn, _ = server.accept()
+        with conn, conn.makefile('r', encoding='utf-8') as lines:
+            for line in lines:
+                command = json.loads(line)
+                if command.get('type') == 'shutdown':
+                    return
+                try:
+                    render(conn, command)
+                    send(conn, {'done': True})
+                except Exception as e:
+                    send(conn, {'error': str(e)})
+
+
+if __name__ == '__main__':
+    serve(sys.argv[sys.argv.index('--') + 1])
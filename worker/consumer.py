@@ -0,0 +1,139 @@
+import collections
+import os
+import random
+import signal
+import sys
+import threading
+
+WAIT_TIME = int(os.environ.get('QUEUE_WAIT_TIME', '20'))
+PREFETCH = int(os.environ.get('QUEUE_PREFETCH', '2'))
+VISIBILITY_TIMEOUT = int(os.environ.get('QUEUE_VISIBILITY_TIMEOUT', '300'))
+HEARTBEAT_INTERVAL = int(os.environ.get('QUEUE_HEARTBEAT_INTERVAL', '60'))
+# A failed job is retried straight away the first time, then after this many seconds, doubling on every failure
+RETRY_BACKOFF = int(os.environ.get('QUEUE_RETRY_BACKOFF', '5'))
+# Relative share of receives that start at each queue, from the highest priority queue down
+WEIGHTS = [float(w) for w in os.environ.get('QUEUE_WEIGHTS', '6,3,1').split(',')]
+
+
+class JobConsumer:
+    """
+    Long-polling SQS consumer that keeps a small local batch of prefetched messages.
+
+    queues are polled by weighted fair share: each receive starts at a queue picked in proportion to its weight and
+    falls through the others in priority order, so higher priority queues are served first without starving the
+    lower ones. When every queue is empty each queue is long-polled in turn for its share of the wait time, so a job
+    arriving on a lower priority queue waits for a share of the long poll rather than all of it.
+
+    A background heartbeat extends the visibility timeout of every message the worker holds, so long jobs are not
+    delivered to another pod. On SIGTERM the consumer stops and raises SystemExit in the main thread; the caller
+    then makes all held messages visible again straight away with release_all().
+    """
+
+    def __init__(self, queues: list, sqs_client, weights: list = WEIGHTS, prefetch: int = PREFETCH,
+                 wait_time: int = WAIT_TIME, visibility_timeout: int = VISIBILITY_TIMEOUT,
+                 heartbeat_interval: int = HEARTBEAT_INTERVAL):
+        self.queues = queues
+        self.weights = (list(weights) + [min(weights)] * len(queues))[:len(queues)]
+        self.sqs_client = sqs_client
+        self.prefetch = max(1, min(prefetch, 10))
+        self.wait_time = wait_time
+        self.visibility_timeout = visibility_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.buffer = collections.deque()
+        self.held = dict()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+
+    def start(self):
+        """Starts the heartbeat thread and installs the SIGTERM handler."""
+        self.heartbeat.start()
+        signal.signal(signal.SIGTERM, self._on_sigterm)
+
+    def __iter__(self):
+        while not self.stopping.is_set():
+            if not self.buffer:
+                self._receive()
+                continue
+            yield self.buffer.popleft()
+
+    def _poll_order(self) -> list:
+        first = random.choices(self.queues, weights=self.weights)[0]
+        return [first] + [queue for queue in self.queues if queue is not first]
+
+    def _receive_from(self, queue, wait_time: int) -> list:
+        return queue.receive_messages(MaxNumberOfMessages=self.prefetch,
+                                      WaitTimeSeconds=wait_time,
+                                      VisibilityTimeout=self.visibility_timeout,
+                                      AttributeNames=['ApproximateReceiveCount'])
+
+    def _receive(self):
+        if len(self.queues) == 1:
+            messages = self._receive_from(self.queues[0], self.wait_time)
+        else:
+            for queue in self._poll_order():
+                messages = self._receive_from(queue, 0)
+                if messages:
+                    break
+            else:
+                wait_time = max(1, self.wait_time // len(self.queues)) if self.wait_time else 0
+                for queue in self.queues:
+                    messages = self._receive_from(queue, wait_time)
+                    if messages or self.stopping.is_set():
+                        break
+        with self.lock:
+            for message in messages:
+                self.held[message.message_id] = message
+        self.buffer.extend(messages)
+
+    def _change_visibility(self, messages, timeout: int):
+        """Sets the visibility timeout of the given messages, ten at a time per queue."""
+        by_queue = collections.defaultdict(list)
+        for message in messages:
+            by_queue[message.queue_url].append(message)
+        for queue_url, messages in by_queue.items():
+            for i in range(0, len(messages), 10):
+                entries = [{'Id': str(j), 'ReceiptHandle': m.receipt_handle, 'VisibilityTimeout': timeout}
+                           for j, m in enumerate(messages[i:i + 10])]
+                try:
+                    self.sqs_client.change_message_visibility_batch(QueueUrl=queue_url, Entries=entries)
+                except Exception as e:
+                    print(f'Failed to change message visibility: {e}')
+
+    def _heartbeat(self):
+        while not self.stopping.wait(self.heartbeat_interval):
+            with self.lock:
+                messages = list(self.held.values())
+            if messages:
+                self._change_visibility(messages, self.visibility_timeout)
+
+    def finish(self, message, success: bool):
+        """
+        Stops extending a message's visibility, deleting it if the job succeeded.
+
+        A failed job is made visible again straight away, so its retry starts without waiting out the timeout; a job
+        that keeps failing backs off from RETRY_BACKOFF seconds up to the visibility timeout.
+        """
+        with self.lock:
+            self.held.pop(message.message_id, None)
+        if success:
+            self.sqs_client.delete_message(QueueUrl=message.queue_url, ReceiptHandle=message.receipt_handle)
+        else:
+            receives = int((message.attributes or dict()).get('ApproximateReceiveCount', '1'))
+            delay = 0 if receives <= 1 else min(self.visibility_timeout, RETRY_BACKOFF * 2 ** (receives - 2))
+            self._change_visibility([message], delay)
+
+    def release_all(self):
+        """Makes every held message visible on the queue again immediately."""
+        with self.lock:
+            messages = list(self.held.values())
+            self.held.clear()
+        self.buffer.clear()
+        self._change_visibility(messages, 0)
+
+    def _on_sigterm(self, signum, frame):
+        # The handler may interrupt the main thread while it holds the lock, so the messages are only released
+        # once the SystemExit has unwound out of it
+        print('Received SIGTERM, releasing messages...')
+        self.stopping.set()
+        sys.exit(0)
@@ -0,0 +1,68 @@
+import collections
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+FETCH_THREADS = int(os.environ.get('SEQUENCE_FETCH_THREADS', '8'))
+PREFETCH_FRAMES = int(os.environ.get('SEQUENCE_PREFETCH_FRAMES', '32'))
+# Most frames read from one bundle by a single ranged GET
+BUNDLE_READ_FRAMES = int(os.environ.get('SEQUENCE_BUNDLE_READ_FRAMES', '8'))
+
+
+def plan_reads(frames: list, max_frames: int = BUNDLE_READ_FRAMES) -> list:
+    """
+    Groups the frames into S3 reads, in order.
+
+    frames: S3 keys of whole objects, or (key, offset, size) for frames stored inside a bundle
+    Consecutive frames from the same bundle are read together, by one ranged GET of up to max_frames frames.
+    Returns a list of (key, byte range or None, list of (offset, size) within the data read).
+    """
+    reads = []
+    for frame in frames:
+        if isinstance(frame, str):
+            reads.append((frame, None, [(0, None)]))
+            continue
+        key, offset, size = frame
+        if reads:
+            last_key, last_range, members = reads[-1]
+            if (last_key == key and last_range is not None and len(members) < max_frames
+                    and offset >= last_range[1] + 1):
+                members.append((offset - last_range[0], size))
+                reads[-1] = (key, (last_range[0], offset + size - 1), members)
+                continue
+        reads.append((key, (offset, offset + size - 1), [(0, size)]))
+    return reads
+
+
+def stream_frames(s3, bucket: str, frames: list, threads: int = FETCH_THREADS, window: int = PREFETCH_FRAMES):
+    """
+    Yields the contents of each frame in the given order, fetching up to window frames ahead concurrently.
+
+    frames: S3 keys of whole objects, or (key, offset, size) for frames stored inside a bundle
+    Only the frames inside the prefetch window are held in memory and nothing is written to disk.
+    """
+    def fetch(read):
+        key, byte_range, members = read
+        if byte_range is None:
+            return [s3.get_object(Bucket=bucket, Key=key)['Body'].read()]
+        data = s3.get_object(Bucket=bucket, Key=key, Range='bytes=%d-%d' % byte_range)['Body'].read()
+        return [data[offset:offset + size] for offset, size in members]
+
+    reads = plan_reads(frames)
+    window = max(1, window // max(1, max((len(members) for _, _, members in reads), default=1)))
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = collections.deque()
+        reads = iter(reads)
+        try:
+            for read in reads:
+                pending.append(executor.submit(fetch, read))
+                if len(pending) >= window:
+                    break
+            while pending:
+                data = pending.popleft().result()
+                for read in reads:
+                    pending.append(executor.submit(fetch, read))
+                    break
+                yield from data
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,101 @@
+import json
+import os
+import socket
+import subprocess
+import time
+
+from telemetry import telemetry
+
+SOCKET_PATH = os.environ.get('BLENDER_SERVER_SOCKET', '/tmp/blender-server.sock')
+STARTUP_TIMEOUT = float(os.environ.get('BLENDER_SERVER_STARTUP_TIMEOUT', '60'))
+DRIVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'blender_server.py')
+
+
+class RenderServerError(Exception):
+    pass
+
+
+class RenderServer:
+    """
+    Client for a long-lived Blender process running blender_server.py.
+
+    The process keeps the scene loaded between batches, so Blender startup, add-on initialisation and scene parsing
+    are only paid when the process starts or the .blend file changes.
+    """
+
+    def __init__(self, blender_path: str, socket_path: str = SOCKET_PATH, startup_timeout: float = STARTUP_TIMEOUT,
+                 threads: int = 0):
+        self.blender_path = blender_path
+        self.socket_path = socket_path
+        self.threads = threads
+        self.startup_timeout = startup_timeout
+        self.process = None
+
+    def _start(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        command = [self.blender_path, '-b', '-t', str(self.threads), '--python', DRIVER_SCRIPT, '--', self.socket_path]
+        started = time.time()
+        self.process = subprocess.Popen(command)
+        deadline = time.time() + self.startup_timeout
+        while not os.path.exists(self.socket_path):
+            if self.process.poll() is not None or time.time() > deadline:
+                self.stop()
+                raise RenderServerError('Blender render server failed to start')
+            time.sleep(0.1)
+        telemetry.record('blender_startup', started, time.time())
+
+    def available(self) -> bool:
+        """Starts the server if it isn't running; returns False if it can't be started."""
+        if self.process is not None and self.process.poll() is None:
+            return True
+        try:
+            self._start()
+        except (OSError, RenderServerError) as e:
+            print(f'Render server unavailable: {e}')
+            return False
+        return True
+
+    def render(self, blender_file: str, start: str, end: str, output_path: str, on_frame=None, border: list = None,
+               on_start=None):
+        """
+        Renders the frame range on the server, calling on_frame with each saved frame's path.
+
+        border: [min_x, max_x, min_y, max_y] region of the image to render, or None for the whole image
+        on_start: called once the server has the scene loaded and starts rendering
+        """
+        command = {'file': os.path.abspath(blender_file), 'start': start, 'end': end,
+                   'output': os.path.abspath(output_path), 'border': border}
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+                conn.connect(self.socket_path)
+                conn.sendall((json.dumps(command) + '\n').encode('utf-8'))
+                with conn.makefile('r', encoding='utf-8') as lines:
+                    for line in lines:
+                        reply = json.loads(line)
+                        if 'saved' in reply:
+                            if on_frame is not None:
+                                on_frame(reply['saved'])
+                        elif 'loaded' in reply:
+                            if on_start is not None:
+                                on_start()
+                        elif 'error' in reply:
+                            raise RenderServerError(reply['error'])
+                        elif reply.get('done'):
+                            return
+        except (OSError, ValueError) as e:
+            self.stop()
+            raise RenderServerError(f'Lost connection to render server: {e}')
+        self.stop()
+        raise RenderServerError('Render server closed the connection')
+
+    def stop(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
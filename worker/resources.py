@@ -0,0 +1,71 @@
+import math
+import os
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+# Sizing of the pod's render slots; RENDER_SLOTS and RENDER_THREADS override it
+SLOT_CPUS = float(os.environ.get('RENDER_SLOT_CPUS', '4'))
+SLOT_MEMORY = int(os.environ.get('RENDER_SLOT_MEMORY', str(4 * 1024 ** 3)))
+# cgroup v1 reports no memory limit as a number close to 2^63
+UNLIMITED_MEMORY = 2 ** 60
+
+
+def _read(path: str):
+    try:
+        with open(os.path.join(CGROUP_ROOT, path)) as f:
+            return f.read().split()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_quota():
+    """The CPUs allowed by the cgroup's CFS quota (cgroup v2 or v1), or None if there is no quota."""
+    fields = _read('cpu.max')
+    if fields is not None:
+        if fields[0] == 'max':
+            return None
+        return int(fields[0]) / int(fields[1])
+    for directory in ('cpu', 'cpu,cpuacct'):
+        quota, period = _read(f'{directory}/cpu.cfs_quota_us'), _read(f'{directory}/cpu.cfs_period_us')
+        if quota is not None and period is not None:
+            return None if int(quota[0]) <= 0 else int(quota[0]) / int(period[0])
+    return None
+
+
+def cgroup_memory_limit():
+    """The cgroup's memory limit in bytes (cgroup v2 or v1), or None if there is no limit."""
+    fields = _read('memory.max') or _read('memory/memory.limit_in_bytes')
+    if fields is None or fields[0] == 'max' or int(fields[0]) >= UNLIMITED_MEMORY:
+        return None
+    return int(fields[0])
+
+
+def cpu_limit() -> float:
+    """
+    The CPUs the pod should use: its cgroup quota, else its CPU request, else every CPU it may run on.
+
+    Without a limit the quota is unset, so the deployment passes the request in as CPU_REQUEST_MILLICORES.
+    """
+    available = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    quota = cgroup_cpu_quota()
+    if quota is None and os.environ.get('CPU_REQUEST_MILLICORES'):
+        quota = int(os.environ['CPU_REQUEST_MILLICORES']) / 1000
+    return available if quota is None else min(quota, available)
+
+
+def render_slots(cpus: float = None, memory: int = None) -> (int, int):
+    """
+    Returns the number of concurrent renders the pod can run and the Blender threads for each.
+
+    A slot gets about SLOT_CPUS CPUs and needs SLOT_MEMORY bytes; there is always at least one slot with one thread.
+    """
+    cpus = cpu_limit() if cpus is None else cpus
+    memory = cgroup_memory_limit() if memory is None else memory
+    if os.environ.get('RENDER_SLOTS'):
+        slots = int(os.environ['RENDER_SLOTS'])
+    else:
+        slots = int(cpus // SLOT_CPUS)
+        if memory is not None:
+            slots = min(slots, memory // SLOT_MEMORY)
+    slots = max(1, slots)
+    threads = int(os.environ.get('RENDER_THREADS', '0')) or max(1, math.floor(cpus / slots))
+    return slots, threads
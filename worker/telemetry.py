@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '3000'))
+BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, float('inf'))
+
+
+class Telemetry:
+    """
+    Records timing spans for each stage of a job and aggregates them into counters and histograms.
+
+    Finished spans are drained into the worker's CSV log; the aggregates are served in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = []
+        self.stage_count = dict()
+        self.stage_seconds = dict()
+        self.stage_bytes = dict()
+        self.stage_buckets = dict()
+        self.counters = dict()
+        self.gauges = dict()
+
+    def record(self, stage: str, start: float, end: float, job: str = '', batch: str = '', nbytes: int = 0):
+        duration = end - start
+        with self.lock:
+            self.spans.append((end, stage, job, batch, duration, nbytes))
+            self.stage_count[stage] = self.stage_count.get(stage, 0) + 1
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0) + duration
+            self.stage_bytes[stage] = self.stage_bytes.get(stage, 0) + nbytes
+            buckets = self.stage_buckets.setdefault(stage, [0] * len(BUCKETS))
+            for i, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    buckets[i] += 1
+
+    @contextmanager
+    def span(self, stage: str, job: str = '', batch: str = '', nbytes: int = 0):
+        """Times the enclosed block; set span['bytes'] inside the block to record the bytes it moved."""
+        span = {'bytes': nbytes}
+        start = time.time()
+        try:
+            yield span
+        finally:
+            self.record(stage, start, time.time(), job, batch, span['bytes'])
+
+    def increment(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        with self.lock:
+            self.gauges[name] = value
+
+    def drain(self, job: str = None, batch: str = None) -> str:
+        """Removes the finished spans (of one job, or one batch of a job, or all) and returns them as CSV log lines."""
+        def selected(span):
+            return (job is None or span[2] == job) and (batch is None or span[3] == batch)
+
+        with self.lock:
+            drained = [s for s in self.spans if selected(s)]
+            self.spans = [s for s in self.spans if not selected(s)]
+        return ''.join(f'{end},Span {stage} job={job} batch={batch} duration={duration:.3f} bytes={nbytes}\n'
+                       for end, stage, job, batch, duration, nbytes in drained)
+
+    def metrics(self) -> str:
+        """Renders the counters and per-stage histograms in the Prometheus text format."""
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'# TYPE worker_{name} counter')
+                lines.append(f'worker_{name} {value}')
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f'# TYPE worker_{name} gauge')
+                lines.append(f'worker_{name} {value}')
+            lines.append('# TYPE worker_stage_seconds histogram')
+            for stage, buckets in sorted(self.stage_buckets.items()):
+                for bound, count in zip(BUCKETS, buckets):
+                    le = '+Inf' if bound == float('inf') else str(bound)
+                    lines.append(f'worker_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {count}')
+                lines.append(f'worker_stage_seconds_sum{{stage="{stage}"}} {self.stage_seconds[stage]:.3f}')
+                lines.append(f'worker_stage_seconds_count{{stage="{stage}"}} {self.stage_count[stage]}')
+            lines.append('# TYPE worker_stage_bytes counter')
+            for stage, nbytes in sorted(self.stage_bytes.items()):
+                lines.append(f'worker_stage_bytes{{stage="{stage}"}} {nbytes}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int = METRICS_PORT):
+        """Serves /metrics from a background thread."""
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = telemetry.metrics().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(('', port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+telemetry = Telemetry()
@@ -0,0 +1,85 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from telemetry import telemetry
+
+UPLOAD_THREADS = int(os.environ.get('UPLOAD_THREADS', '4'))
+UPLOAD_QUEUE = int(os.environ.get('UPLOAD_QUEUE', '8'))
+
+
+class FrameUploader:
+    """
+    Uploads rendered frames to S3 on a bounded thread pool while the next frames are still rendering.
+
+    At most max_pending uploads are queued or running at once; submit() blocks beyond that.
+    Each upload produces a per-frame result instead of raising, so one failed frame does not abort the batch.
+    on_uploaded is called with the path and key of each frame once it is in S3, from the uploading thread.
+    """
+
+    def __init__(self, s3, bucket: str, threads: int = UPLOAD_THREADS, max_pending: int = UPLOAD_QUEUE,
+                 prefix: str = '', job: str = '', batch: str = '', on_uploaded=None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.on_uploaded = on_uploaded
+        self.job = job
+        self.batch = batch
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.slots = threading.Semaphore(max_pending)
+        self.lock = threading.Lock()
+        self.submitted = set()
+        self.results = dict()
+
+    def _key(self, filepath: str) -> str:
+        return self.prefix + os.path.basename(filepath)
+
+    def _upload(self, filepath: str):
+        try:
+            with telemetry.span('upload', self.job, self.batch, os.path.getsize(filepath)):
+                self.s3.upload_file(filepath, self.bucket, self._key(filepath))
+            error = None
+        except Exception as e:
+            error = e
+        finally:
+            self.slots.release()
+        if error is None and self.on_uploaded is not None:
+            self.on_uploaded(filepath, self._key(filepath))
+        with self.lock:
+            self.results[filepath] = error
+
+    def submit(self, filepath: str):
+        """Queues a finished frame for upload; frames already submitted are ignored."""
+        filepath = os.path.abspath(filepath)
+        with self.lock:
+            if filepath in self.submitted:
+                return
+            self.submitted.add(filepath)
+        self.slots.acquire()
+        self.executor.submit(self._upload, filepath)
+
+    def submit_directory(self, directory: str):
+        """Queues every frame in the directory that hasn't been submitted yet."""
+        for filename in sorted(os.listdir(directory)):
+            self.submit(os.path.join(directory, filename))
+
+    def wait(self) -> dict:
+        """Waits for all uploads to finish and returns a map from frame path to its error (None on success)."""
+        self.executor.shutdown(wait=True)
+        return dict(self.results)
+
+    def retry_failed(self) -> dict:
+        """Retries failed uploads once, serially, and returns the frames that still failed."""
+        failed = dict()
+        for filepath, error in self.wait().items():
+            if error is None:
+                continue
+            try:
+                self.s3.upload_file(filepath, self.bucket, self._key(filepath))
+                self.results[filepath] = None
+                if self.on_uploaded is not None:
+                    self.on_uploaded(filepath, self._key(filepath))
+            except Exception as e:
+                self.results[filepath] = e
+                failed[filepath] = e
+        return failed
@@ -1,53 +1,551 @@
-import boto3
 import botocore.exceptions
+from boto3.dynamodb.conditions import Key
 import json
 import os
 import random
+import re
 import shutil
+import struct
+import queue
 import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+
+import aws_clients
+from blend_cache import BlendCache
+from consumer import JobConsumer
+from frame_stream import stream_frames
+from render_server import SOCKET_PATH, RenderServer, RenderServerError
+from resources import render_slots
+from telemetry import telemetry
+from uploader import FrameUploader
 
 # BLENDER_PATH = "/Applications/Blender.app/Contents/MacOS/Blender"
 BLENDER_PATH = "blender"
 MY_ID = random.randint(0, 10000)
+USE_RENDER_SERVER = os.environ.get('BLENDER_SERVER', '1') == '1'
+# Upload each batch's frames as one tar bundle instead of one object per frame
+BUNDLE_FRAMES = os.environ.get('BUNDLE_FRAMES', '0') == '1'
+# Seconds between a batch's progress reports to its BatchTable item
+PROGRESS_INTERVAL = float(os.environ.get('BATCH_PROGRESS_INTERVAL', '15'))
+# Concurrent renders and Blender threads for each, sized from the pod's cgroup limits
+RENDER_SLOTS, RENDER_THREADS = render_slots()
+# Job threads beyond the render slots, which download, upload and sequence while every slot is rendering
+IO_WORKERS = int(os.environ.get('IO_WORKERS', '1'))
+# Each task runs in its own directory under here, so concurrent tasks never share files
+WORK_DIR = os.environ.get('WORK_DIR', 'work')
 
-s3 = boto3.client('s3', region_name='us-east-1')
-sqs = boto3.resource('sqs', region_name='us-east-1')
-job_queue = sqs.get_queue_by_name(QueueName='JobQueue')
-logging_queue = sqs.get_queue_by_name(QueueName='LoggingQueue')
-sqs_client = boto3.client('sqs', region_name='us-east-1')
-dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
-job_table = dynamodb.Table('JobTable')
+s3 = aws_clients.lazy_client('s3')
+# In priority order; the server picks each job's queue
+PRIORITY_QUEUES = {'high': 'JobQueueHigh', 'normal': 'JobQueue', 'low': 'JobQueueLow'}
+job_queues = {priority: aws_clients.lazy_queue(name) for priority, name in PRIORITY_QUEUES.items()}
+logging_queue = aws_clients.lazy_queue('LoggingQueue')
+sqs_client = aws_clients.lazy_client('sqs')
+job_table = aws_clients.lazy_table('JobTable')
+batch_table = aws_clients.lazy_table('BatchTable')
+frame_time_table = aws_clients.lazy_table('FrameTimeTable')
+cache_table = aws_clients.lazy_table('RenderCacheTable')
+blend_cache = BlendCache(s3)
+# One long-lived Blender process per render slot, each holding its slot's free slot index while it renders
+render_servers = [RenderServer(BLENDER_PATH, '%s.%d' % (SOCKET_PATH, slot), threads=RENDER_THREADS)
+                  for slot in range(RENDER_SLOTS)]
+free_slots = queue.Queue()
+for slot in range(RENDER_SLOTS):
+    free_slots.put(slot)
+# Set on SIGTERM, as the held messages go back on their queues, so in-flight tasks stop working on them
+shutting_down = threading.Event()
 
 render_bucket_name = 'render-files-bucket'
 png_bucket_name = 'png-files-bucket'
 
+# Rendered frames are kept in the PNG bucket under their scene hash and indexed in the RenderCacheTable
+CACHE_PREFIX = 'cache/'
+SUMMARY_FRAME = -1
+TOTAL_SCENE = 'total'
+# Frames evicted before their job is sequenced are re-rendered in batches of this many, up to MAX_RERENDERS times
+RERENDER_BATCH_FRAMES = 3
+MAX_RERENDERS = 2
+
+# Renders only a region of the image, for tiles; Blender applies it before the frame range arguments that follow
+BORDER_SCRIPT = ('import bpy; r = bpy.context.scene.render; r.use_border = True; r.use_crop_to_border = True; '
+                 'r.border_min_x, r.border_max_x, r.border_min_y, r.border_max_y = %f, %f, %f, %f')
+
+SAVED_PATTERN = re.compile(r"Saved: '(.+)'")
+# Blender's progress lines while it renders a frame, which start once the scene has loaded
+RENDERING_PATTERN = re.compile(r'^Fra:\d+')
+FRAME_PATTERN = re.compile(r'(\d+)\.png$')
+
+# Segments and full sequences share these codec parameters so that segments can be concatenated by stream copy
+FRAMERATE = '24'
+RESOLUTION = '1920x1080'
+ENCODE_OPTIONS = ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-r', FRAMERATE, '-s', RESOLUTION]
+
+
+def render(blender_file: str, start: str, end: str, on_frame=None, border: list = None, output_path: str = None,
+           slot: int = 0, on_start=None):
+    """
+    Renders the blender file animation, using the given frame range.
+
+    on_frame: called with the path of each frame as soon as Blender has saved it
+    on_start: called once Blender has loaded the scene and starts rendering the first frame
+    border: [min_x, max_x, min_y, max_y] fractions of the image to render, cropped to that region
+    output_path: defaults to <filename>/<filename>, to which Blender appends the frame number
+    slot: the render slot held by the caller, whose render server and thread count are used
+    """
+    if output_path is None:
+        output_path = blender_file[:-6] + '/' + os.path.basename(blender_file[:-6])
+    render_server = render_servers[slot]
+    if USE_RENDER_SERVER and render_server.available():
+        try:
+            render_server.render(blender_file, start, end, output_path, on_frame, border, on_start)
+            return
+        except RenderServerError as e:
+            print(f'Render server failed, falling back to a Blender subprocess: {e}')
+        except BaseException:
+            # on_frame gave up on the render; otherwise the server would render the rest of the batch for nobody
+            render_server.stop()
+            raise
+    command = [BLENDER_PATH, '-b', blender_file, '-E', 'CYCLES', '-t', str(RENDER_THREADS)]
+    if border is not None:
+        command += ['--python-expr', BORDER_SCRIPT % tuple(border)]
+    command += ['-o', output_path, '-s', start, '-e', end, '-a']
+    if on_frame is None and on_start is None:
+        subprocess.run(command, check=True)
+        return
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        for line in process.stdout:
+            print(line, end='')
+            if on_start is not None and RENDERING_PATTERN.match(line):
+                on_start()
+                on_start = None
+            match = SAVED_PATTERN.search(line)
+            if match and on_frame is not None:
+                on_frame(match.group(1))
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
 
-def render(blender_file: str, start: str, end: str):
-    """Renders the blender file animation, using the given frame range."""
-    output_path = blender_file[:-6] + '/' + blender_file[:-6]
-    command = [BLENDER_PATH, '-b', blender_file, '-E', 'CYCLES', '-o', output_path, '-s', start, '-e', end, '-a']
-    subprocess.run(command, check=True)
+
+@contextmanager
+def render_slot(job: str = '', batch: str = ''):
+    """Waits for a free render slot and holds it for the enclosed renders."""
+    started = time.time()
+    slot = free_slots.get()
+    telemetry.record('slot_wait', started, time.time(), job, batch)
+    try:
+        yield slot
+    finally:
+        free_slots.put(slot)
 
 
-def sequence(filename: str):
+def sequence(filename: str, frames, output_file: str = None):
     """
     Sequences the png output images into an mp4 video file.
 
     filename: the name of the blender file without the .blend extension
+    frames: iterable of png images in frame order, piped into ffmpeg as they arrive
+    output_file: defaults to the filename with an .mp4 extension
     """
-    framerate = '24'
-    resolution = '1920x1080'
-    file_template = filename + '/' + filename + '%04d.png'
-    output_file = filename + '.mp4'
-    command = ['ffmpeg',
-               '-r', framerate,
-               '-s', resolution,
-               '-i', file_template,
+    if output_file is None:
+        output_file = filename + '.mp4'
+    command = ['ffmpeg', '-y',
+               '-f', 'image2pipe',
+               '-r', FRAMERATE,
+               '-s', RESOLUTION,
+               '-i', '-',
+               *ENCODE_OPTIONS,
                output_file]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    try:
+        for frame in frames:
+            process.stdin.write(frame)
+        process.stdin.close()
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+def read_frames(directory: str):
+    """Yields the contents of each png in the directory in frame order."""
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith('.png'):
+            with open(os.path.join(directory, filename), 'rb') as f:
+                yield f.read()
+
+
+def batch_key(start: str, end: str) -> str:
+    """Sort key of a batch item in the BatchTable."""
+    return '%06d-%06d' % (int(start), int(end))
+
+
+def cache_prefix(scene: str) -> str:
+    """Frames are stored under the scene hash, so every job rendering the same scene shares them."""
+    return CACHE_PREFIX + scene + '/'
+
+
+def segment_key(job: str, filename: str, start: str, end: str) -> str:
+    """
+    The S3 key of this worker's video segment for a batch; filename is without the .blend extension.
+
+    Speculative copies of a batch write their own segments, so the copy that loses the race can delete its segment.
+    """
+    return job + '/' + filename + '_segment_%04d_%04d_%d.mp4' % (int(start), int(end), MY_ID)
+
+
+def concat(segment_files: list, output_file: str):
+    """Joins mp4 segments with matching codec parameters into one video using the concat demuxer."""
+    list_file = output_file + '.txt'
+    with open(list_file, 'w') as f:
+        for segment in segment_files:
+            f.write(f"file '{os.path.abspath(segment)}'\n")
+    command = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_file, '-c', 'copy', output_file]
+    try:
+        subprocess.run(command, check=True)
+    finally:
+        os.remove(list_file)
+
+
+def tile_border(tile: int, rows: int, cols: int) -> list:
+    """The [min_x, max_x, min_y, max_y] image region of a tile; tiles are numbered row by row from the top left."""
+    row, col = divmod(tile, cols)
+    return [col / cols, (col + 1) / cols, 1 - (row + 1) / rows, 1 - row / rows]
+
+
+def png_size(path: str) -> (int, int):
+    """Width and height of a png image, from its header."""
+    with open(path, 'rb') as f:
+        header = f.read(24)
+    return struct.unpack('>II', header[16:24])
+
+
+def stitch(tile_files: list, rows: int, cols: int, output_file: str):
+    """Assembles cropped tiles, given row by row from the top left, into one image with ffmpeg's overlay filter."""
+    sizes = [png_size(path) for path in tile_files]
+    widths = [sizes[col][0] for col in range(cols)]
+    heights = [sizes[row * cols][1] for row in range(rows)]
+    filters = [f'color=c=black@0.0:s={sum(widths)}x{sum(heights)},format=rgba[c0]']
+    for tile in range(len(tile_files)):
+        row, col = divmod(tile, cols)
+        filters.append(f'[c{tile}][{tile}:v]overlay=x={sum(widths[:col])}:y={sum(heights[:row])}[c{tile + 1}]')
+    command = ['ffmpeg', '-y']
+    for path in tile_files:
+        command += ['-i', path]
+    command += ['-filter_complex', ';'.join(filters), '-map', f'[c{len(tile_files)}]', '-frames:v', '1', output_file]
     subprocess.run(command, check=True)
 
 
+class FrameTimer:
+    """
+    Measures how long each frame took to render from the times at which Blender saved them.
+
+    The first frame of each render run also includes Blender loading the scene, which the server already allows for
+    as batch overhead, so it is recorded as a 'first_frame' span. Its render time is measured from loaded(), when
+    Blender reports that it has started rendering; a run without that report keeps no time for its first frame.
+    """
+
+    def __init__(self, on_frame=None, job: str = '', batch: str = ''):
+        self.on_frame = on_frame
+        self.job = job
+        self.batch = batch
+        self.last = time.time()
+        self.first = True
+        self.rendering = None
+        self.frame_times = dict()
+
+    def start_run(self):
+        """Call just before each render starts."""
+        self.last = time.time()
+        self.first = True
+        self.rendering = None
+
+    def loaded(self):
+        """Call when the render has loaded the scene and started on the first frame."""
+        self.rendering = time.time()
+
+    def __call__(self, filepath: str):
+        now = time.time()
+        match = FRAME_PATTERN.search(filepath)
+        started = self.rendering if self.first else self.last
+        if match and started is not None:
+            self.frame_times[str(int(match.group(1)))] = round(now - started, 3)
+        telemetry.record('first_frame' if self.first else 'frame', self.last, now, self.job, self.batch)
+        telemetry.increment('frames_rendered_total')
+        self.last = now
+        self.first = False
+        if self.on_frame is not None:
+            self.on_frame(filepath)
+
+
+class BatchAbandoned(Exception):
+    """Raised from a render's frame callback when another copy of the batch has already completed it."""
+
+
+def timestamp() -> Decimal:
+    return Decimal(str(round(time.time(), 3)))
+
+
+class BatchProgress:
+    """
+    Reports how far a batch has got to its BatchTable item, at most every PROGRESS_INTERVAL seconds.
+
+    The watcher compares these heartbeats with the rest of the job to find stragglers and start speculative copies.
+    Each report is conditional on the batch still being in progress; once another copy has completed it, or the worker
+    is shutting down, the render is stopped by raising BatchAbandoned.
+    """
+
+    def __init__(self, job: str, start: str, end: str, on_frame=None, interval: float = PROGRESS_INTERVAL):
+        self.key = {'job': job, 'batch': batch_key(start, end)}
+        self.on_frame = on_frame
+        self.interval = interval
+        self.frames_done = 0
+        self.reported = 0
+
+    def _update(self, expression: str, values: dict) -> bool:
+        try:
+            batch_table.update_item(
+                Key=self.key,
+                UpdateExpression=expression,
+                ConditionExpression='batch_status = :processing',
+                ExpressionAttributeValues={':processing': 'Processing', **values}
+            )
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            return False
+        self.reported = time.time()
+        return True
+
+    def start(self) -> bool:
+        """Records the start of this copy of the batch; returns False if the batch is already complete."""
+        return self._update(
+            'set started_at = if_not_exists(started_at, :now), progress_at = :now, frames_done = :zero, '
+            'worker = :worker add attempts :one',
+            {':now': timestamp(), ':zero': 0, ':worker': MY_ID, ':one': 1}
+        )
+
+    def __call__(self, filepath: str):
+        if shutting_down.is_set():
+            raise BatchAbandoned('Worker is shutting down')
+        self.frames_done += 1
+        if time.time() - self.reported >= self.interval:
+            try:
+                reported = self._update('set progress_at = :now, frames_done = :done',
+                                        {':now': timestamp(), ':done': self.frames_done})
+            except botocore.exceptions.ClientError as e:
+                # A missed heartbeat only makes the batch look slower
+                print(f'Failed to report batch progress: {e}')
+                reported = True
+            if not reported:
+                raise BatchAbandoned(f'Batch {self.key["batch"]} was completed by another worker')
+        if self.on_frame is not None:
+            self.on_frame(filepath)
+
+
+def record_frame_times(blender_file: str, frame_times: dict):
+    """Stores per-frame render times so the server can size future batches for this file."""
+    if not frame_times:
+        return
+    try:
+        frame_time_table.update_item(
+            Key={'file': blender_file},
+            UpdateExpression='set frame_times = if_not_exists(frame_times, :empty)',
+            ExpressionAttributeValues={':empty': dict()}
+        )
+        names = {f'#f{frame}': frame for frame in frame_times}
+        values = {f':t{frame}': Decimal(str(t)) for frame, t in frame_times.items()}
+        frame_time_table.update_item(
+            Key={'file': blender_file},
+            UpdateExpression='set ' + ', '.join(f'frame_times.#f{frame} = :t{frame}' for frame in frame_times),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+    except botocore.exceptions.ClientError as e:
+        body = {'id': MY_ID, 'type': 'error', 'state': 'Recording frame times', 'message': str(e)}
+        logging_queue.send_message(MessageBody=json.dumps(body))
+
+
+def frame_files(directory: str) -> dict:
+    """The png frames in the directory, by frame number."""
+    frames = dict()
+    for filename in os.listdir(directory):
+        match = FRAME_PATTERN.search(filename)
+        if match:
+            frames[int(match.group(1))] = filename
+    return frames
+
+
+def uploaded_frames(scene: str, directory: str) -> dict:
+    """Render cache index entries of the frames in the directory, uploaded one object per frame."""
+    return {frame: {'key': cache_prefix(scene) + filename, 'bytes': os.path.getsize(directory + filename)}
+            for frame, filename in frame_files(directory).items()}
+
+
+def upload_bundle(scene: str, blender_file: str, start: str, end: str, directory: str, job: str = '',
+                  batch: str = '') -> dict:
+    """
+    Packs the frames in the directory into one tar object in the render cache, with a single PUT.
+
+    Returns the render cache index entries of the frames, with the offset and size of each frame's data in the tar
+    so it can be read back with a ranged GET.
+    """
+    files = frame_files(directory)
+    key = cache_prefix(scene) + blender_file[:-6] + '_%04d-%04d_%d.tar' % (int(start), int(end), MY_ID)
+    bundle_file = directory.rstrip('/') + '.tar'
+    with tarfile.open(bundle_file, 'w') as tar:
+        for frame in sorted(files):
+            tar.add(directory + files[frame], arcname=files[frame])
+    entries = dict()
+    with tarfile.open(bundle_file) as tar:
+        for member in tar.getmembers():
+            frame = int(FRAME_PATTERN.search(member.name).group(1))
+            entries[frame] = {'key': key, 'offset': member.offset_data, 'bytes': member.size}
+    try:
+        with telemetry.span('upload', job, batch, os.path.getsize(bundle_file)):
+            s3.upload_file(bundle_file, png_bucket_name, key)
+    finally:
+        cleanup(bundle_file, "")
+    return entries
+
+
+def frame_ref(entry: dict):
+    """Where stream_frames reads a cached frame from: its key, or (key, offset, size) inside a bundle."""
+    if 'offset' in entry:
+        return entry['key'], int(entry['offset']), int(entry['bytes'])
+    return entry['key']
+
+
+def record_cached_frames(scene: str, blender_file: str, frames: dict, checkpoints=None) -> bool:
+    """
+    Adds uploaded frames to the render cache index, and the size of those it added to the scene's and total usage.
+
+    frames: index entries by frame number, each with the S3 key and size, and the offset for bundled frames
+    checkpoints: the batch's FrameCheckpoints, whose checkpointed frames are accounted along with these
+    """
+    checkpoints = checkpoints or FrameCheckpoints(scene, blender_file)
+    try:
+        checkpoints.index(frames)
+    except botocore.exceptions.ClientError as e:
+        body = {'id': MY_ID, 'type': 'error', 'state': 'Recording cached frames', 'message': str(e)}
+        logging_queue.send_message(MessageBody=json.dumps(body))
+        return False
+    finally:
+        checkpoints.account()
+    return True
+
+
+def get_cached_frames(scene: str, start: str, end: str) -> dict:
+    """Returns the render cache index entries of the scene's cached frames in the range, by frame number."""
+    frames = dict()
+    kwargs = {'KeyConditionExpression': Key('scene').eq(scene) & Key('frame').between(int(start), int(end))}
+    while True:
+        response = cache_table.query(**kwargs)
+        frames.update((int(item['frame']), item) for item in response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return frames
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+class FrameCheckpoints:
+    """
+    Records each frame in the render cache index as soon as it has been uploaded, so that a retry of the batch, or a
+    speculative copy of it, only renders the frames that are still missing.
+
+    A frame is only indexed if it isn't already, so a frame uploaded by two copies of a batch is counted once. The
+    size of the frames this batch indexed is added to the scene's and total usage once, by account(), rather than
+    on every frame.
+    """
+
+    def __init__(self, scene: str, blender_file: str):
+        self.scene = scene
+        self.blender_file = blender_file
+        self.frames = set()
+        self.added_bytes = 0
+        self.lock = threading.Lock()
+
+    def index(self, frames: dict):
+        """Puts the frames into the render cache index, skipping those that are already in it."""
+        for frame, entry in frames.items():
+            try:
+                cache_table.put_item(
+                    Item={'scene': self.scene, 'frame': frame, **entry},
+                    ConditionExpression='attribute_not_exists(#frame)',
+                    ExpressionAttributeNames={'#frame': 'frame'}
+                )
+                added = entry['bytes']
+            except botocore.exceptions.ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                added = 0
+            with self.lock:
+                self.frames.add(frame)
+                self.added_bytes += added
+
+    def __call__(self, filepath: str, key: str):
+        """Checkpoints an uploaded frame; frames that fail here are indexed with the rest of the batch."""
+        frame = int(FRAME_PATTERN.search(filepath).group(1))
+        try:
+            self.index({frame: {'key': key, 'bytes': os.path.getsize(filepath)}})
+        except botocore.exceptions.ClientError as e:
+            print(f'Failed to checkpoint frame {frame}: {e}')
+
+    def account(self):
+        """Adds the size of the frames indexed since the last call to the scene's and total usage."""
+        with self.lock:
+            size, self.added_bytes = self.added_bytes, 0
+        if not size:
+            return
+        try:
+            cache_table.update_item(
+                Key={'scene': self.scene, 'frame': SUMMARY_FRAME},
+                UpdateExpression='set #file = :file, last_used = :now add #bytes :bytes',
+                ExpressionAttributeNames={'#file': 'file', '#bytes': 'bytes'},
+                ExpressionAttributeValues={':file': self.blender_file, ':now': int(time.time()), ':bytes': size}
+            )
+            cache_table.update_item(
+                Key={'scene': TOTAL_SCENE, 'frame': SUMMARY_FRAME},
+                UpdateExpression='add #bytes :bytes',
+                ExpressionAttributeNames={'#bytes': 'bytes'},
+                ExpressionAttributeValues={':bytes': size}
+            )
+        except botocore.exceptions.ClientError as e:
+            body = {'id': MY_ID, 'type': 'error', 'state': 'Recording render cache usage', 'message': str(e)}
+            logging_queue.send_message(MessageBody=json.dumps(body))
+
+
+def frame_runs(frames: list) -> list:
+    """Splits frame numbers into (start, end) runs of consecutive frames."""
+    runs = []
+    for frame in sorted(frames):
+        if runs and runs[-1][1] == frame - 1:
+            runs[-1] = (runs[-1][0], frame)
+        else:
+            runs.append((frame, frame))
+    return runs
+
+
+def restore_frames(blender_file: str, directory: str, frames: dict, job: str = '', batch: str = ''):
+    """Downloads cached frames into the directory, next to the ones just rendered, for encoding the segment."""
+    files = [directory + blender_file[:-6] + '%04d.png' % frame for frame in sorted(frames)]
+    refs = [frame_ref(frames[frame]) for frame in sorted(frames)]
+    with telemetry.span('download', job, batch):
+        for path, data in zip(files, stream_frames(s3, png_bucket_name, refs)):
+            with open(path, 'wb') as f:
+                f.write(data)
+
+
 def cleanup(filename: str, directory: str):
     try:
         if filename:
@@ -55,160 +553,592 @@ def cleanup(filename: str, directory: str):
         if directory:
             shutil.rmtree(directory)
     except Exception as e:
-        body = {'id': MY_ID, 'type': 'error', 'state': 'Clean up', 'message': e}
+        body = {'id': MY_ID, 'type': 'error', 'state': 'Clean up', 'message': str(e)}
         logging_queue.send_message(MessageBody=json.dumps(body))
 
 
-def render_job(blender_file: str, start: str, end: str) -> (bool, str):
-    """Completes a render job."""
-    log = ""
-
-    # Download the .blend file
+def fetch_scene(job: str, batch: str, blender_file: str, assets: list, log: str, work: str = '') -> (bool, str):
+    """Fetches the .blend file and its linked assets through the local cache into the work directory."""
     print('Downloading .blend file...')
     try:
-        s3.download_file(render_bucket_name, blender_file, blender_file)
+        for key in [blender_file, *assets]:
+            t = time.time()
+            with telemetry.span('download', job, batch) as span:
+                hit = blend_cache.fetch(render_bucket_name, key, work + key)
+                span['bytes'] = 0 if hit else os.path.getsize(work + key)
+            status = 'hit' if hit else 'miss'
+            telemetry.increment('cache_hits_total' if hit else 'cache_misses_total')
+            log += str(time.time()) + f",Cache {status} for {key} in {time.time() - t:.3f}s ({blend_cache.stats()})\n"
     except botocore.exceptions.ClientError as e:
-        body = {'id': MY_ID, 'type': 'error', 'state': 'Downloading blend file', 'message': e}
+        body = {'id': MY_ID, 'type': 'error', 'state': 'Downloading blend file', 'message': str(e)}
         logging_queue.send_message(MessageBody=json.dumps(body))
-        cleanup(blender_file, "")
-        return False
+        return False, log
     log += str(time.time()) + f",Downloaded file {blender_file} for render\n"
+    return True, log
+
+
+def render_job(job: str, blender_file: str, scene: str, start: str, end: str, assets: list = (),
+               work: str = '') -> (bool, str):
+    """
+    Completes a render job, rendering only the frames of the batch that aren't in the render cache yet.
 
-    # Render the animation
+    job: the id of the job the batch belongs to
+    scene: the render cache hash of the .blend file, its assets and the render settings
+    assets: keys of files in the render bucket that the .blend file links to, fetched alongside it
+    work: the task's own directory, which the caller removes afterwards
+    """
+    log = ""
+    batch = start + '-' + end
+
+    # A speculative copy may have been queued behind the original, or the other way round
+    progress = BatchProgress(job, start, end)
+    try:
+        started = progress.start()
+    except botocore.exceptions.ClientError as e:
+        body = {'id': MY_ID, 'type': 'error', 'state': 'Reporting batch progress', 'message': str(e)}
+        logging_queue.send_message(MessageBody=json.dumps(body))
+        started = True
+    if not started:
+        # Finishes the count if the copy that completed the batch failed to count it off the job
+        log = count_batch(job, blender_file, scene, start, end, log)
+        log += str(time.time()) + f",Skipped {blender_file} frames {start} to {end}, already completed\n"
+        return True, log
+
+    # Frames already in the render cache, from an earlier attempt at the batch or another copy of it
+    try:
+        done = get_cached_frames(scene, start, end)
+    except botocore.exceptions.ClientError as e:
+        body = {'id': MY_ID, 'type': 'error', 'state': 'Looking up cached frames', 'message': str(e)}
+        logging_queue.send_message(MessageBody=json.dumps(body))
+        done = dict()
+    runs = frame_runs(set(range(int(start), int(end) + 1)) - set(done))
+
+    success, log = fetch_scene(job, batch, blender_file, assets, log, work)
+    if not success:
+        return False, log
+
+    # Render the missing frames once a render slot is free, uploading and checkpointing each frame as soon as it is
+    # saved unless they are bundled afterwards
     print('Rendering animation...')
-    directory = blender_file[:-6] + '/'
+    directory = work + blender_file[:-6] + '/'
     os.mkdir(directory)
+    checkpoints = FrameCheckpoints(scene, blender_file)
+    try:
+        uploader = FrameUploader(s3, png_bucket_name, prefix=cache_prefix(scene), job=job, batch=batch,
+                                 on_uploaded=checkpoints)
+        progress.on_frame = None if BUNDLE_FRAMES else uploader.submit
+        try:
+            with render_slot(job, batch) as slot, telemetry.span('render', job, batch):
+                timer = FrameTimer(progress, job, batch)
+                for run_start, run_end in runs:
+                    timer.start_run()
+                    render(work + blender_file, str(run_start), str(run_end), on_frame=timer,
+                           output_path=directory + blender_file[:-6], slot=slot, on_start=timer.loaded)
+        except BatchAbandoned as e:
+            uploader.wait()
+            log += str(time.time()) + f",Abandoned {blender_file} frames {start} to {end}: {e}\n"
+            return True, log
+        except Exception as e:
+            uploader.wait()
+            body = {'id': MY_ID, 'type': 'error', 'state': 'Rendering animation', 'message': str(e)}
+            logging_queue.send_message(MessageBody=json.dumps(body))
+            return False, log
+        if done:
+            log += str(time.time()) + f",Restored {len(done)} cached {blender_file} frames of {start} to {end}\n"
+        log += str(time.time()) + f",Rendered animation {blender_file} frames {start} to {end}\n"
+        record_frame_times(blender_file, timer.frame_times)
+
+        print('Uploading frames to S3...')
+        if not runs:
+            uploader.wait()
+            frames = dict()
+        elif BUNDLE_FRAMES:
+            uploader.wait()
+            try:
+                frames = upload_bundle(scene, blender_file, start, end, directory, job, batch)
+            except Exception as e:
+                body = {'id': MY_ID, 'type': 'error', 'state': 'Uploading frame bundle to S3', 'message': str(e)}
+                logging_queue.send_message(MessageBody=json.dumps(body))
+                return False, log
+        else:
+            # Upload any frames that Blender didn't report, then wait for the upload tail
+            uploader.submit_directory(directory)
+            failed = uploader.retry_failed()
+            if failed:
+                for filepath, e in failed.items():
+                    body = {'id': MY_ID, 'type': 'error', 'state': f'Uploading frame {filepath} to S3',
+                            'message': str(e)}
+                    logging_queue.send_message(MessageBody=json.dumps(body))
+                return False, log
+            # Frames whose checkpoint failed are indexed with the rest of the batch
+            frames = {frame: entry for frame, entry in uploaded_frames(scene, directory).items()
+                      if frame not in checkpoints.frames}
+        log += str(time.time()) + f",Uploaded {blender_file} frames {start} to {end}\n"
+
+        # Encode the batch into a video segment while its frames are still on disk
+        print('Encoding segment...')
+        segment = segment_key(job, blender_file[:-6], start, end)
+        segment_file = work + os.path.basename(segment)
+        try:
+            if done:
+                restore_frames(blender_file, directory, done, job, batch)
+            with telemetry.span('encode_segment', job, batch):
+                sequence(blender_file[:-6], read_frames(directory), segment_file)
+            with telemetry.span('upload', job, batch, os.path.getsize(segment_file)):
+                s3.upload_file(segment_file, png_bucket_name, segment)
+            log += str(time.time()) + f",Encoded {blender_file} segment {start} to {end}\n"
+        except Exception as e:
+            # Not fatal: the sequence job falls back to encoding this batch's frames
+            body = {'id': MY_ID, 'type': 'error', 'state': 'Encoding segment', 'message': str(e)}
+            logging_queue.send_message(MessageBody=json.dumps(body))
+            segment = None
+
+        # Only the first copy of the batch to finish indexes its frames and counts the batch off the job
+        if not claim_batch(job, start, end, segment):
+            # Per-frame uploads share their keys with the winning copy; segments and bundles are this worker's own
+            keys = {segment} | {entry['key'] for entry in frames.values() if 'offset' in entry}
+            discard_outputs(sorted(key for key in keys if key))
+            log += str(time.time()) + f",Discarded {blender_file} frames {start} to {end}, already completed\n"
+        elif not record_cached_frames(scene, blender_file, frames, checkpoints):
+            release_batch(job, start, end)
+            return False, log
+        else:
+            log = count_batch(job, blender_file, scene, start, end, log)
+        return True, log
+    finally:
+        # Frames checkpointed by a copy that lost, failed or was abandoned are in the index all the same
+        checkpoints.account()
+
+
+def tile_key(job: str, filename: str, frame: str, tile: int) -> str:
+    """The S3 key of a rendered tile; filename is without the .blend extension."""
+    return job + '/tiles/' + filename + '_%04d_tile%02d.png' % (int(frame), tile)
+
+
+def tile_job(job: str, blender_file: str, scene: str, frame: str, tile: int, grid: list,
+             assets: list = (), work: str = '') -> (bool, str):
+    """
+    Renders one tile of a frame. The worker that finishes the frame's last tile stitches the frame.
+
+    grid: [rows, cols] of the frame's tiles
+    work: the task's own directory, which the caller removes afterwards
+    """
+    log = ""
+    rows, cols = grid
+    batch = frame + '-' + frame
+
+    success, log = fetch_scene(job, batch, blender_file, assets, log, work)
+    if not success:
+        return False, log
+
+    # Render the tile's region of the frame
+    print(f'Rendering tile {tile} of frame {frame}...')
+    directory = work + blender_file[:-6] + '/'
+    tiles_directory = directory + 'tiles/'
+    os.makedirs(tiles_directory)
+    output_path = tiles_directory + blender_file[:-6] + '_tile%02d_' % tile
+    tile_file = output_path + '%04d.png' % int(frame)
+    try:
+        with render_slot(job, batch) as slot, telemetry.span('render', job, batch):
+            started = time.time()
+            render(work + blender_file, frame, frame, border=tile_border(tile, rows, cols), output_path=output_path,
+                   slot=slot)
+            render_seconds = time.time() - started
+        with telemetry.span('upload', job, batch, os.path.getsize(tile_file)):
+            s3.upload_file(tile_file, png_bucket_name, tile_key(job, blender_file[:-6], frame, tile))
+    except Exception as e:
+        body = {'id': MY_ID, 'type': 'error', 'state': f'Rendering tile {tile} of frame {frame}', 'message': str(e)}
+        logging_queue.send_message(MessageBody=json.dumps(body))
+        return False, log
+    log += str(time.time()) + f",Rendered {blender_file} frame {frame} tile {tile}\n"
+    # Stored as the whole frame's cost, so the server keeps sizing work by frame
+    record_frame_times(blender_file, {str(int(frame)): round(render_seconds * rows * cols, 3)})
+
+    # Count the tile off the frame; the set makes a redelivered tile count once, and the condition keeps a tile that
+    # arrives after the job's batches were deleted from creating a stray item
+    try:
+        response = batch_table.update_item(
+            Key={'job': job, 'batch': batch_key(frame, frame)},
+            UpdateExpression='add tiles_done :tile',
+            ConditionExpression='attribute_exists(batch_status)',
+            ExpressionAttributeValues={':tile': {str(tile)}},
+            ReturnValues='ALL_NEW'
+        )
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        log += str(time.time()) + f",Skipped {blender_file} frame {frame} tile {tile}, job already finished\n"
+        return True, log
+    item = response['Attributes']
+    if len(item['tiles_done']) == rows * cols and item['batch_status'] == 'Processing':
+        success, log = stitch_frame(job, blender_file, scene, frame, rows, cols, directory, log)
+        if not success:
+            return False, log
+    elif len(item['tiles_done']) == rows * cols:
+        # The frame is stitched; finishes the count if the stitching worker failed to count it off the job
+        log = count_batch(job, blender_file, scene, frame, frame, log)
+    return True, log
+
+
+def stitch_frame(job: str, blender_file: str, scene: str, frame: str, rows: int, cols: int, directory: str,
+                 log: str) -> (bool, str):
+    """Downloads a frame's tiles, stitches them into the frame and completes the frame's batch."""
+    print(f'Stitching frame {frame}...')
+    keys = [tile_key(job, blender_file[:-6], frame, tile) for tile in range(rows * cols)]
+    files = [directory + 'tiles/' + os.path.basename(key) for key in keys]
+    frame_file = directory + blender_file[:-6] + '%04d.png' % int(frame)
     try:
-        render(blender_file, start, end)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda k, f: s3.download_file(png_bucket_name, k, f), keys, files))
+        with telemetry.span('stitch', job, frame + '-' + frame):
+            stitch(files, rows, cols, frame_file)
+        s3.upload_file(frame_file, png_bucket_name, cache_prefix(scene) + os.path.basename(frame_file))
     except Exception as e:
-        body = {'id': MY_ID, 'type': 'error', 'state': 'Rendering animation', 'message': e}
+        body = {'id': MY_ID, 'type': 'error', 'state': f'Stitching frame {frame}', 'message': str(e)}
+        logging_queue.send_message(MessageBody=json.dumps(body))
+        return False, log
+    if not record_cached_frames(scene, blender_file, uploaded_frames(scene, directory)):
+        return False, log
+    log += str(time.time()) + f",Stitched {blender_file} frame {frame} from {rows * cols} tiles\n"
+    if claim_batch(job, frame, frame, None):
+        log = count_batch(job, blender_file, scene, frame, frame, log)
+    try:
+        s3.delete_objects(Bucket=png_bucket_name, Delete={'Objects': [{'Key': key} for key in keys]})
+    except botocore.exceptions.ClientError as e:
+        body = {'id': MY_ID, 'type': 'error', 'state': 'Deleting tiles', 'message': str(e)}
         logging_queue.send_message(MessageBody=json.dumps(body))
-        cleanup(blender_file, directory)
+    return True, log
+
+
+def claim_batch(job: str, start: str, end: str, segment: str) -> bool:
+    """
+    Marks a batch complete, with its segment; returns False if it was already complete.
+
+    The condition on the batch status makes the first copy of a batch to finish, whether redelivered or speculative,
+    the only one whose output is used.
+    """
+    update = 'set batch_status = :complete, completed_at = :now'
+    values = {':complete': 'Complete', ':processing': 'Processing', ':now': timestamp()}
+    if segment:
+        update += ', segment = :segment'
+        values[':segment'] = segment
+    try:
+        batch_table.update_item(
+            Key={'job': job, 'batch': batch_key(start, end)},
+            UpdateExpression=update,
+            ConditionExpression='batch_status = :processing',
+            ExpressionAttributeValues=values
+        )
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
         return False
-    log += str(time.time()) + f",Rendered animation {blender_file} frames {start} to {end}\n"
+    return True
 
-    # Upload output frames to S3
-    print('Uploading frames to S3...')
-    directory = blender_file[:-6] + '/'
-    for filename in os.listdir(directory):
-        filepath = os.path.join(directory, filename)
-        try:
-            s3.upload_file(filepath, png_bucket_name, filename)
-        except botocore.exceptions.ClientError as e:
-            body = {'id': MY_ID, 'type': 'error', 'state': 'Uploading frames to S3', 'message': e}
-            logging_queue.send_message(MessageBody=json.dumps(body))
-            cleanup(blender_file, directory)
-            return False
-    log += str(time.time()) + f",Uploaded {blender_file} frames {start} to {end}\n"
-
-    # Update batch status in the DynamoDB table
-    batch = "#" + start + '_' + end
-    response = job_table.update_item(
-        Key={'file': blender_file},
-        UpdateExpression=f'set batches.{batch} = :status',
-        ExpressionAttributeNames={batch: start + '-' + end},
-        ExpressionAttributeValues={':status': 'Complete'},
-        ReturnValues='ALL_NEW'
+
+def release_batch(job: str, start: str, end: str):
+    """Returns a claimed batch to Processing, so a retry of it can complete it."""
+    batch_table.update_item(
+        Key={'job': job, 'batch': batch_key(start, end)},
+        UpdateExpression='set batch_status = :processing remove completed_at, segment',
+        ExpressionAttributeValues={':processing': 'Processing'}
     )
 
+
+def discard_outputs(keys: list):
+    """Deletes the objects a losing copy of a batch uploaded under its own keys."""
+    if not keys:
+        return
+    try:
+        s3.delete_objects(Bucket=png_bucket_name, Delete={'Objects': [{'Key': key} for key in keys]})
+    except botocore.exceptions.ClientError as e:
+        body = {'id': MY_ID, 'type': 'error', 'state': 'Discarding batch outputs', 'message': str(e)}
+        logging_queue.send_message(MessageBody=json.dumps(body))
+
+
+def count_batch(job: str, blender_file: str, scene: str, start: str, end: str, log: str) -> str:
+    """
+    Counts a completed batch off the job, sending the sequence job once every batch is done.
+
+    The batch is added to the job's counted set in the same update, so a batch is only ever counted once: a copy that
+    finds the batch already complete calls this again, which finishes a count that failed after the batch was claimed.
+    """
+    batch = start + '-' + end
+    dynamodb_start = time.time()
+    try:
+        response = job_table.update_item(
+            Key={'job': job},
+            UpdateExpression='set remaining = remaining - :one add counted :batches',
+            ConditionExpression='attribute_exists(remaining) and not contains(counted, :batch)',
+            ExpressionAttributeValues={':one': 1, ':batches': {batch_key(start, end)}, ':batch': batch_key(start, end)},
+            ReturnValues='ALL_NEW'
+        )
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return log
+
     # Check if the whole job is complete
-    if not ('Processing' in response['Attributes']['batches'].values()):
+    if response['Attributes']['remaining'] == 0:
         # Update the job status
         job_table.update_item(
-            Key={'file': blender_file},
+            Key={'job': job},
             UpdateExpression=f'set job_status = :status',
             ExpressionAttributeValues={
                 ':status': 'Processing'
             }
         )
 
-        # Send a sequence job to SQS
+        # Send a sequence job to SQS at high priority: it only needs an I/O thread, not a render slot, and finishing a
+        # job whose frames are all rendered comes before starting new ones
         job_range = response['Attributes']['range'].split('-')
-        job = {'type': 'sequence', 'file': blender_file, 'start': job_range[0], 'end': job_range[1]}
-        job_queue.send_message(MessageBody=json.dumps(job))
+        body = {'type': 'sequence', 'job': job, 'file': blender_file, 'scene': scene,
+                'start': job_range[0], 'end': job_range[1]}
+        job_queues['high'].send_message(MessageBody=json.dumps(body))
         log += str(time.time()) + f",Submitted {blender_file} sequence job\n"
+    telemetry.record('dynamodb_update', dynamodb_start, time.time(), job, batch)
+    return log
 
-    # Cleanup directory
-    print('Cleaning up...')
-    cleanup(blender_file, directory)
-    return True, log
 
+def get_batches(job: str) -> list:
+    """Returns all of the job's batch items in frame order."""
+    batches = []
+    kwargs = {'KeyConditionExpression': Key('job').eq(job)}
+    while True:
+        response = batch_table.query(**kwargs)
+        batches.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return batches
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
 
-def sequence_job(blender_file: str, start: str, end: str) -> (bool, str):
-    """Completes a sequence job."""
-    log = ""
 
-    # Download the output files
-    print('Downloading frames...')
-    directory = blender_file[:-6] + '/'
-    os.mkdir(directory)
-    for i in range(int(start), int(end) + 1):
-        try:
-            filename = blender_file[:-6] + "%04d.png" % i
-            s3.download_file(png_bucket_name, filename, filename)
-            shutil.move(filename, directory + filename)
-        except botocore.exceptions.ClientError as e:
-            body = {'id': MY_ID, 'type': 'error', 'state': 'Downloading frames from S3', 'message': e}
-            logging_queue.send_message(MessageBody=json.dumps(body))
-            cleanup("", directory)
-            return False
-    log += str(time.time()) + f",Downloaded {blender_file} frames for sequencing\n"
+def rerender_frames(job: str, blender_file: str, scene: str, frames: list, batches: list, log: str) -> str:
+    """
+    Sends render batches for frames evicted from the render cache before the job was sequenced.
+
+    The job waits for the new batches again, and the last of them to complete sends a new sequence job. After
+    MAX_RERENDERS rounds the job is marked failed instead, so frames that keep disappearing can't loop forever.
+    batches: the job's current batch items; a new batch with the same frames replaces one of them
+    """
+    ranges = [(s, min(s + RERENDER_BATCH_FRAMES - 1, run_end)) for run_start, run_end in frame_runs(frames)
+              for s in range(run_start, run_end + 1, RERENDER_BATCH_FRAMES)]
+    existing = {batch['batch'] for batch in batches}
+    keys = {batch_key(s, e) for s, e in ranges}
+    try:
+        # A new batch that replaces one of the job's batches is taken out of the counted set, so it can be counted again
+        response = job_table.update_item(
+            Key={'job': job},
+            UpdateExpression='set job_status = :waiting, remaining = remaining + :batches, '
+                             'n_batches = n_batches + :added add rerenders :one delete counted :keys',
+            ConditionExpression='attribute_not_exists(rerenders) or rerenders < :max',
+            ExpressionAttributeValues={':waiting': 'Waiting', ':batches': len(ranges), ':added': len(keys - existing),
+                                       ':one': 1, ':max': MAX_RERENDERS, ':keys': keys},
+            ReturnValues='ALL_NEW'
+        )
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        job_table.update_item(
+            Key={'job': job},
+            UpdateExpression='set job_status = :status',
+            ExpressionAttributeValues={':status': 'Failed'}
+        )
+        body = {'id': MY_ID, 'type': 'error', 'state': 'Sequencing images',
+                'message': f'{job} failed: {len(frames)} frames left the render cache {MAX_RERENDERS} times'}
+        logging_queue.send_message(MessageBody=json.dumps(body))
+        return log + str(time.time()) + f",Failed {blender_file}, frames missing from the render cache\n"
+
+    with batch_table.batch_writer() as writer:
+        for s, e in ranges:
+            writer.put_item(Item={'job': job, 'batch': batch_key(s, e), 'start': str(s), 'end': str(e),
+                                  'batch_status': 'Processing'})
+    jobs = [{'type': 'render', 'job': job, 'file': blender_file, 'scene': scene, 'start': str(s), 'end': str(e)}
+            for s, e in ranges]
+    for message in jobs:
+        if response['Attributes'].get('assets'):
+            message['assets'] = response['Attributes']['assets']
+        job_queues['high'].send_message(MessageBody=json.dumps(message))
+    return log + str(time.time()) + f",Re-rendering {len(frames)} {blender_file} frames missing from the cache\n"
+
 
-    # Sequence the images
+def sequence_frames(job: str, blender_file: str, keys: list, start: str, end: str, log: str,
+                    work: str = '') -> (bool, str):
+    """Encodes the mp4 by streaming the given frames from the render cache into ffmpeg."""
     print('Sequencing images...')
     try:
-        sequence(blender_file[:-6])
+        with telemetry.span('sequence', job, start + '-' + end):
+            sequence(blender_file[:-6], stream_frames(s3, png_bucket_name, keys), work + job + '.mp4')
+    except botocore.exceptions.ClientError as e:
+        body = {'id': MY_ID, 'type': 'error', 'state': 'Downloading frames from S3', 'message': str(e)}
+        logging_queue.send_message(MessageBody=json.dumps(body))
+        return False, log
     except Exception as e:
-        body = {'id': MY_ID, 'type': 'error', 'state': 'Sequencing images', 'message': e}
+        body = {'id': MY_ID, 'type': 'error', 'state': 'Sequencing images', 'message': str(e)}
         logging_queue.send_message(MessageBody=json.dumps(body))
-        cleanup(blender_file[:-6] + '.mp4', directory)
-        return False
+        return False, log
+    log += str(time.time()) + f",Sequenced {blender_file}\n"
+    return True, log
+
+
+def concat_segments(job: str, blender_file: str, keys: list, log: str, work: str = '',
+                    batch: str = '') -> (bool, str):
+    """Builds the mp4 from the per-batch segments, given as S3 keys in frame order, with a stream copy."""
+    print('Concatenating segments...')
+    directory = work + job + '_segments/'
+    os.mkdir(directory)
+    files = [directory + os.path.basename(key) for key in keys]
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda k, f: s3.download_file(png_bucket_name, k, f), keys, files))
+        with telemetry.span('sequence', job, batch):
+            concat(files, work + job + '.mp4')
+    except Exception as e:
+        body = {'id': MY_ID, 'type': 'error', 'state': 'Concatenating segments', 'message': str(e)}
+        logging_queue.send_message(MessageBody=json.dumps(body))
+        return False, log
     log += str(time.time()) + f",Sequenced {blender_file}\n"
+    return True, log
+
+
+def sequence_job(job: str, blender_file: str, scene: str, start: str, end: str, work: str = '') -> (bool, str):
+    """
+    Completes a sequence job; the video is uploaded as <job>.mp4.
+
+    work: the task's own directory, which the caller removes afterwards
+    """
+    log = ""
+
+    # Join the batch segments if the batches rendered every frame and each has a segment, otherwise encode all the
+    # frames from the render cache
+    batches = get_batches(job)
+    rendered = sum(int(batch['end']) - int(batch['start']) + 1 for batch in batches)
+    if rendered == int(end) - int(start) + 1 and all('segment' in batch for batch in batches):
+        success, log = concat_segments(job, blender_file, [batch['segment'] for batch in batches], log, work,
+                                       start + '-' + end)
+    else:
+        try:
+            frames = get_cached_frames(scene, start, end)
+        except botocore.exceptions.ClientError as e:
+            body = {'id': MY_ID, 'type': 'error', 'state': 'Looking up cached frames', 'message': str(e)}
+            logging_queue.send_message(MessageBody=json.dumps(body))
+            return False, log
+        missing = [frame for frame in range(int(start), int(end) + 1) if frame not in frames]
+        if missing:
+            # Retrying this message can't bring the frames back; the batches that re-render them sequence the job
+            return True, rerender_frames(job, blender_file, scene, missing, batches, log)
+        keys = [frame_ref(frames[frame]) for frame in range(int(start), int(end) + 1)]
+        success, log = sequence_frames(job, blender_file, keys, start, end, log, work)
+    if not success:
+        return False, log
 
     # Upload mp4 file to S3
     print('Uploading mp4 files...')
-    mp4_file = blender_file[:-6] + '.mp4'
+    mp4_file = job + '.mp4'
     try:
-        s3.upload_file(mp4_file, render_bucket_name, mp4_file)
+        with telemetry.span('upload', job, start + '-' + end, os.path.getsize(work + mp4_file)):
+            s3.upload_file(work + mp4_file, render_bucket_name, mp4_file)
     except botocore.exceptions.ClientError as e:
-        body = {'id': MY_ID, 'type': 'error', 'state': 'Uploading mp4 file to S3', 'message': e}
+        body = {'id': MY_ID, 'type': 'error', 'state': 'Uploading mp4 file to S3', 'message': str(e)}
         logging_queue.send_message(MessageBody=json.dumps(body))
-        cleanup(mp4_file, directory)
-        return False
+        return False, log
     log += str(time.time()) + f",Uploaded {blender_file} mp4\n"
-
-    # Cleanup local directory
-    print('Cleaning up...')
-    cleanup(mp4_file, directory)
     return True, log
 
 
+def run_task(consumer: JobConsumer, message, free_threads: threading.Semaphore):
+    """
+    Runs one message's job in its own work directory, then reports and acknowledges it.
+
+    Whatever fails, the thread is released and the message is finished, so it is never held without being worked on.
+    """
+    success, log = False, ""
+    work = None
+    try:
+        job = json.loads(message.body)
+        print('Received job: ')
+        print(job)
+        job_id = job['job']
+        filename = job['file']
+        start_frame = job['start']
+        end_frame = job['end']
+        work = tempfile.mkdtemp(prefix='task-', dir=WORK_DIR) + '/'
+        try:
+            if job['type'] == 'render':
+                success, log = render_job(job_id, filename, job['scene'], start_frame, end_frame,
+                                          job.get('assets', []), work)
+            elif job['type'] == 'tile':
+                success, log = tile_job(job_id, filename, job['scene'], start_frame, job['tile'], job['grid'],
+                                        job.get('assets', []), work)
+            else:
+                success, log = sequence_job(job_id, filename, job['scene'], start_frame, end_frame, work)
+        except Exception as e:
+            body = {'id': MY_ID, 'type': 'error', 'state': f'Running {job["type"]} job', 'message': str(e)}
+            logging_queue.send_message(MessageBody=json.dumps(body))
+            success, log = False, ""
+        # Only this task's spans, and those of no job such as Blender start-ups; concurrent tasks drain their own
+        log += telemetry.drain(job_id, start_frame + '-' + end_frame) + telemetry.drain('')
+        telemetry.increment('jobs_completed_total' if success else 'jobs_failed_total')
+        body = {'id': MY_ID, 'type': 'log', 'success': success, 'message': log}
+        logging_queue.send_message(MessageBody=json.dumps(body))
+        if success:
+            print('Completed job: ')
+            print(job)
+    except Exception as e:
+        # A job that succeeded is still acknowledged if only its report failed
+        body = {'id': MY_ID, 'type': 'error', 'state': 'Running job', 'message': f'{message.body}: {e}'}
+        try:
+            logging_queue.send_message(MessageBody=json.dumps(body))
+        except Exception as e:
+            print(f'Failed to report job error: {e}')
+    finally:
+        print('Cleaning up...')
+        if work is not None:
+            cleanup("", work)
+        free_threads.release()
+        try:
+            # After SIGTERM the message has been released to other pods, and its receipt handle may be stale
+            if not shutting_down.is_set():
+                consumer.finish(message, success)
+        except Exception as e:
+            print(f'Failed to finish message: {e}')
+
+
 def main():
     print('Starting worker node...')
-    body = {'id': MY_ID, 'type': 'log', 'success': True, 'message': 'Started running'}
+    body = {'id': MY_ID, 'type': 'log', 'success': True,
+            'message': f'Started running with {RENDER_SLOTS} render slots of {RENDER_THREADS} threads'}
     logging_queue.send_message(MessageBody=json.dumps(body))
 
-    running = True
-    while running:
-        message = job_queue.receive_messages(MaxNumberOfMessages=1)
-        if message:
-            job = json.loads(message[0].body)
-            print('Received job: ')
-            print(job)
-            receipt_handle = message[0].receipt_handle
-            filename = job['file']
-            start_frame = job['start']
-            end_frame = job['end']
-            process_job = render_job if job['type'] == 'render' else sequence_job
-            success, log = process_job(filename, start_frame, end_frame)
-            body = {'id': MY_ID, 'type': 'log', 'success': success, 'message': log}
-            logging_queue.send_message(MessageBody=json.dumps(body))
-            if success:
-                sqs_client.delete_message(QueueUrl=job_queue.url, ReceiptHandle=receipt_handle)
-                print('Completed job: ')
-                print(job)
-        else:
-            time.sleep(10)
+    # The scaler sizes the deployment by render slots, not pods
+    telemetry.set_gauge('render_slots', RENDER_SLOTS)
+    telemetry.serve()
+    os.makedirs(WORK_DIR, exist_ok=True)
+    consumer = JobConsumer(list(job_queues.values()), sqs_client)
+    consumer.start()
+
+    # Render slots limit the concurrent renders; the extra threads keep the slots busy while other jobs download,
+    # upload and sequence. A message is only received once a thread is free to run it.
+    threads = RENDER_SLOTS + IO_WORKERS
+    free_threads = threading.Semaphore(threads)
+    messages = iter(consumer)
+    executor = ThreadPoolExecutor(max_workers=threads)
+    try:
+        while free_threads.acquire():
+            message = next(messages, None)
+            if message is None:
+                break
+            executor.submit(run_task, consumer, message, free_threads)
+    except SystemExit:
+        # SIGTERM: every held message is made visible again, so other pods will render them. The in-flight tasks
+        # are abandoned rather than waited for, and exiting ends their renders.
+        shutting_down.set()
+        consumer.release_all()
+        executor.shutdown(wait=False)
+        for render_server in render_servers:
+            render_server.stop()
+        sys.stdout.flush()
+        os._exit(0)
+    executor.shutdown()
 
 
 if __name__ == '__main__':